@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+""" Measure how many logins per second and per core bcrypt allows.
+
+    usage: python benchmarks/bcrypt_logins.py [--rounds 10 12] [--logins 64]
+
+    Each login is one password check. The checks run first inline on the
+    calling thread, then through event_plaza.passwords.PasswordHasher with
+    one worker per core, fed by as many client threads as there are cores.
+"""
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from event_plaza.passwords import PasswordHasher, _hash  # noqa: E402
+
+
+def run(hasher, hashed, logins, clients):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(clients) as pool:
+        results = list(pool.map(lambda _: hasher.check(hashed, 'correct horse'), range(logins)))
+    assert all(results)
+    return logins / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--rounds', type=int, nargs='+', default=[10, 12])
+    parser.add_argument('--logins', type=int, default=64)
+    args = parser.parse_args()
+    cores = os.cpu_count()
+
+    print('{:>6} {:>8} {:>8} {:>12} {:>16}'.format(
+        'rounds', 'mode', 'workers', 'logins/s', 'logins/s/core'))
+    for rounds in args.rounds:
+        hashed = _hash('correct horse', rounds)
+        for mode, workers, clients in (('inline', 0, 1), ('pool', cores, cores)):
+            hasher = PasswordHasher(rounds, workers, max_pending=args.logins)
+            rate = run(hasher, hashed, args.logins, clients)
+            hasher.shutdown()
+            print('{:>6} {:>8} {:>8} {:>12.1f} {:>16.1f}'.format(
+                rounds, mode, max(workers, 1), rate, rate / max(workers, 1)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+""" Fill an empty database with a reproducible synthetic data set.
+
+    usage: python benchmarks/datagen.py [--url sqlite:///...] [--scale small|medium|large]
+                                        [--users N] [--events N] [--tasks N] [--seed 1]
+
+    Creates the schema, then users, events with their organizers, managers
+    and attendees, committees with their heads, vices and members, and
+    tasks. Tasks are spread unevenly (a few events hold most of them) over
+    the last 180 days, in every status. The same seed gives the same data
+    set; only the keys, which come from the configured strategy
+    (EVENTPLAZA_KEYS), differ between runs.
+
+    User n signs in as user<n>@bench.example.com with PASSWORD and owns
+    the events n, n + users, n + 2 * users, ... The event summaries are
+    rebuilt at the end; --search also fills the search index.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import itertools
+from datetime import datetime, timedelta
+from flask import current_app
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from event_plaza import create_app, db  # noqa: E402
+from event_plaza import activity, search  # noqa: E402
+from event_plaza.models import User, Event, Task, Committee  # noqa: E402
+from event_plaza.models.event_tables import (event_organizers, event_managers,  # noqa: E402
+                                             event_attendens)
+from event_plaza.models.committee import (committee_head, committee_vice,  # noqa: E402
+                                          committee_member)
+from event_plaza.models.keys import new_id  # noqa: E402
+from event_plaza.passwords import _hash  # noqa: E402
+
+PASSWORD = 'benchmark'
+SCALES = {
+    'small': {'users': 200, 'events': 200, 'tasks': 20000},
+    'medium': {'users': 2000, 'events': 2000, 'tasks': 200000},
+    'large': {'users': 20000, 'events': 10000, 'tasks': 1000000},
+}
+WORDS = ('stadium water volunteer badge stage sound light ticket sponsor press catering '
+         'security parking shuttle banner speaker hotel flight visa booth wifi power '
+         'signage medal registration printing budget invoice contract permit').split()
+STATUSES = ('new', 'review', 'done')
+STATUS_WEIGHTS = (0.5, 0.2, 0.3)
+
+
+def email(number):
+    """ Return the email of the nth generated user """
+    return 'user{}@bench.example.com'.format(number)
+
+
+def event_name(number):
+    """ Return the name of the nth generated event """
+    return 'Bench Event {}'.format(number)
+
+
+class Writer():
+    """ Inserts rows in batches, one transaction each, parents first """
+
+    def __init__(self, batch):
+        self.batch = batch
+        self.pending = {}
+        self.counts = {}
+
+    def add(self, table, row):
+        rows = self.pending.setdefault(table, [])
+        rows.append(row)
+        if len(rows) == self.batch:
+            self.flush(table)
+
+    def flush(self, table=None):
+        """ Write the rows of a table (default: all), and of the tables it
+            may reference before them
+        """
+        for parent in db.metadata.sorted_tables:
+            rows = self.pending.pop(parent, [])
+            if rows:
+                db.session.execute(parent.insert(), rows)
+                db.session.commit()
+                self.counts[parent.name] = self.counts.get(parent.name, 0) + len(rows)
+            if parent is table:
+                return
+
+
+def _text(rng, words):
+    return ' '.join(rng.choices(WORDS, k=words))
+
+
+def generate(users, events, tasks, seed=1, batch=5000, index_search=False):
+    """ Fill the app's (empty) database, return {table: rows} """
+    rng = random.Random(seed)
+    now = datetime.now().replace(microsecond=0)
+    writer = Writer(batch)
+    # Hashing once keeps a large data set quick to build
+    password = _hash(PASSWORD, current_app.config.get('BCRYPT_LOG_ROUNDS', 12))
+
+    user_ids = []
+    for number in range(users):
+        user_ids.append(new_id())
+        joined = now - timedelta(days=rng.uniform(0, 365))
+        writer.add(User.__table__, {
+            'id': user_ids[-1], 'first_name': 'User', 'last_name': str(number),
+            'email': email(number), 'password': password, 'is_confirmed': True,
+            'image_file': 'default.jpg', 'email_token': 'NOT INIT',
+            'created_at': joined, 'updated_at': joined})
+
+    event_ids = []
+    for number in range(events):
+        event_ids.append(new_id())
+        created = now - timedelta(days=rng.uniform(0, 365))
+        writer.add(Event.__table__, {
+            'id': event_ids[-1], 'name': event_name(number), 'description': _text(rng, 20),
+            'location': 'Cairo', 'date': (created + timedelta(days=60)).strftime('%Y-%m-%d'),
+            'time': '10:00', 'image_file': 'event_default.jpg',
+            'created_at': created, 'updated_at': created})
+        owner = user_ids[number % users]
+        organizers = {owner, *rng.sample(user_ids, min(users, rng.randint(0, 3)))}
+        managers = {owner, *rng.sample(user_ids, min(users, rng.randint(0, 2)))}
+        attendees = set(rng.sample(user_ids, min(users, rng.randint(0, 20)))) - organizers
+        for table, members in ((event_organizers, organizers), (event_managers, managers),
+                               (event_attendens, attendees)):
+            for user_id in members:
+                writer.add(table, {'event_id': event_ids[-1], 'user_id': user_id})
+        for _ in range(rng.randint(0, 5)):
+            committee_id = new_id()
+            writer.add(Committee.__table__, {
+                'id': committee_id, 'event_id': event_ids[-1], 'name': _text(rng, 2).title(),
+                'description': _text(rng, 12), 'created_at': created, 'updated_at': created})
+            staff = rng.sample(user_ids, min(users, rng.randint(1, 10)))
+            for table, members in ((committee_head, staff[:1]), (committee_vice, staff[1:2]),
+                                   (committee_member, staff[2:])):
+                for user_id in members:
+                    writer.add(table, {'committee_id': committee_id, 'user_id': user_id})
+
+    # A long tail: the biggest events hold a large share of the tasks
+    weights = list(itertools.accumulate(1 / (rank + 10) for rank in range(events)))
+    for _ in range(tasks):
+        created = now - timedelta(seconds=rng.uniform(0, 180 * 86400))
+        status = rng.choices(STATUSES, STATUS_WEIGHTS)[0]
+        reviewed = created + timedelta(seconds=rng.uniform(0, 7 * 86400)) \
+            if status != 'new' else created
+        writer.add(Task.__table__, {
+            'id': new_id(), 'event_id': rng.choices(event_ids, cum_weights=weights)[0],
+            'name': _text(rng, 3).capitalize(), 'description': _text(rng, rng.randint(5, 40)),
+            'status': status, 'created_at': created, 'updated_at': reviewed,
+            'reviewed_at': reviewed})
+    writer.flush()
+
+    activity.rebuild()
+    if index_search:
+        writer.counts['search_documents'] = search.reindex()
+    return writer.counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--url', help='Empty database to fill (default: a temporary SQLite file)')
+    parser.add_argument('--scale', choices=SCALES, default='small')
+    parser.add_argument('--users', type=int)
+    parser.add_argument('--events', type=int)
+    parser.add_argument('--tasks', type=int)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--search', action='store_true', help='Also fill the search index')
+    args = parser.parse_args()
+    sizes = dict(SCALES[args.scale])
+    sizes.update({name: getattr(args, name) for name in sizes if getattr(args, name)})
+    url = args.url or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': url})
+    with app.app_context():
+        db.create_all()
+        start = time.perf_counter()
+        counts = generate(seed=args.seed, batch=args.batch_size, index_search=args.search,
+                          **sizes)
+        elapsed = time.perf_counter() - start
+    for table, count in sorted(counts.items()):
+        print('{:<20} {:>10}'.format(table, count))
+    print('Filled {} in {:.0f} s; sign in as {} / {}'.format(url, elapsed, email(0), PASSWORD))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+""" Measure what idle live dashboards cost a process.
+
+    usage: python benchmarks/live.py [--streams 10000] [--events 100]
+
+    Opens --streams SSE streams on the in-process hub, spread over --events
+    channels, and reports the memory each idle stream holds (its queue,
+    subscription and suspended generator; not the socket nor the greenlet
+    or thread serving it) and how long publishing a message to one event's
+    dashboards and to every dashboard takes.
+"""
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from event_plaza import live  # noqa: E402
+
+MESSAGE = {'type': 'task.moved', 'previous': 'new',
+           'task': {'id': '0190c6a0-6f2b-7c3e-8b1a-3f4d5e6a7b8c', 'name': 'Book the stadium',
+                    'status': 'review', 'created_at': '2024-07-01T10:00:00'}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--streams', type=int, default=10000)
+    parser.add_argument('--events', type=int, default=100)
+    args = parser.parse_args()
+
+    hub = live.MemoryHub()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    streams = []
+    for number in range(args.streams):
+        stream = live.stream(hub, str(number % args.events))
+        next(stream)
+        streams.append(stream)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    print('{} idle streams: {:.1f} MB, {:.0f} bytes each'.format(
+        args.streams, size / 2 ** 20, size / args.streams))
+
+    start = time.perf_counter()
+    hub.publish('0', MESSAGE)
+    print('publish to one event ({} dashboards): {:.3f} ms'.format(
+        args.streams // args.events, 1000 * (time.perf_counter() - start)))
+    start = time.perf_counter()
+    for channel in range(args.events):
+        hub.publish(str(channel), MESSAGE)
+    print('publish to every event ({} dashboards): {:.1f} ms'.format(
+        args.streams, 1000 * (time.perf_counter() - start)))
+    start = time.perf_counter()
+    for stream in streams:
+        next(stream)
+    print('format every message: {:.1f} ms'.format(1000 * (time.perf_counter() - start)))
+
+
+if __name__ == '__main__':
+    main()
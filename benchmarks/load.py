@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+""" Replay the organizer journey with concurrent users and check query budgets.
+
+    usage: python benchmarks/load.py [--users 4] [--iterations 50] [--scale small]
+                                     [--base-url http://127.0.0.1:5000]
+
+    Every virtual user signs in once (again, after a pause, while the
+    password hasher sheds it), then repeats: home, its event's
+    dashboard, move the first new task to review, the pending review page,
+    mark the task done. Reports the p50, p95 and p99 latency of each step
+    and the most SQL statements it ran, from the X-SQL-Statements header.
+
+    By default the app runs in this process (through its test client, one
+    per user and thread) on a temporary SQLite file filled by datagen. With
+    --base-url it drives a running server instead, which must hold a data
+    set generated by datagen and have EVENTPLAZA_METRICS_HEADER=true for
+    the budgets to be checked.
+
+    Exits with status 1 when a step got an unexpected status or ran more
+    statements than its budget in BUDGETS.
+"""
+import os
+import re
+import sys
+import time
+import argparse
+import tempfile
+import threading
+import http.cookiejar
+import urllib.error
+import urllib.parse
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from event_plaza import create_app, db  # noqa: E402
+import datagen  # noqa: E402
+
+# step: (expected status, most SQL statements it may run). Measured on the
+# generated data; raise a budget in the change that needs the statement.
+BUDGETS = {
+    'login': (302, 1),
+    'home': (200, 3),
+    'dashboard': (200, 3),
+    'review task': (302, 3),
+    'pending review': (200, 2),
+    'done task': (302, 3),
+}
+CSRF_TOKEN = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+TASK_ID = re.compile(r'data-task-id="([^"]+)"')
+
+
+class TestClient():
+    """ Sends the requests to an app in this process """
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, path, data=None):
+        """ Return the status, headers and body of a GET, or a POST of data """
+        response = self.client.open(path, method='POST' if data else 'GET', data=data)
+        return response.status_code, response.headers, response.get_data(as_text=True)
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args):
+        return None
+
+
+class HttpClient():
+    """ Sends the requests to a running server """
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect())
+
+    def request(self, path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data else None
+        try:
+            with self.opener.open(self.base_url + path, body) as response:
+                return response.status, response.headers, response.read().decode()
+        except urllib.error.HTTPError as error:
+            return error.code, error.headers, error.read().decode()
+
+
+class Results():
+    """ The latencies and statement counts of every step, from every user """
+
+    def __init__(self):
+        self.timings = {step: [] for step in BUDGETS}
+        self.statements = {step: [] for step in BUDGETS}
+        self.errors = {step: 0 for step in BUDGETS}
+        self._lock = threading.Lock()
+
+    def add(self, step, elapsed, status, headers):
+        with self._lock:
+            self.timings[step].append(elapsed)
+            if headers.get('X-SQL-Statements') is not None:
+                self.statements[step].append(int(headers['X-SQL-Statements']))
+            if status != BUDGETS[step][0]:
+                self.errors[step] += 1
+
+
+def virtual_user(client, number, iterations, results):
+    """ Sign in as the nth generated user and work on the nth event """
+
+    def step(name, path, data=None):
+        start = time.perf_counter()
+        status, headers, body = client.request(path, data)
+        results.add(name, time.perf_counter() - start, status, headers)
+        return headers, body
+
+    for attempt in range(10):
+        page = client.request('/login')[2]
+        headers, _ = step('login', '/login', {
+            'csrf_token': CSRF_TOKEN.search(page).group(1), 'email': datagen.email(number),
+            'password': datagen.PASSWORD})
+        # A busy password hasher sheds the sign in back to the login page
+        if not headers.get('Location', '').endswith('/login'):
+            break
+        time.sleep(0.1 * 2 ** attempt)
+    dashboard = '/{}/dashboard'.format(urllib.parse.quote(datagen.event_name(number)))
+    for _ in range(iterations):
+        step('home', '/home')
+        task = TASK_ID.search(step('dashboard', dashboard)[1])
+        if task is None:
+            # Every task of the event is done already
+            continue
+        step('review task', '{}/{}/review'.format(dashboard, task.group(1)))
+        step('pending review', dashboard + '/pendingreview')
+        step('done task', '{}/{}/done'.format(dashboard, task.group(1)))
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[int(fraction * (len(values) - 1))] if values else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--users', type=int, default=4, help='Concurrent virtual users')
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--scale', choices=datagen.SCALES, default='small',
+                        help='Data set to generate for the in-process app')
+    parser.add_argument('--base-url', help='Drive this server instead of an in-process app')
+    args = parser.parse_args()
+
+    if args.base_url:
+        clients = [HttpClient(args.base_url) for _ in range(args.users)]
+    else:
+        url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'load.db')
+        app = create_app({'SQLALCHEMY_DATABASE_URI': url, 'METRICS_HEADER': True})
+        with app.app_context():
+            db.create_all()
+            datagen.generate(**datagen.SCALES[args.scale])
+        clients = [TestClient(app) for _ in range(args.users)]
+
+    results = Results()
+    threads = [threading.Thread(target=virtual_user,
+                                args=(client, number, args.iterations, results))
+               for number, client in enumerate(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    failed = False
+    print('{:<16} {:>8} {:>8} {:>9} {:>9} {:>9} {:>11}'.format(
+        'step', 'requests', 'errors', 'p50 ms', 'p95 ms', 'p99 ms', 'statements'))
+    for step, (status, budget) in BUDGETS.items():
+        timings, statements = results.timings[step], results.statements[step]
+        most = max(statements) if statements else None
+        over = most is not None and most > budget
+        failed = failed or over or results.errors[step] > 0
+        print('{:<16} {:>8} {:>8} {:>9.1f} {:>9.1f} {:>9.1f} {:>11}'.format(
+            step, len(timings), results.errors[step], 1000 * percentile(timings, 0.5),
+            1000 * percentile(timings, 0.95), 1000 * percentile(timings, 0.99),
+            '-' if most is None else '{}/{}{}'.format(most, budget, ' !' if over else '')))
+    print('{} requests in {:.1f} s'.format(sum(map(len, results.timings.values())), elapsed))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+""" Time the hot functions of a request, one call at a time.
+
+    usage: python benchmarks/micro.py [--url sqlite:///...] [--rounds 12] [--only bcrypt ...]
+
+    Builds a small data set with datagen (in a temporary SQLite file by
+    default), then reports the median and 95th percentile time per call of
+    the user loader, the organizer check, save_picture, BaseModel.to_dict
+    (next to the TASK projection), the verification token lookup and
+    bcrypt. "cold" calls start from an empty request-scoped or process
+    cache, "warm" ones hit it.
+"""
+import io
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from werkzeug.datastructures import FileStorage  # noqa: E402
+from event_plaza import create_app, db  # noqa: E402
+from event_plaza import permissions, tokens  # noqa: E402
+from event_plaza.models import User, Event, Task  # noqa: E402
+from event_plaza.models.user import load_user  # noqa: E402
+from event_plaza.images import KINDS, save_picture  # noqa: E402
+from event_plaza.serializers import TASK  # noqa: E402
+from event_plaza.passwords import _hash, _check  # noqa: E402
+import datagen  # noqa: E402
+
+
+def measure(function, calls, setup=None):
+    """ Return the time of every call of function, in seconds """
+    timings = []
+    for number in range(calls):
+        argument = setup(number) if setup else None
+        start = time.perf_counter()
+        function(argument)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def picture(number):
+    """ Return a 1200x800 JPEG upload, a different one for every number """
+    from PIL import Image
+    image = Image.new('RGB', (1200, 800), (number % 256, (number // 256) % 256, 120))
+    data = io.BytesIO()
+    image.save(data, 'JPEG')
+    data.seek(0)
+    return FileStorage(data, filename='upload.jpg', content_type='image/jpeg')
+
+
+def benchmarks(app, rounds):
+    """ Yield (name, calls, function, setup) """
+    with app.app_context():
+        user = User.query.filter_by(email=datagen.email(0)).one()
+        user_id, password = user.id, user.password
+        event_id = db.session.query(Event.id).filter(Event.organizer.any(id=user_id)).first()[0]
+        task_id = db.session.query(Task.id).first()[0]
+
+    def in_request(function):
+        def run(argument):
+            with app.test_request_context():
+                function(argument)
+        return run
+
+    def cold_roles(argument):
+        permissions.cache.clear()
+        permissions.has_event_role(user_id, event_id, 'organizer')
+
+    yield 'load_user, cold', 500, in_request(lambda _: load_user(user_id)), None
+    with app.test_request_context():
+        load_user(user_id)
+        yield 'load_user, warm', 5000, lambda _: load_user(user_id), None
+    yield 'organizer check, cold', 500, in_request(cold_roles), None
+    with app.test_request_context():
+        permissions.has_event_role(user_id, event_id, 'organizer')
+        yield 'organizer check, warm', 5000, \
+            lambda _: permissions.has_event_role(user_id, event_id, 'organizer'), None
+    yield 'save_picture, new image', 20, \
+        in_request(lambda upload: save_picture(upload, event=True)), picture
+    yield 'save_picture, known image', 50, \
+        in_request(lambda upload: save_picture(upload, event=True)), lambda _: picture(0)
+    with app.app_context():
+        task = db.session.get(Task, task_id)
+        row = TASK.query(Task.id == task_id).one()
+        yield 'Task.to_dict', 5000, lambda _: task.to_dict(), None
+        yield 'TASK.row', 5000, lambda _: TASK.row(row), None
+    with app.app_context():
+        token = tokens.issue(user_id, tokens.VERIFY)
+        db.session.commit()
+    yield 'verification token lookup', 2000, \
+        in_request(lambda _: tokens.find(token, tokens.VERIFY)), None
+    yield 'bcrypt hash, {} rounds'.format(rounds), 5, lambda _: _hash('benchmark', rounds), None
+    yield 'bcrypt check, {} rounds'.format(rounds), 5, lambda _: _check(password, 'benchmark'), \
+        None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--url', help='Empty database to fill (default: a temporary SQLite file)')
+    parser.add_argument('--rounds', type=int, default=12, help='bcrypt work factor')
+    parser.add_argument('--only', nargs='+', help='Only run the benchmarks starting with these')
+    args = parser.parse_args()
+    directory = tempfile.mkdtemp()
+    url = args.url or 'sqlite:///' + os.path.join(directory, 'micro.db')
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': url, 'BCRYPT_LOG_ROUNDS': args.rounds,
+                      # Render pictures inline, into a scratch static folder
+                      'IMAGE_WORKERS': 0, 'IMAGE_STAGING_DIR': os.path.join(directory, 'staging')})
+    app.static_folder = os.path.join(directory, 'static')
+    for kind in KINDS.values():
+        os.makedirs(os.path.join(app.static_folder, kind[0]))
+    with app.app_context():
+        db.create_all()
+        datagen.generate(users=200, events=200, tasks=5000)
+
+    print('{:<32} {:>7} {:>12} {:>12}'.format('benchmark', 'calls', 'p50 us', 'p95 us'))
+    for name, calls, function, setup in benchmarks(app, args.rounds):
+        if args.only and not any(name.startswith(prefix) for prefix in args.only):
+            continue
+        timings = sorted(measure(function, calls, setup))
+        print('{:<32} {:>7} {:>12.1f} {:>12.1f}'.format(
+            name, calls, 1e6 * statistics.median(timings),
+            1e6 * timings[int(0.95 * (len(timings) - 1))]))
+
+
+if __name__ == '__main__':
+    main()
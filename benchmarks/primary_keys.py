@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+""" Compare the insert rate and size of tables keyed by each key strategy.
+
+    usage: python benchmarks/primary_keys.py [--url mysql://...] [--rows 200000]
+
+    For every strategy (random uuid4 strings, time-ordered uuid7 strings and
+    uuid7 as BINARY(16)) a tasks-like table and an assigns-like association
+    table are created in the database, filled in batches, measured and
+    dropped. On MySQL the sizes are InnoDB's data and index lengths; on
+    SQLite (the default, in a temporary file) they come from dbstat when it
+    is available, else from the file size.
+"""
+import os
+import sys
+import uuid
+import time
+import argparse
+import tempfile
+from datetime import datetime
+from sqlalchemy import (create_engine, MetaData, Table, Column, String, DateTime,
+                        ForeignKey, text, bindparam)
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from event_plaza.models.keys import Key, uuid7  # noqa: E402
+
+
+STRATEGIES = (
+    ('uuid4 string', False, lambda: str(uuid.uuid4())),
+    ('uuid7 string', False, lambda: str(uuid7())),
+    ('uuid7 binary', True, lambda: str(uuid7())),
+)
+
+
+def tables(binary):
+    metadata = MetaData()
+    tasks = Table('bench_tasks', metadata,
+                  Column('id', Key(binary), primary_key=True),
+                  Column('event_id', Key(binary), nullable=False, index=True),
+                  Column('name', String(128), nullable=False),
+                  Column('created_at', DateTime, nullable=False))
+    assigns = Table('bench_assigns', metadata,
+                    Column('task_id', Key(binary), ForeignKey('bench_tasks.id'),
+                           primary_key=True),
+                    Column('user_id', Key(binary), primary_key=True))
+    return metadata, tasks, assigns
+
+
+def sizes(engine, names):
+    """ Return (data bytes, index bytes) of the tables """
+    with engine.connect() as connection:
+        if engine.dialect.name == 'mysql':
+            for name in names:
+                connection.execute(text('ANALYZE TABLE {}'.format(name)))
+            row = connection.execute(text(
+                'SELECT SUM(data_length), SUM(index_length) FROM information_schema.tables '
+                'WHERE table_schema = DATABASE() AND table_name IN :names'
+            ).bindparams(bindparam('names', expanding=True)), {'names': names}).one()
+            return int(row[0]), int(row[1])
+        try:
+            data = index = 0
+            for name, size in connection.execute(text(
+                    'SELECT name, SUM(pgsize) FROM dbstat GROUP BY name')):
+                if name in names:
+                    data += size
+                elif name.startswith('sqlite_autoindex_bench') or name.startswith('ix_bench'):
+                    index += size
+            return data, index
+        except Exception:
+            return os.path.getsize(engine.url.database), 0
+
+
+def run(engine, binary, make_key, rows, batch):
+    metadata, tasks, assigns = tables(binary)
+    metadata.drop_all(engine)
+    metadata.create_all(engine)
+    events = [make_key() for _ in range(50)]
+    users = [make_key() for _ in range(500)]
+    start = time.perf_counter()
+    for offset in range(0, rows, batch):
+        now = datetime.now()
+        task_rows = [{'id': make_key(), 'event_id': events[i % len(events)],
+                      'name': 'task {}'.format(offset + i), 'created_at': now}
+                     for i in range(min(batch, rows - offset))]
+        assign_rows = [{'task_id': row['id'], 'user_id': users[i % len(users)]}
+                       for i, row in enumerate(task_rows)]
+        with engine.begin() as connection:
+            connection.execute(tasks.insert(), task_rows)
+            connection.execute(assigns.insert(), assign_rows)
+    elapsed = time.perf_counter() - start
+    measured = sizes(engine, [tasks.name, assigns.name])
+    metadata.drop_all(engine)
+    return rows / elapsed, measured
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--url', help='Database to run in (default: a temporary SQLite file)')
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--batch', type=int, default=1000)
+    args = parser.parse_args()
+
+    print('{:<14} {:>12} {:>12} {:>12}'.format('keys', 'inserts/s', 'data MiB', 'index MiB'))
+    for name, binary, make_key in STRATEGIES:
+        url = args.url or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'keys.db')
+        rate, (data, index) = run(create_engine(url), binary, make_key, args.rows, args.batch)
+        print('{:<14} {:>12.0f} {:>12.1f} {:>12.1f}'.format(
+            name, rate, data / 2 ** 20, index / 2 ** 20))
+
+
+if __name__ == '__main__':
+    main()
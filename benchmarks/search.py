@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+""" Measure full-text search latency over a large number of tasks.
+
+    usage: python benchmarks/search.py [--url sqlite:///...] [--documents 1000000]
+
+    Fills search_documents of an empty database (a temporary SQLite file by
+    default, or the --url one, e.g. a scratch MySQL schema) with random
+    task text, drawn from a Zipf-like vocabulary, spread over 1000 events,
+    a tenth of which the searching user organizes, then reports the median
+    and 95th percentile latency of a few queries through event_plaza.search.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import itertools
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from event_plaza import create_app, db  # noqa: E402
+from event_plaza import search  # noqa: E402
+from event_plaza.models import search_documents  # noqa: E402
+from event_plaza.models.event_tables import event_organizers  # noqa: E402
+from event_plaza.models.keys import new_id  # noqa: E402
+
+WORDS = ('stadium water volunteer badge stage sound light ticket sponsor press catering '
+         'security parking shuttle banner speaker hotel flight visa booth wifi power '
+         'signage medal registration printing budget invoice contract permit').split()
+# Task text follows a long tailed vocabulary: the words above plus many rare ones
+VOCABULARY = WORDS + ['w{:x}'.format(i) for i in range(50000)]
+CUM_WEIGHTS = list(itertools.accumulate(1 / rank for rank in range(1, len(VOCABULARY) + 1)))
+QUERIES = ('stadium', 'sponsor contract', 'vol', 'spon', 'registration badge printing', 'w1f00')
+
+
+def fill(documents, events, batch=5000):
+    user_id = new_id()
+    event_ids = [new_id() for _ in range(events)]
+    db.session.execute(event_organizers.insert(), [
+        {'event_id': event_id, 'user_id': user_id} for event_id in event_ids[:events // 10]])
+    for offset in range(0, documents, batch):
+        db.session.execute(search_documents.insert(), [{
+            'kind': 'task', 'object_id': new_id(), 'event_id': random.choice(event_ids),
+            'title': ' '.join(random.choices(VOCABULARY, cum_weights=CUM_WEIGHTS, k=3)),
+            'body': ' '.join(random.choices(VOCABULARY, cum_weights=CUM_WEIGHTS, k=random.randint(10, 120))),
+        } for _ in range(min(batch, documents - offset))])
+        db.session.commit()
+    return user_id
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--url', help='Empty database to fill (default: a temporary SQLite file)')
+    parser.add_argument('--documents', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    url = args.url or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'search.db')
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': url})
+    with app.test_request_context():
+        db.create_all()
+        start = time.perf_counter()
+        user_id = fill(args.documents, 1000)
+        print('indexed {} documents in {:.0f} s\n'.format(args.documents,
+                                                           time.perf_counter() - start))
+        print('{:<28} {:>8} {:>10} {:>10}'.format('query', 'results', 'p50 ms', 'p95 ms'))
+        for query in QUERIES:
+            timings = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                results = search.search(user_id, query)
+                timings.append(1000 * (time.perf_counter() - start))
+            timings.sort()
+            print('{:<28} {:>8} {:>10.1f} {:>10.1f}'.format(
+                query, len(results), statistics.median(timings),
+                timings[int(0.95 * (len(timings) - 1))]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+""" Measure how long a worker takes to boot.
+
+    usage: python benchmarks/startup.py [--runs 10] [--url sqlite://] [--top 15]
+
+    Every run is a fresh interpreter which imports event_plaza, builds the
+    app with create_app() and serves one request, timing each step. The
+    median of the runs is reported, followed by the modules that took the
+    longest to import (python -X importtime) in one more run.
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+CHILD = '''
+import json, time
+start = time.perf_counter()
+import event_plaza
+imported = time.perf_counter()
+app = event_plaza.create_app()
+created = time.perf_counter()
+app.test_client().get('/')
+served = time.perf_counter()
+print(json.dumps({'import': imported - start, 'create_app': created - imported,
+                  'first request': served - created, 'total': served - start}))
+'''
+
+
+def run(env, extra=()):
+    return subprocess.run([sys.executable, *extra, '-c', CHILD], cwd=ROOT, env=env,
+                          capture_output=True, text=True, check=True)
+
+
+def slowest_imports(stderr, top):
+    """ Return the (cumulative microseconds, module) of the slowest imports """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        imports.append((int(cumulative), name.strip()))
+    return sorted(imports, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--url', default='sqlite://',
+                        help='Database the app is configured with (never queried)')
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+    env = dict(os.environ, EVENTPLAZA_SQLALCHEMY_DATABASE_URI=args.url)
+
+    timings = [json.loads(run(env).stdout) for _ in range(args.runs)]
+    for step in timings[0]:
+        print('{:<14} {:>8.1f} ms'.format(step, 1000 * statistics.median(t[step] for t in timings)))
+
+    print('\nslowest imports (cumulative)')
+    for cumulative, name in slowest_imports(run(env, ('-X', 'importtime')).stderr, args.top):
+        print('{:>8.1f} ms  {}'.format(cumulative / 1000, name))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,256 @@
+#!/usr/bin/python3
+""" Task activity log, written behind the requests.
+
+    Mapper events note every task created, moved to another status or
+    deleted in the session; once the transaction commits, the entries join
+    an in-process buffer instead of being written by the request. A writer
+    thread drains the buffer every ACTIVITY_FLUSH_SECONDS (sooner once
+    ACTIVITY_BATCH_SIZE entries wait): it appends them to task_activity and
+    applies their sum to the event_task_stats and event_task_days summaries
+    in one transaction, so the analytics page reads a few rows per event
+    instead of scanning the tasks.
+
+    Entries still buffered when a process dies are lost; `flask
+    activity-rebuild` recounts the summaries from the tasks and the log.
+    ACTIVITY_FLUSH_SECONDS = 0 writes them synchronously after each commit.
+"""
+import atexit
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta
+from flask import current_app, has_request_context
+from flask_login import current_user
+from sqlalchemy import event as sa_event, inspect, select, update, delete, func
+from sqlalchemy.orm import Session
+from event_plaza import db
+from event_plaza.sql import insert_ignore
+from event_plaza.models import Task, Event, TASK_STATUSES
+from event_plaza.models.activity import task_activity, event_task_stats, event_task_days
+from event_plaza.models.keys import new_id
+
+
+_buffer = []
+_lock = threading.Lock()
+_wakeup = threading.Event()
+_writer = None
+
+
+def entry(task_id, event_id, action, from_status=None, to_status=None, since=None, now=None):
+    """ Return the task_activity row of a change of a task """
+    now = now or datetime.now()
+    user_id = None
+    if has_request_context() and current_user.is_authenticated:
+        user_id = current_user.id
+    return {'id': new_id(), 'task_id': task_id, 'event_id': event_id, 'user_id': user_id,
+            'action': action, 'from_status': from_status, 'to_status': to_status,
+            'seconds': int((now - since).total_seconds()) if since else None,
+            'created_at': now}
+
+
+def record(session, entries):
+    """ Buffer activity entries once the session's transaction commits """
+    session.info.setdefault('task_activity', []).extend(entries)
+
+
+def summarize(entries):
+    """ Return the summary deltas of entries: {event_id: {column: delta}}
+        and {(event_id, day): {column: delta}}
+    """
+    stats = defaultdict(lambda: defaultdict(int))
+    days = defaultdict(lambda: defaultdict(int))
+    for row in entries:
+        totals = stats[row['event_id']]
+        today = days[row['event_id'], row['created_at'].date()]
+        if row['from_status'] in TASK_STATUSES:
+            totals['tasks_' + row['from_status']] -= 1
+        if row['to_status'] in TASK_STATUSES:
+            totals['tasks_' + row['to_status']] += 1
+        if row['action'] == 'create':
+            today['created'] += 1
+        elif row['to_status'] in ('review', 'done'):
+            today['reviewed' if row['to_status'] == 'review' else 'done'] += 1
+            # Cycle times only count the usual new -> review -> done path
+            if row['seconds'] is not None and (row['from_status'], row['to_status']) in \
+                    (('new', 'review'), ('review', 'done')):
+                column = 'reviewed' if row['to_status'] == 'review' else 'done'
+                totals[column] += 1
+                totals[column + '_seconds'] += row['seconds']
+    return stats, days
+
+
+def _increment(connection, table, keys, deltas):
+    insert_ignore(table, [dict(keys)], connection)
+    connection.execute(update(table)
+                       .where(*(table.c[name] == value for name, value in keys.items()))
+                       .values({name: table.c[name] + delta
+                                for name, delta in deltas.items() if delta}))
+
+
+def write(connection, entries):
+    """ Append entries to the log and apply them to the summaries """
+    if not entries:
+        return
+    connection.execute(task_activity.insert(), entries)
+    stats, days = summarize(entries)
+    # Always in key order, so concurrent writers lock rows in the same order
+    for event_id in sorted(stats, key=str):
+        if any(stats[event_id].values()):
+            _increment(connection, event_task_stats, {'event_id': event_id}, stats[event_id])
+    for event_id, day in sorted(days, key=lambda key: (str(key[0]), key[1])):
+        if any(days[event_id, day].values()):
+            _increment(connection, event_task_days, {'event_id': event_id, 'day': day},
+                       days[event_id, day])
+
+
+def flush(app=None):
+    """ Write every buffered entry now, return how many there were """
+    app = app or current_app._get_current_object()
+    with _lock:
+        entries = _buffer[:]
+        del _buffer[:]
+    if not entries:
+        return 0
+    try:
+        with app.app_context(), db.engine.begin() as connection:
+            write(connection, entries)
+    except Exception:
+        app.logger.exception('Writing %d task activity entries failed', len(entries))
+        with _lock:
+            # Keep them for the next attempt, unless the database stays down
+            if len(_buffer) + len(entries) <= app.config.get('ACTIVITY_MAX_PENDING', 100000):
+                _buffer[:0] = entries
+        return 0
+    return len(entries)
+
+
+class ActivityWriter(threading.Thread):
+    """ The thread writing the buffered activity of this process """
+
+    def __init__(self, app):
+        super().__init__(daemon=True, name='activity-writer')
+        self.app = app
+        self.stop = threading.Event()
+
+    def run(self):
+        interval = self.app.config.get('ACTIVITY_FLUSH_SECONDS', 2)
+        while not self.stop.is_set():
+            _wakeup.wait(interval)
+            _wakeup.clear()
+            flush(self.app)
+
+
+def _start_writer(app):
+    global _writer
+    if _writer is not None:
+        return
+    with _lock:
+        if _writer is not None:
+            return
+        _writer = ActivityWriter(app)
+        _writer.start()
+        atexit.register(flush, app)
+
+
+def _enqueue(entries):
+    app = current_app._get_current_object()
+    with _lock:
+        _buffer.extend(entries)
+        pending = len(_buffer)
+    if app.config.get('ACTIVITY_FLUSH_SECONDS', 2) <= 0:
+        flush(app)
+        return
+    _start_writer(app)
+    if pending >= app.config.get('ACTIVITY_BATCH_SIZE', 500):
+        _wakeup.set()
+
+
+@sa_event.listens_for(Session, 'after_commit')
+def _committed(session):
+    entries = session.info.pop('task_activity', None)
+    if entries:
+        _enqueue(entries)
+
+
+@sa_event.listens_for(Session, 'after_rollback')
+def _rolled_back(session):
+    session.info.pop('task_activity', None)
+
+
+@sa_event.listens_for(Task, 'after_insert')
+def _created(mapper, connection, target):
+    record(inspect(target).session,
+           [entry(target.id, target.event_id, 'create', to_status=target.status or 'new')])
+
+
+@sa_event.listens_for(Task, 'after_update')
+def _updated(mapper, connection, target):
+    history = inspect(target).attrs.status.history
+    if not history.has_changes() or not history.deleted:
+        return
+    before, now = history.deleted[0], datetime.now()
+    since = target.reviewed_at if before == 'review' else target.created_at
+    record(inspect(target).session,
+           [entry(target.id, target.event_id, target.status, before, target.status, since, now)])
+
+
+@sa_event.listens_for(Task, 'after_delete')
+def _deleted(mapper, connection, target):
+    record(inspect(target).session,
+           [entry(target.id, target.event_id, 'delete', from_status=target.status)])
+
+
+def event_summary(event_id, days=30):
+    """ Return the summary row of an event (or None), its last days of
+        throughput, oldest first, and its latest activity (with the name
+        of the task, None once deleted)
+    """
+    stats = db.session.execute(select(event_task_stats)
+                               .where(event_task_stats.c.event_id == event_id)).first()
+    since = datetime.now().date() - timedelta(days=days - 1)
+    throughput = db.session.execute(select(event_task_days)
+                                    .where(event_task_days.c.event_id == event_id,
+                                           event_task_days.c.day >= since)
+                                    .order_by(event_task_days.c.day)).all()
+    latest = db.session.execute(select(task_activity, Task.name)
+                                .outerjoin(Task, Task.id == task_activity.c.task_id)
+                                .where(task_activity.c.event_id == event_id)
+                                .order_by(task_activity.c.created_at.desc())
+                                .limit(20)).all()
+    return stats, throughput, latest
+
+
+def rebuild():
+    """ Recount the summaries: tasks per status from the tasks, cycle times
+        and throughput from the log. Return the number of events.
+    """
+    flush()
+    counts = defaultdict(lambda: dict.fromkeys(('tasks_' + status for status in TASK_STATUSES), 0))
+    for event_id, status, count in db.session.query(Task.event_id, Task.status, func.count()) \
+            .group_by(Task.event_id, Task.status):
+        if status in TASK_STATUSES:
+            counts[event_id]['tasks_' + status] = count
+    entries = db.session.execute(select(task_activity.c.event_id, task_activity.c.action,
+                                        task_activity.c.from_status, task_activity.c.to_status,
+                                        task_activity.c.seconds, task_activity.c.created_at)
+                                 # The log outlives the events, the summaries do not
+                                 .where(task_activity.c.event_id.in_(select(Event.id)))) \
+        .mappings()
+    stats, days = summarize(entries)
+    db.session.execute(delete(event_task_stats))
+    db.session.execute(delete(event_task_days))
+    rows = []
+    for event_id in set(counts) | set(stats):
+        row = {'event_id': event_id, 'reviewed': 0, 'reviewed_seconds': 0,
+               'done': 0, 'done_seconds': 0}
+        row.update({name: value for name, value in stats[event_id].items()
+                    if not name.startswith('tasks_')})
+        row.update(counts[event_id])
+        rows.append(row)
+    if rows:
+        db.session.execute(event_task_stats.insert(), rows)
+    days = [{'event_id': event_id, 'day': day, 'created': 0, 'reviewed': 0, 'done': 0, **deltas}
+            for (event_id, day), deltas in days.items() if any(deltas.values())]
+    if days:
+        db.session.execute(event_task_days.insert(), days)
+    db.session.commit()
+    return len(rows)
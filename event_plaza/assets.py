@@ -0,0 +1,265 @@
+#!/usr/bin/python3
+""" Fingerprinted, precompressed static assets.
+
+    `flask assets-build` copies the stylesheet, the scripts and the stock
+    pictures to static/dist under names that contain a hash of their
+    content (styles/styles.3f9a0c1d2e4b.css), with gzip and, when the
+    brotli package is installed, brotli variants of the text files next to
+    them, and records the names in static/dist/manifest.json.
+
+    Templates link to assets with asset_url('styles/styles.css'), which
+    points at the fingerprinted copy on /assets/..., served with the best
+    variant the browser accepts and cached for a year, since a new build
+    gives a new name. Without a manifest (e.g. in development) asset_url
+    falls back to the plain static file.
+
+    --purge also drops the Tailwind rules whose classes appear in no
+    template nor script, which leaves a small part of the stylesheet.
+"""
+import os
+import re
+import gzip
+import json
+import hashlib
+import threading
+import mimetypes
+from flask import current_app, request, url_for, send_from_directory, abort
+
+
+MANIFEST = 'manifest.json'
+# Directories of static whose files are built, and the single files (the
+# stock pictures; the uploaded ones next to them are served by main.media)
+SOURCE_DIRECTORIES = ('styles', 'js')
+SOURCE_FILES = ('event_pics/event_default.jpg', 'profile_pics/default.jpg')
+COMPRESSED_TYPES = ('.css', '.js', '.svg', '.json', '.txt')
+CACHE_MAX_AGE = 365 * 24 * 3600
+# Content-Encoding: suffix of the variant, in order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+# What the Tailwind extractor calls candidates: anything between quotes,
+# spaces and angle brackets might be a class name
+CANDIDATE_SEPARATORS = re.compile(r'[\s"\'`<>=]+')
+CLASS_SELECTOR = re.compile(r'\.((?:\\[0-9a-fA-F]{1,6} ?|\\.|[\w-])+)')
+ESCAPE = re.compile(r'\\([0-9a-fA-F]{1,6}) ?|\\(.)')
+# Only dropped from the selectors: Tailwind puts empty ones in declarations
+COMMENT = re.compile(r'/\*.*?\*/', re.S)
+# At-rules holding rules that may be purged, the others are kept whole
+NESTED_AT_RULES = ('@media', '@supports', '@layer', '@container')
+
+
+def dist_folder(app=None):
+    app = app or current_app
+    return app.config.get('ASSETS_FOLDER') or os.path.join(app.static_folder, 'dist')
+
+
+def fingerprint(filename, content):
+    """ Return filename with a hash of its content before the extension """
+    base, extension = os.path.splitext(filename)
+    return '{}.{}{}'.format(base, hashlib.sha256(content).hexdigest()[:12], extension)
+
+
+def sources(static_folder):
+    """ Return the names, relative to static_folder, of the files to build """
+    names = [name for name in SOURCE_FILES
+             if os.path.isfile(os.path.join(static_folder, name))]
+    for directory in SOURCE_DIRECTORIES:
+        for root, _, files in os.walk(os.path.join(static_folder, directory)):
+            for name in files:
+                names.append(os.path.relpath(os.path.join(root, name), static_folder)
+                             .replace(os.sep, '/'))
+    return sorted(names)
+
+
+def _compressors():
+    compressors = [('.gz', lambda data: gzip.compress(data, 9, mtime=0))]
+    try:
+        import brotli
+    except ImportError:
+        pass
+    else:
+        compressors.insert(0, ('.br', lambda data: brotli.compress(data, quality=11)))
+    return compressors
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'wb') as output:
+        output.write(content)
+    os.replace(path + '.tmp', path)
+
+
+def build(static_folder, output, purge_with=None):
+    """ Build the assets of static_folder into output, return the manifest.
+
+        purge_with is a list of files (templates, scripts) whose class
+        names the stylesheets keep; by default they are kept whole.
+        The previous builds' files are left, for the pages still linking
+        to them during a deploy.
+    """
+    used = candidates(purge_with) if purge_with else None
+    compressors = _compressors()
+    manifest = {}
+    for name in sources(static_folder):
+        with open(os.path.join(static_folder, name), 'rb') as source:
+            content = source.read()
+        if used is not None and name.endswith('.css'):
+            content = purge_css(content.decode('utf-8'), used).encode('utf-8')
+        manifest[name] = fingerprint(name, content)
+        path = os.path.join(output, manifest[name])
+        _write(path, content)
+        if name.endswith(COMPRESSED_TYPES):
+            for suffix, compress in compressors:
+                compressed = compress(content)
+                if len(compressed) < len(content):
+                    _write(path + suffix, compressed)
+    # Written last, so the pages only link to files that exist
+    _write(os.path.join(output, MANIFEST), json.dumps(manifest, indent=2).encode('utf-8'))
+    return manifest
+
+
+def candidates(paths):
+    """ Return every token of the files that could be a class name """
+    found = set()
+    for path in paths:
+        with open(path, encoding='utf-8') as source:
+            found.update(CANDIDATE_SEPARATORS.split(source.read()))
+    return found
+
+
+def _unescape(match):
+    return chr(int(match.group(1), 16)) if match.group(1) else match.group(2)
+
+
+def _classes(selector):
+    return {ESCAPE.sub(_unescape, name) for name in CLASS_SELECTOR.findall(selector)}
+
+
+def _split(text, separator):
+    """ Split text on the separators outside of parentheses, brackets and strings """
+    parts, depth, quote, start = [], 0, None, 0
+    for index, char in enumerate(text):
+        if quote:
+            if char == quote and text[index - 1] != '\\':
+                quote = None
+        elif char in '"\'':
+            quote = char
+        elif char in '([':
+            depth += 1
+        elif char in ')]':
+            depth -= 1
+        elif char == separator and depth == 0:
+            parts.append(text[start:index])
+            start = index + 1
+    parts.append(text[start:])
+    return parts
+
+
+def _rules(css):
+    """ Yield the (prelude, body) of the top level rules of a stylesheet;
+        the body of a statement (e.g. @import ...;) is None, and so is the
+        body of a license comment (/*! ... */), yielded as its prelude
+    """
+    depth, quote, start, prelude, body_start, index = 0, None, 0, '', 0, 0
+    while index < len(css):
+        char = css[index]
+        if quote:
+            if char == '\\':
+                index += 1
+            elif char == quote:
+                quote = None
+        elif css.startswith('/*', index):
+            end = css.find('*/', index + 2)
+            end = len(css) if end < 0 else end + 2
+            if depth == 0 and css[index + 2:end].lstrip().startswith('!'):
+                yield css[index:end], None
+                start = end
+            index = end - 1
+        elif char in '"\'':
+            quote = char
+        elif char == '{':
+            if depth == 0:
+                prelude, body_start = COMMENT.sub('', css[start:index]).strip(), index + 1
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                yield prelude, css[body_start:index]
+                start = index + 1
+        elif char == ';' and depth == 0:
+            yield COMMENT.sub('', css[start:index]).strip(), None
+            start = index + 1
+        index += 1
+
+
+def _purge(css, used):
+    for prelude, body in _rules(css):
+        if body is None:
+            yield prelude if prelude.startswith('/*') else prelude + ';'
+        elif prelude.startswith(NESTED_AT_RULES):
+            rules = list(_purge(body, used))
+            if rules:
+                yield prelude + ' {\n' + '\n\n'.join(rules) + '\n}'
+        elif prelude.startswith('@'):
+            yield prelude + ' {' + body + '}'
+        else:
+            selectors = [selector.strip() for selector in _split(prelude, ',')
+                         if _classes(selector) <= used]
+            if selectors:
+                yield ',\n'.join(selectors) + ' {' + body + '}'
+
+
+def purge_css(css, used):
+    """ Return a stylesheet without the rules that need a class not in used.
+
+        Rules without classes (the base styles) and at-rules such as
+        @keyframes are kept, and so are the license comments.
+    """
+    return '\n\n'.join(_purge(css, used)) + '\n'
+
+
+_manifest = None
+_manifest_lock = threading.Lock()
+
+
+def get_manifest():
+    """ Read the build's manifest on first use ({} when there is none) """
+    global _manifest
+    if _manifest is None:
+        with _manifest_lock:
+            if _manifest is None:
+                try:
+                    with open(os.path.join(dist_folder(), MANIFEST), encoding='utf-8') as source:
+                        manifest = json.load(source)
+                except FileNotFoundError:
+                    manifest = {}
+                _manifest = (manifest, set(manifest.values()))
+    return _manifest
+
+
+def asset_url(filename):
+    """ Return the url of the current build of a static file """
+    built = get_manifest()[0].get(filename)
+    if built is None:
+        return url_for('static', filename=filename)
+    return url_for('main.asset', filename=built)
+
+
+def send_asset(filename):
+    """ Serve a built asset, precompressed if the browser accepts it """
+    if filename not in get_manifest()[1]:
+        abort(404)
+    directory = dist_folder()
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    for encoding, suffix in ENCODINGS:
+        if request.accept_encodings[encoding] and \
+                os.path.isfile(os.path.join(directory, filename + suffix)):
+            response = send_from_directory(directory, filename + suffix, mimetype=mimetype,
+                                           max_age=CACHE_MAX_AGE)
+            response.content_encoding = encoding
+            break
+    else:
+        response = send_from_directory(directory, filename, mimetype=mimetype,
+                                       max_age=CACHE_MAX_AGE)
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
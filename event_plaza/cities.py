@@ -0,0 +1,169 @@
+#!/usr/bin/python3
+""" Precompiled city index for the location autocomplete.
+
+    cities.csv is compiled once into a sorted binary index over both the
+    English and the Arabic city names, which is memory-mapped on first use
+    and searched by prefix with a binary search. The file layout is:
+
+        magic (8 bytes) | count (uint32) | count record offsets (uint32)
+        records: key \\0 id \\0 governorate_id \\0 name_en \\0 name_ar \\n
+
+    where records are sorted by their normalized search key. A city has a
+    record per name, plus one without the leading article ("Al ", "El ",
+    "ال") so that "bas" finds "Al Basatin".
+"""
+import os
+import csv
+import mmap
+import struct
+import tempfile
+import threading
+import unicodedata
+from collections import namedtuple
+from flask import current_app
+
+
+MAGIC = b'EPCITY1\n'
+CITIES_CSV = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          'cities.csv')
+
+City = namedtuple('City', ['id', 'governorate_id', 'name_en', 'name_ar'])
+
+_ARABIC_LETTERS = str.maketrans({'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ى': 'ي', 'ة': 'ه'})
+_ARTICLES = ('al ', 'el ', 'ال')
+
+
+def normalize(text):
+    """ Fold case, Arabic diacritics and letter variants for searching """
+    text = unicodedata.normalize('NFKD', text.strip().casefold())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ' '.join(text.translate(_ARABIC_LETTERS).split())
+
+
+def _keys(name):
+    key = normalize(name)
+    keys = {key}
+    for article in _ARTICLES:
+        if key.startswith(article) and len(key) > len(article):
+            keys.add(key[len(article):].lstrip())
+    return keys
+
+
+def build_index(csv_path, index_path):
+    """ Compile the cities CSV into a sorted index file, return the number of cities """
+    records = []
+    cities = 0
+    with open(csv_path, newline='', encoding='utf-8') as csvfile:
+        for row in csv.DictReader(csvfile):
+            cities += 1
+            fields = (row['id'], row['governorate_id'], row['city_name_en'], row['city_name_ar'])
+            for name in (row['city_name_en'], row['city_name_ar']):
+                for key in _keys(name):
+                    records.append('\0'.join((key,) + fields).encode('utf-8') + b'\n')
+    records = sorted(set(records))
+
+    offsets, position = [], 0
+    for record in records:
+        offsets.append(position)
+        position += len(record)
+    # Each process writes its own file: workers starting together may all
+    # rebuild the index, and only whole files ever replace it
+    descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(index_path)),
+                                             prefix=os.path.basename(index_path) + '.')
+    try:
+        with os.fdopen(descriptor, 'wb') as index:
+            index.write(MAGIC)
+            index.write(struct.pack('<I', len(records)))
+            index.write(struct.pack('<{}I'.format(len(records)), *offsets))
+            index.writelines(records)
+        os.chmod(temporary, 0o644)
+        os.replace(temporary, index_path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+    return cities
+
+
+class CityIndex():
+    """ Prefix search over a memory-mapped index file """
+
+    def __init__(self, path):
+        with open(path, 'rb') as index:
+            self._map = mmap.mmap(index.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            raise ValueError('{} is not a city index'.format(path))
+        self.count = struct.unpack_from('<I', self._map, len(MAGIC))[0]
+        self._offsets = len(MAGIC) + 4
+        self._data = self._offsets + 4 * self.count
+
+    def _record(self, position):
+        start = self._data + struct.unpack_from('<I', self._map, self._offsets + 4 * position)[0]
+        end = self._map.find(b'\n', start)
+        return self._map[start:end].decode('utf-8').split('\0')
+
+    def _lower_bound(self, key):
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._record(middle)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def search(self, prefix, limit=10):
+        """ Return up to $(limit) cities with a name starting with the prefix """
+        key = normalize(prefix)
+        found = {}
+        if not key:
+            return []
+        position = self._lower_bound(key)
+        while position < self.count and len(found) < limit:
+            record = self._record(position)
+            if not record[0].startswith(key):
+                break
+            found.setdefault(record[1], City(*record[1:]))
+            position += 1
+        return list(found.values())
+
+    def find(self, name):
+        """ Return the city with exactly this English or Arabic name, or None """
+        key = normalize(name)
+        for city in self.search(name, limit=50):
+            if key in (normalize(city.name_en), normalize(city.name_ar)):
+                return city
+        return None
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """ Load the index on first use, (re)building it when the CSV is newer """
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                path = index_path()
+                if not os.path.exists(path) or \
+                        os.path.getmtime(path) < os.path.getmtime(CITIES_CSV):
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    build_index(CITIES_CSV, path)
+                _index = CityIndex(path)
+    return _index
+
+
+def index_path():
+    return current_app.config.get('CITY_INDEX_PATH') or \
+        os.path.join(current_app.instance_path, 'cities.idx')
+
+
+def search(prefix, limit=10):
+    """ Return up to $(limit) cities with a name starting with the prefix """
+    return get_index().search(prefix, limit)
+
+
+def find(name):
+    """ Return the city with exactly this English or Arabic name, or None """
+    return get_index().find(name)
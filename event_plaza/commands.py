@@ -0,0 +1,172 @@
+#!/usr/bin/python3
+""" Flask CLI commands """
+import os
+import threading
+from datetime import timedelta
+import click
+from sqlalchemy import inspect
+from flask import Blueprint, current_app
+from event_plaza import db
+from event_plaza.outbox import OutboxWorker
+from event_plaza.images import collect_garbage
+from event_plaza import cities
+from event_plaza import task_transfer
+from event_plaza.key_migration import copy_database
+from event_plaza.models import keys
+from event_plaza.lookups import event_by_name
+from event_plaza import search, activity, assets, tokens
+
+
+# Registered without a group, so these are plain `flask <command>`s
+commands = Blueprint('commands', __name__, cli_group=None)
+
+
+@commands.cli.command('init-db')
+def init_db():
+    """ Create the tables and indexes that do not exist yet """
+    db.create_all()
+    # create_all skips the tables that exist, with the indexes added to them since
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name not in existing:
+                # Indexes limited to another dialect (ddl_if) are skipped here
+                index.create(db.engine)
+    click.echo('Created the missing tables and indexes of {}'.format(
+        db.engine.url.render_as_string()))
+
+
+@commands.cli.command('outbox-worker')
+@click.option('--workers', default=1, show_default=True,
+              help='Number of delivery threads to run.')
+def outbox_worker(workers):
+    """ Deliver queued emails until interrupted """
+    stop = threading.Event()
+    app = current_app._get_current_object()
+    pool = [OutboxWorker(app, stop) for _ in range(workers)]
+    for worker in pool:
+        worker.start()
+    click.echo('Delivering emails with {} worker(s), press CTRL+C to quit'.format(workers))
+    try:
+        while any(worker.is_alive() for worker in pool):
+            stop.wait(1)
+    except KeyboardInterrupt:
+        stop.set()
+
+
+@commands.cli.command('images-gc')
+@click.option('--grace-hours', default=1.0, show_default=True,
+              help='Keep unreferenced pictures younger than this.')
+def images_gc(grace_hours):
+    """ Remove the stored pictures nobody references """
+    removed = collect_garbage(timedelta(hours=grace_hours))
+    click.echo('Removed {} picture(s)'.format(removed))
+
+
+@commands.cli.command('cities-index')
+def cities_index():
+    """ Compile cities.csv into the autocomplete index """
+    path = cities.index_path()
+    count = cities.build_index(cities.CITIES_CSV, path)
+    click.echo('Indexed {} cities into {}'.format(count, path))
+
+
+def _event_or_fail(name):
+    event = event_by_name(name)
+    if event is None:
+        raise click.ClickException('There is no event named {}'.format(name))
+    return event
+
+
+@commands.cli.command('tasks-import')
+@click.argument('event_name')
+@click.argument('source', type=click.File('r', encoding='utf-8-sig', errors='replace'))
+@click.option('--format', 'fmt', type=click.Choice(task_transfer.FORMATS),
+              help='File format, guessed from the file name by default.')
+@click.option('--batch-size', default=task_transfer.BATCH_SIZE, show_default=True,
+              help='Tasks inserted per transaction.')
+def tasks_import(event_name, source, fmt, batch_size):
+    """ Import the tasks of a CSV or JSON lines file (- for stdin) into an event """
+    event = _event_or_fail(event_name)
+    report = task_transfer.import_tasks(event.id, source, fmt or task_transfer.format_of(source.name),
+                                        batch_size)
+    for line, error in report.errors:
+        click.echo('line {}: {}'.format(line, error), err=True)
+    click.echo('Imported {} task(s), rejected {}'.format(report.imported, report.rejected))
+
+
+@commands.cli.command('tasks-export')
+@click.argument('event_name')
+@click.argument('target', type=click.File('w', encoding='utf-8'), default='-')
+@click.option('--format', 'fmt', type=click.Choice(task_transfer.FORMATS),
+              help='File format, guessed from the file name by default.')
+def tasks_export(event_name, target, fmt):
+    """ Export the tasks of an event as CSV or JSON lines (to stdout by default) """
+    event = _event_or_fail(event_name)
+    for chunk in task_transfer.export_tasks(event.id, fmt or task_transfer.format_of(target.name)):
+        target.write(chunk)
+
+
+@commands.cli.command('keys-migrate')
+@click.argument('source_url')
+@click.option('--rekey', is_flag=True,
+              help='Replace the keys by time-ordered ones and rewrite the references.')
+@click.option('--batch-size', default=1000, show_default=True,
+              help='Rows inserted per transaction.')
+def keys_migrate(source_url, rekey, batch_size):
+    """ Copy the database at SOURCE_URL into the app's (empty) database,
+        storing its keys the way EVENTPLAZA_KEYS says.
+    """
+    click.echo('Copying into a database with {} keys'.format(keys.STRATEGY))
+    try:
+        for table, copied in copy_database(source_url, rekey, batch_size):
+            click.echo('{:<20} {:>10} row(s)'.format(table, copied))
+    except RuntimeError as error:
+        raise click.ClickException(str(error))
+
+
+@commands.cli.command('search-reindex')
+def search_reindex():
+    """ Rebuild the search index from the tasks, events and committees """
+    click.echo('Indexed {} document(s)'.format(search.reindex()))
+
+
+@commands.cli.command('activity-rebuild')
+def activity_rebuild():
+    """ Recount the task analytics from the tasks and the activity log """
+    click.echo('Rebuilt the task summaries of {} event(s)'.format(activity.rebuild()))
+
+
+@commands.cli.command('assets-build')
+@click.option('--purge', is_flag=True,
+              help='Drop the CSS rules whose classes no template or script uses.')
+def assets_build(purge):
+    """ Fingerprint and precompress the static files into static/dist """
+    app = current_app
+    purge_with = None
+    if purge:
+        templates = os.path.join(app.root_path, app.template_folder)
+        purge_with = [os.path.join(templates, name) for name in os.listdir(templates)]
+        purge_with += [os.path.join(app.static_folder, name)
+                       for name in assets.sources(app.static_folder) if name.endswith('.js')]
+    manifest = assets.build(app.static_folder, assets.dist_folder(), purge_with)
+    for name, built in manifest.items():
+        size = os.path.getsize(os.path.join(assets.dist_folder(), built))
+        click.echo('{:<32} {:<40} {:>8} bytes'.format(name, built, size))
+
+
+@commands.cli.command('tokens-sweep')
+@click.option('--batch-size', default=1000, show_default=True,
+              help='Rows deleted per transaction.')
+def tokens_sweep(batch_size):
+    """ Delete the expired verification and password reset tokens """
+    click.echo('Deleted {} expired token(s)'.format(tokens.sweep(batch_size)))
+
+
+@commands.cli.command('tokens-migrate')
+def tokens_migrate():
+    """ Move the plaintext tokens of users.email_token to auth_tokens """
+    click.echo('Moved {} verification token(s)'.format(tokens.migrate_legacy()))
@@ -0,0 +1,181 @@
+#!/usr/bin/python3
+""" Event name resolution cache.
+
+    Every /<event_name>/... route starts by turning the name in the URL into
+    an event. The few fields the pages need (id, name and image) are cached
+    in an in-process LRU with a TTL, optionally backed by a SQLite file that
+    all the workers of a host share (EVENT_CACHE_PATH). Entries are dropped
+    whenever an event is created, renamed, re-imaged or deleted.
+"""
+import os
+import time
+import sqlite3
+import threading
+from collections import OrderedDict, namedtuple
+from flask import current_app
+from sqlalchemy import event as sa_event, inspect
+from sqlalchemy.orm import Session, object_session
+from event_plaza.models import Event
+from event_plaza.lookups import event_by_name
+
+
+EventInfo = namedtuple('EventInfo', ['id', 'name', 'image_file'])
+
+
+class MemoryStore():
+    """ A thread-safe LRU of EventInfo with a TTL """
+
+    def __init__(self, size=1024, ttl=300):
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[name]
+                return None
+            self._entries.move_to_end(name)
+            return entry[1]
+
+    def set(self, info):
+        with self._lock:
+            self._entries[info.name] = (time.monotonic() + self.ttl, info)
+            self._entries.move_to_end(info.name)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def delete(self, names):
+        with self._lock:
+            for name in names:
+                self._entries.pop(name, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SqliteStore():
+    """ A store in a local SQLite file, shared by the processes of a host """
+
+    def __init__(self, path, ttl=300):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connection().execute('CREATE TABLE IF NOT EXISTS event_names ('
+                                   'name TEXT PRIMARY KEY, id TEXT NOT NULL, '
+                                   'image_file TEXT, expires_at REAL NOT NULL)')
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            self._local.connection = connection
+        return connection
+
+    def get(self, name):
+        row = self._connection().execute(
+            'SELECT id, name, image_file FROM event_names WHERE name = ? AND expires_at > ?',
+            (name, time.time())).fetchone()
+        return EventInfo(*row) if row else None
+
+    def set(self, info):
+        self._connection().execute(
+            'INSERT OR REPLACE INTO event_names VALUES (?, ?, ?, ?)',
+            (info.name, info.id, info.image_file, time.time() + self.ttl))
+
+    def delete(self, names):
+        self._connection().executemany('DELETE FROM event_names WHERE name = ?',
+                                       [(name,) for name in names])
+
+    def clear(self):
+        self._connection().execute('DELETE FROM event_names')
+
+
+class EventNameCache():
+    """ The in-process LRU, in front of an optional shared store """
+
+    def __init__(self, local, shared=None):
+        self.local = local
+        self.shared = shared
+
+    def get(self, name):
+        info = self.local.get(name)
+        if info is None and self.shared is not None:
+            info = self.shared.get(name)
+            if info is not None:
+                self.local.set(info)
+        return info
+
+    def set(self, info):
+        self.local.set(info)
+        if self.shared is not None:
+            self.shared.set(info)
+
+    def invalidate(self, *names):
+        self.local.delete(names)
+        if self.shared is not None:
+            self.shared.delete(names)
+
+    def clear(self):
+        self.local.clear()
+        if self.shared is not None:
+            self.shared.clear()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """ Build the process' cache from the app config on first use """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                config = current_app.config
+                ttl = config.get('EVENT_CACHE_TTL', 300)
+                path = config.get('EVENT_CACHE_PATH')
+                _cache = EventNameCache(MemoryStore(config.get('EVENT_CACHE_SIZE', 1024), ttl),
+                                        SqliteStore(path, ttl) if path else None)
+    return _cache
+
+
+def resolve_event(name):
+    """ Return the EventInfo of the event with this name, or None """
+    cache = get_cache()
+    info = cache.get(name)
+    if info is None:
+        event = event_by_name(name)
+        if event is None:
+            return None
+        info = EventInfo(event.id, event.name, event.image_file)
+        cache.set(info)
+    return info
+
+
+@sa_event.listens_for(Event, 'after_insert')
+@sa_event.listens_for(Event, 'after_update')
+@sa_event.listens_for(Event, 'after_delete')
+def _event_changed(mapper, connection, target):
+    """ Drop the event's current and previous names, now and after the commit """
+    names = {target.name, *inspect(target).attrs.name.history.deleted}
+    if _cache is not None:
+        _cache.invalidate(*names)
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('event_cache_names', set()).update(names)
+
+
+@sa_event.listens_for(Session, 'after_commit')
+@sa_event.listens_for(Session, 'after_rollback')
+def _flush_changed(session):
+    names = session.info.pop('event_cache_names', ())
+    if names and _cache is not None:
+        _cache.invalidate(*names)
@@ -5,8 +5,8 @@ from flask_wtf.file import FileField, FileAllowed
 from flask_login import current_user
 from wtforms import StringField, PasswordField, SubmitField, BooleanField, TextAreaField, DateField, TimeField, SelectField
 from wtforms.validators import DataRequired, Length, Email, EqualTo, ValidationError
-from event_plaza import app
-from event_plaza.models import User, Event
+from event_plaza.lookups import user_by_email, event_by_name
+from event_plaza.cities import find as find_city
 
 
 class RegistrationForm(FlaskForm):
@@ -24,8 +24,7 @@ class RegistrationForm(FlaskForm):
 
     def validate_email(self, email):
         """ validate that the email is unique """
-        with app.app_context():
-            user = User.query.filter_by(email=email.data).first()
+        user = user_by_email(email.data)
         if user:
             raise ValidationError('That email is already Registered.')
 
@@ -51,37 +50,36 @@ class UpdateProfileForm(FlaskForm):
     def validate_email(self, email):
         """ validate that the email is unique """
         if email.data != current_user.email:
-            with app.app_context():
-                user = User.query.filter_by(email=email.data).first()
+            user = user_by_email(email.data)
             if user:
                 raise ValidationError('That email is already Registered.')
 
 class CreateEventForm(FlaskForm):
     """" Class for creating an event form """
-    import csv
-    with open('cities.csv', newline='') as csvfile:
-        spamreader = csv.reader(csvfile, delimiter=',', quotechar='"')
-        all_cities = [city[3] for city in spamreader]
-        all_cities.pop(0)
-
-    
     name = StringField('Name', validators=[DataRequired()])
     # Description limit is 1024 
     description = TextAreaField('Description', validators=[DataRequired(), Length(min=2, max=1024)])
     date = DateField('Date', format='%Y-%m-%d', validators=[DataRequired()])
     time = TimeField('Time', format='%H:%M', validators=[DataRequired()])
-    location = StringField('Location', validators=[DataRequired()])
-    location = SelectField('Location', choices=all_cities)
+    location = StringField('Location', validators=[DataRequired()],
+                           render_kw={"list": "cities", "autocomplete": "off",
+                                      "data-autocomplete": "cities"})
     picture = FileField('Event thumbnail', validators=[FileAllowed(['jpg', 'png'])])
     submit = SubmitField('Create Event')
 
     def validate_name(self, name):
         """ validate that the event name is unique """
-        with app.app_context():
-            event = Event.query.filter_by(name=name.data).first()
+        event = event_by_name(name.data)
         if event:
             raise ValidationError('That event name is already taken.')
 
+    def validate_location(self, location):
+        """ validate that the location is a known city, stored by its English name """
+        city = find_city(location.data)
+        if city is None:
+            raise ValidationError('Please pick a city from the list.')
+        location.data = city.name_en
+
 class AddUserToEventForm(FlaskForm):
     """ Class for adding a user to an event form """
     email = StringField('Email', validators=[DataRequired(), Email()], render_kw={"placeholder": "friend@mail.com"})
@@ -89,26 +87,41 @@ class AddUserToEventForm(FlaskForm):
     submit = SubmitField('Add User')
 
     def validate_email(self, email):
-        with app.app_context():
-            user = User.query.filter_by(email=email.data).first()
+        user = user_by_email(email.data)
         if user is None:
             raise ValidationError('There is no account with that email.')
 
 
+class BulkInviteForm(FlaskForm):
+    """ Class for adding many users to an event at once """
+    emails = TextAreaField('Emails', render_kw={"placeholder": "one email per line, optionally followed by ,manager", "spellcheck": "false"})
+    roster = FileField('Roster file', validators=[FileAllowed(['csv', 'txt'])])
+    role = SelectField('Default role', choices=[('organizer', 'Organizer'), ('manager', 'Manager')])
+    submit = SubmitField('Add Users')
+
+    def validate_emails(self, emails):
+        if not emails.data.strip() and not self.roster.data:
+            raise ValidationError('Enter some emails or upload a roster file.')
+
+
 class CreateTaskForm(FlaskForm):
     """ Class for creating a task form """
     name = StringField('Title', validators=[DataRequired(), Length(min=2, max=128)], render_kw={"placeholder": "Title", "spellcheck": "false"})
     description = TextAreaField('Description', validators=[DataRequired(), Length(min=2, max=1024)], render_kw={"placeholder": "Describe everything about this task here", "spellcheck": "false"})
     submit = SubmitField('Create')
 
+class ImportTasksForm(FlaskForm):
+    """ Class for the bulk task import form """
+    tasks = FileField('Tasks file', validators=[DataRequired(), FileAllowed(['csv', 'jsonl'])])
+    submit = SubmitField('Import')
+
 class RequestResetForm(FlaskForm):
     email = StringField('Email',
                         validators=[DataRequired(), Email()])
     submit = SubmitField('Request Password Reset')
 
     def validate_email(self, email):
-        with app.app_context():
-            user = User.query.filter_by(email=email.data).first()
+        user = user_by_email(email.data)
         if user is None:
             raise ValidationError('There is no account with that email. You must register first.')
 
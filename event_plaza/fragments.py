@@ -0,0 +1,268 @@
+#!/usr/bin/python3
+""" Cache of rendered page fragments, invalidated by version counters.
+
+    A task column is cached under its event, status and page cursor, and
+    the event cards of the home page under their user and page cursor.
+    Each of those groups has a version counter that is bumped whenever a
+    transaction changes what it shows (tasks created, moved, edited or
+    deleted; an organizer or manager added or removed; an event renamed),
+    and the version is part of the cache key: the stale fragments are
+    never read again and age out of the LRU. Fragments are rendered from
+    the primary, never from a replica that may not have the change yet.
+
+    Fragments live in an in-process LRU bounded by FRAGMENT_CACHE_BYTES,
+    optionally backed by a SQLite file that all the workers of a host
+    share (FRAGMENT_CACHE_PATH), which also holds the counters. Without it
+    every worker counts on its own, so a worker may serve a column changed
+    through another one until FRAGMENT_CACHE_TTL runs out.
+"""
+import os
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from flask import current_app, g, has_request_context
+from markupsafe import Markup
+from sqlalchemy import event as sa_event, inspect, select
+from sqlalchemy.orm import Session, object_session
+from event_plaza.models import User, Event, Task, TASK_STATUSES
+from event_plaza.models.event_tables import event_organizers
+from event_plaza.routing import reading_primary
+
+
+class MemoryStore():
+    """ A thread-safe LRU of fragments with a TTL, and the version counters """
+
+    def __init__(self, max_bytes=64 * 2 ** 20, ttl=60):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, html):
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic() + self.ttl, html)
+            self.size += len(html)
+            while self.size > self.max_bytes and self._entries:
+                self._drop(next(iter(self._entries)))
+
+    def _drop(self, key):
+        self.size -= len(self._entries.pop(key)[1])
+
+    def version(self, group):
+        with self._lock:
+            return self._versions.get(group, 0)
+
+    def bump(self, groups):
+        with self._lock:
+            for group in groups:
+                self._versions[group] = self._versions.get(group, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+class SqliteStore():
+    """ A store in a local SQLite file, shared by the processes of a host """
+
+    def __init__(self, path, ttl=60):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        connection = self._connection()
+        connection.execute('CREATE TABLE IF NOT EXISTS fragments ('
+                           'key TEXT PRIMARY KEY, html TEXT NOT NULL, expires_at REAL NOT NULL)')
+        connection.execute('CREATE TABLE IF NOT EXISTS fragment_versions ('
+                           'name TEXT PRIMARY KEY, version INTEGER NOT NULL)')
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            self._local.connection = connection
+        return connection
+
+    def get(self, key):
+        row = self._connection().execute(
+            'SELECT html FROM fragments WHERE key = ? AND expires_at > ?',
+            (key, time.time())).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, html):
+        connection = self._connection()
+        connection.execute('INSERT OR REPLACE INTO fragments VALUES (?, ?, ?)',
+                           (key, html, time.time() + self.ttl))
+        # Outdated versions are never read again
+        connection.execute('DELETE FROM fragments WHERE expires_at < ?', (time.time(),))
+
+    def version(self, group):
+        row = self._connection().execute(
+            'SELECT version FROM fragment_versions WHERE name = ?', (group,)).fetchone()
+        return row[0] if row else 0
+
+    def bump(self, groups):
+        self._connection().executemany(
+            'INSERT INTO fragment_versions VALUES (?, 1) '
+            'ON CONFLICT (name) DO UPDATE SET version = version + 1',
+            [(group,) for group in groups])
+
+    def clear(self):
+        self._connection().execute('DELETE FROM fragments')
+
+
+class FragmentCache():
+    """ The in-process LRU, in front of an optional shared store """
+
+    def __init__(self, local, shared=None):
+        self.local = local
+        self.shared = shared
+
+    def version(self, group):
+        return (self.shared or self.local).version(group)
+
+    def get(self, key):
+        html = self.local.get(key)
+        if html is None and self.shared is not None:
+            html = self.shared.get(key)
+            if html is not None:
+                self.local.set(key, html)
+        return html
+
+    def set(self, key, html):
+        self.local.set(key, html)
+        if self.shared is not None:
+            self.shared.set(key, html)
+
+    def bump(self, *groups):
+        (self.shared or self.local).bump(groups)
+
+    def clear(self):
+        self.local.clear()
+        if self.shared is not None:
+            self.shared.clear()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """ Build the process' cache from the app config on first use """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                config = current_app.config
+                ttl = config.get('FRAGMENT_CACHE_TTL', 60)
+                path = config.get('FRAGMENT_CACHE_PATH')
+                _cache = FragmentCache(
+                    MemoryStore(config.get('FRAGMENT_CACHE_BYTES', 64 * 2 ** 20), ttl),
+                    SqliteStore(path, ttl) if path else None)
+    return _cache
+
+
+def tasks_group(event_id, status):
+    return 'tasks:{}:{}'.format(event_id, status)
+
+
+def events_group(user_id):
+    return 'events:{}'.format(user_id)
+
+
+def cached(group, part, render):
+    """ Return the fragment of a group (part tells its pages apart), calling
+        render() to build it on a miss
+    """
+    if not current_app.config.get('FRAGMENT_CACHE', True):
+        return Markup(render())
+    cache = get_cache()
+    key = '{}@{}:{}'.format(group, cache.version(group), part or '')
+    html = cache.get(key)
+    if html is None:
+        g.fragment_incomplete = False
+        # A lagging replica would cache what the group showed before its
+        # version was bumped, for every client until the TTL runs out
+        with reading_primary():
+            html = render()
+        if not g.pop('fragment_incomplete'):
+            cache.set(key, html)
+    return Markup(html)
+
+
+def incomplete():
+    """ Keep the fragment being rendered out of the cache, e.g. because it
+        shows a placeholder for a picture that is still being rendered
+    """
+    if has_request_context():
+        g.fragment_incomplete = True
+
+
+def bump(session, *groups):
+    """ Outdate the fragments of groups now, and again once the transaction
+        ends, so that a page rendered in between is not kept
+    """
+    if _cache is not None:
+        _cache.bump(*groups)
+    if session is not None:
+        session.info.setdefault('fragment_groups', set()).update(groups)
+
+
+@sa_event.listens_for(Session, 'after_commit')
+@sa_event.listens_for(Session, 'after_rollback')
+def _flush_bumped(session):
+    groups = session.info.pop('fragment_groups', ())
+    if groups and _cache is not None:
+        _cache.bump(*groups)
+
+
+@sa_event.listens_for(Task, 'after_insert')
+@sa_event.listens_for(Task, 'after_update')
+@sa_event.listens_for(Task, 'after_delete')
+def _task_changed(mapper, connection, target):
+    statuses = {target.status, *inspect(target).attrs.status.history.deleted}
+    bump(object_session(target), *(tasks_group(target.event_id, status) for status in statuses))
+
+
+@sa_event.listens_for(Event, 'after_update')
+def _event_changed(mapper, connection, target):
+    """ Columns and cards link to the event by name, and cards show it """
+    organizers = connection.execute(select(event_organizers.c.user_id)
+                                    .where(event_organizers.c.event_id == target.id))
+    bump(object_session(target), *(tasks_group(target.id, status) for status in TASK_STATUSES),
+         *(events_group(user_id) for user_id, in organizers))
+
+
+def _watch(attribute, user_is_target):
+    """ Outdate the event cards of the affected user whenever a role
+        collection shown on them changes
+    """
+    def on_change(target, value, initiator):
+        session = object_session(target) or object_session(value)
+        bump(session, events_group(target.id if user_is_target else value.id))
+    sa_event.listen(attribute, 'append', on_change)
+    sa_event.listen(attribute, 'remove', on_change)
+
+
+for _attribute in (Event.organizer, Event.managers):
+    _watch(_attribute, user_is_target=False)
+for _attribute in (User.organized_events, User.managed_events):
+    _watch(_attribute, user_is_target=True)
@@ -0,0 +1,266 @@
+#!/usr/bin/python3
+""" Uploaded pictures pipeline and store.
+
+    An upload is written as-is to a staging directory and the request moves
+    on. A process pool then renders the fixed set of variants each kind of
+    picture needs, as progressive JPEG or WebP (IMAGE_FORMAT), into the
+    static directory. Until the variant a page asks for exists, the page
+    shows the default picture instead.
+
+    Pictures are stored under the digest of their content and counted in
+    the `pictures` table: uploading the same picture twice reuses its files,
+    and files nobody references any more are removed by collect_garbage().
+    Since a file name never changes content, they are served with strong
+    ETags and an immutable Cache-Control.
+"""
+import os
+import re
+import secrets
+import hashlib
+import time
+import tempfile
+import logging
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+from flask import current_app, url_for, send_from_directory, abort
+from sqlalchemy.exc import IntegrityError
+from event_plaza import db
+from event_plaza.models import Picture
+from event_plaza.metrics import IMAGE_SECONDS
+from event_plaza import fragments
+from event_plaza.assets import asset_url
+
+
+# kind: (static directory, placeholder, {variant: (width, height, crop)})
+KINDS = {
+    'profile': ('profile_pics', 'default.jpg', {
+        'avatar': (80, 80, True),
+        'large': (480, 480, True),
+    }),
+    'event': ('event_pics', 'event_default.jpg', {
+        'card': (896, 480, True),
+    }),
+}
+FORMATS = {
+    'jpeg': ('jpg', {'format': 'JPEG', 'quality': 85, 'optimize': True, 'progressive': True}),
+    'webp': ('webp', {'format': 'WEBP', 'quality': 80, 'method': 4}),
+}
+
+CACHE_MAX_AGE = 365 * 24 * 3600
+STORED_NAME = re.compile(r'^[0-9a-f]+_[a-z]+\.[a-z]+$')
+
+_pool = None
+logger = logging.getLogger(__name__)
+
+
+def render_variants(staging_path, directory, key, variants, image_format):
+    """ Render every variant of a staged upload, then drop the upload.
+        Runs in a worker process.
+    """
+    from PIL import Image, ImageOps
+    extension, options = FORMATS[image_format]
+    try:
+        with Image.open(staging_path) as original:
+            original = ImageOps.exif_transpose(original)
+            if image_format == 'jpeg' or original.mode not in ('RGB', 'RGBA'):
+                original = original.convert('RGB')
+            for variant, (width, height, crop) in variants.items():
+                if crop:
+                    picture = ImageOps.fit(original, (width, height), Image.LANCZOS)
+                else:
+                    picture = original.copy()
+                    picture.thumbnail((width, height), Image.LANCZOS)
+                path = os.path.join(directory, variant_filename(key, variant, extension))
+                # Write next to the final name and rename, so a page never
+                # serves a half written file; each render has its own file,
+                # the same picture uploaded twice is rendered twice at once
+                descriptor, temporary = tempfile.mkstemp(dir=directory, suffix='.tmp')
+                try:
+                    with os.fdopen(descriptor, 'wb') as output:
+                        picture.save(output, **options)
+                    os.chmod(temporary, 0o644)
+                    os.replace(temporary, path)
+                except BaseException:
+                    os.unlink(temporary)
+                    raise
+    finally:
+        os.remove(staging_path)
+
+
+class InvalidPicture(ValueError):
+    """ Raised for an upload that is not a whole picture """
+
+
+def check_picture(path):
+    """ Raise InvalidPicture unless a staged upload is a picture Pillow can
+        render, so a broken one is turned down in the request rather than
+        failing in the pool after its key was stored
+    """
+    from PIL import Image
+    try:
+        with Image.open(path) as picture:
+            picture.verify()
+        with Image.open(path) as picture:
+            if picture.format == 'JPEG':
+                # verify() does not read a JPEG's scans: decoding them at an
+                # eighth of the size reads them all, and notices a truncation
+                picture.draft('RGB', (picture.width // 8, picture.height // 8))
+                picture.load()
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as error:
+        raise InvalidPicture(str(error))
+
+
+def _log_failure(future):
+    if future.exception() is not None:
+        logger.error('Rendering picture variants failed', exc_info=future.exception())
+
+
+def _timer(submitted):
+    """ Return a done callback observing the rendering time, queueing included """
+    def observe(future):
+        IMAGE_SECONDS.observe(time.perf_counter() - submitted, step='render')
+    return observe
+
+
+def _get_pool(workers):
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=workers)
+    return _pool
+
+
+def variant_filename(key, variant, extension):
+    return '{}_{}.{}'.format(key, variant, extension)
+
+
+def acquire(kind, key):
+    """ Count one more reference to a stored picture """
+    now = datetime.now()
+    counted = Picture.query.filter_by(kind=kind, digest=key) \
+        .update({Picture.refcount: Picture.refcount + 1, Picture.updated_at: now})
+    if counted:
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.add(Picture(kind=kind, digest=key, refcount=1))
+    except IntegrityError:
+        # Somebody else stored the same picture meanwhile
+        acquire(kind, key)
+
+
+def release(kind, key):
+    """ Count one reference less to a picture, if it lives in the store """
+    if not key or '.' in key:
+        return
+    Picture.query.filter(Picture.kind == kind, Picture.digest == key, Picture.refcount > 0) \
+        .update({Picture.refcount: Picture.refcount - 1, Picture.updated_at: datetime.now()})
+
+
+def save_picture(form_picture, event=False):
+    """ Stage an uploaded picture and schedule its variants.
+        Return the key to store in the model's image_file; the caller commits
+        the reference it adds to the picture. Raise InvalidPicture for a
+        file that is not a whole picture.
+    """
+    with IMAGE_SECONDS.time(step='request'):
+        return _save_picture(form_picture, event)
+
+
+def _save_picture(form_picture, event):
+    app = current_app
+    kind = 'event' if event else 'profile'
+    directory, _, variants = KINDS[kind]
+    image_format = app.config.get('IMAGE_FORMAT', 'jpeg')
+    _, f_ext = os.path.splitext(form_picture.filename)
+    staging = app.config.get('IMAGE_STAGING_DIR') or \
+        os.path.join(app.instance_path, 'image_staging')
+    os.makedirs(staging, exist_ok=True)
+    staging_path = os.path.join(staging, secrets.token_hex(8) + f_ext.lower())
+    digest = hashlib.sha256()
+    with open(staging_path, 'wb') as staged:
+        for chunk in iter(lambda: form_picture.stream.read(64 * 1024), b''):
+            digest.update(chunk)
+            staged.write(chunk)
+    key = digest.hexdigest()[:32]
+    try:
+        check_picture(staging_path)
+    except InvalidPicture:
+        os.remove(staging_path)
+        raise
+    acquire(kind, key)
+
+    output = os.path.join(app.static_folder, directory)
+    extension = FORMATS[image_format][0]
+    if all(os.path.exists(os.path.join(output, variant_filename(key, variant, extension)))
+           for variant in variants):
+        os.remove(staging_path)
+        return key
+    job = (staging_path, output, key, variants, image_format)
+    workers = app.config.get('IMAGE_WORKERS', 2)
+    if workers <= 0:
+        with IMAGE_SECONDS.time(step='render'):
+            render_variants(*job)
+    else:
+        future = _get_pool(workers).submit(render_variants, *job)
+        future.add_done_callback(_log_failure)
+        future.add_done_callback(_timer(time.perf_counter()))
+    return key
+
+
+def picture_url(kind, image_file, variant):
+    """ Return the url of a variant of a picture.
+
+        Pictures saved before the pipeline existed are stored with their
+        extension and have no variants; they are served as they are.
+    """
+    directory, placeholder, _ = KINDS[kind]
+    if '.' in image_file:
+        return asset_url('{}/{}'.format(directory, image_file))
+    preferred = FORMATS[current_app.config.get('IMAGE_FORMAT', 'jpeg')][0]
+    for extension in [preferred] + [ext for ext, _ in FORMATS.values() if ext != preferred]:
+        filename = variant_filename(image_file, variant, extension)
+        if os.path.exists(os.path.join(current_app.static_folder, directory, filename)):
+            return url_for('main.media', kind=kind, filename=filename)
+    # Not rendered yet: pages showing the placeholder must not be cached
+    fragments.incomplete()
+    return asset_url('{}/{}'.format(directory, placeholder))
+
+
+def send_picture(kind, filename):
+    """ Serve a stored picture, which browsers may cache forever """
+    if kind not in KINDS or not STORED_NAME.match(filename):
+        abort(404)
+    response = send_from_directory(os.path.join(current_app.static_folder, KINDS[kind][0]),
+                                   filename, etag=filename.split('.')[0],
+                                   max_age=CACHE_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+def collect_garbage(grace=timedelta(hours=1)):
+    """ Remove the files of pictures nobody referenced for a while.
+        Return how many pictures were removed.
+    """
+    removed = 0
+    unused = db.session.query(Picture.id, Picture.kind, Picture.digest) \
+        .filter(Picture.refcount <= 0, Picture.updated_at < datetime.now() - grace).all()
+    for picture_id, kind, digest in unused:
+        deleted = Picture.query.filter(Picture.id == picture_id, Picture.refcount <= 0) \
+            .delete(synchronize_session=False)
+        if not deleted:
+            db.session.rollback()
+            continue
+        # The deleted row stays locked until the commit, so a save_picture of
+        # the same content waits for the files to be gone and renders them again
+        directory = os.path.join(current_app.static_folder, KINDS[kind][0])
+        try:
+            for filename in os.listdir(directory):
+                if filename.startswith(digest + '_'):
+                    os.remove(os.path.join(directory, filename))
+        except OSError:
+            db.session.rollback()
+            raise
+        db.session.commit()
+        removed += 1
+    return removed
@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+""" Adding many users to an event at once.
+
+    A roster of emails is resolved to users with one IN query per chunk,
+    and the memberships are written with one multi-row INSERT per role
+    table that ignores the rows already there, instead of appending users
+    to the event's relationships one by one.
+"""
+import re
+from event_plaza import db
+from event_plaza.models import User
+from event_plaza.models.event_tables import event_organizers, event_managers
+from event_plaza import permissions, fragments
+from event_plaza.sql import insert_ignore
+
+
+ROLES = ('organizer', 'manager')
+MAX_ENTRIES = 1000
+IN_CHUNK = 500
+EMAIL = re.compile(r'^[^@\s,;]+@[^@\s,;]+\.[^@\s,;]+$')
+
+# What happened to each email of a roster
+ADDED = 'added'
+ALREADY_IN_EVENT = 'already in the event'
+UNKNOWN_USER = 'no account with this email'
+INVALID_EMAIL = 'not a valid email'
+INVALID_ROLE = 'unknown role'
+
+
+def parse_roster(text, default_role='organizer'):
+    """ Return the (email, role) entries of a roster, one "email[,role]"
+        per line; blank lines and repeated emails are skipped.
+    """
+    entries, seen = [], set()
+    for line in text.splitlines():
+        fields = [field.strip() for field in re.split(r'[,;\t]', line)]
+        if not fields[0]:
+            continue
+        email = fields[0]
+        role = (fields[1].lower() if len(fields) > 1 and fields[1] else default_role)
+        if email.lower() in seen:
+            continue
+        seen.add(email.lower())
+        entries.append((email, role))
+    return entries
+
+
+def _users_by_email(emails):
+    users = {}
+    for start in range(0, len(emails), IN_CHUNK):
+        chunk = emails[start:start + IN_CHUNK]
+        for user_id, email in db.session.query(User.id, User.email) \
+                .filter(User.email.in_(chunk)):
+            users[email.lower()] = user_id
+    return users
+
+
+def _organizers(event_id, user_ids):
+    found = set()
+    for start in range(0, len(user_ids), IN_CHUNK):
+        chunk = user_ids[start:start + IN_CHUNK]
+        found.update(user_id for user_id, in db.session.query(event_organizers.c.user_id)
+                     .filter(event_organizers.c.event_id == event_id,
+                             event_organizers.c.user_id.in_(chunk)))
+    return found
+
+
+def add_users(event_id, entries):
+    """ Add the users of (email, role) entries to an event and commit.
+
+        Like adding a single user, everybody becomes an organizer and
+        managers are organizers too; users already organizing the event are
+        left as they are. Return a list of (email, role, result).
+    """
+    valid = [email for email, role in entries if EMAIL.match(email) and role in ROLES]
+    users = _users_by_email(valid)
+    existing = _organizers(event_id, list(users.values()))
+
+    report, organizers, managers = [], [], []
+    for email, role in entries:
+        user_id = users.get(email.lower())
+        if not EMAIL.match(email):
+            result = INVALID_EMAIL
+        elif role not in ROLES:
+            result = INVALID_ROLE
+        elif user_id is None:
+            result = UNKNOWN_USER
+        elif user_id in existing:
+            result = ALREADY_IN_EVENT
+        else:
+            result = ADDED
+            existing.add(user_id)
+            organizers.append({'event_id': event_id, 'user_id': user_id})
+            if role == 'manager':
+                managers.append({'event_id': event_id, 'user_id': user_id})
+        report.append((email, role, result))
+
+    insert_ignore(event_organizers, organizers)
+    insert_ignore(event_managers, managers)
+    fragments.bump(db.session, *(fragments.events_group(row['user_id']) for row in organizers))
+    db.session.commit()
+    permissions.invalidate(*(row['user_id'] for row in organizers))
+    return report
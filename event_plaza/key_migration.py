@@ -0,0 +1,71 @@
+#!/usr/bin/python3
+""" Copy a database into the app's database, converting its keys.
+
+    The target schema is created with the current key strategy (see
+    models/keys.py), so copying a database made with string keys into an
+    app running with EVENTPLAZA_KEYS=binary converts every key and foreign
+    key to BINARY(16) on the way. With rekey, random uuid4 keys are also
+    replaced by time-ordered ones made from each row's created_at, and every
+    foreign key is rewritten to match; the old to new key map is kept in
+    memory for the whole copy.
+"""
+import uuid
+from sqlalchemy import create_engine, MetaData, select, func
+from event_plaza import db
+from event_plaza.models.keys import Key, uuid7
+
+
+def _as_string(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return str(uuid.UUID(bytes=bytes(value)))
+    return value
+
+
+def _key_map(source, tables):
+    mapping = {}
+    with source.connect() as connection:
+        for table in tables:
+            if 'id' not in table.c or 'created_at' not in table.c:
+                continue
+            rows = connection.execution_options(stream_results=True, yield_per=10000) \
+                .execute(select(table.c.id, table.c.created_at))
+            for key, created_at in rows:
+                timestamp = created_at.timestamp() if created_at is not None else None
+                mapping[_as_string(key)] = str(uuid7(timestamp))
+    return mapping
+
+
+def copy_database(source_url, rekey=False, batch_size=1000):
+    """ Copy every table of the source database into the app's empty one.
+        Yield (table name, rows copied) as each table is done.
+    """
+    source = create_engine(source_url)
+    source_tables = MetaData()
+    source_tables.reflect(source)
+    db.create_all()
+    tables = [table for table in db.metadata.sorted_tables if table.name in source_tables.tables]
+    for table in tables:
+        if db.session.execute(select(func.count()).select_from(table)).scalar():
+            raise RuntimeError('The table {} of the target database is not empty'.format(table.name))
+    mapping = _key_map(source, [source_tables.tables[table.name] for table in tables]) \
+        if rekey else {}
+
+    for table in tables:
+        origin = source_tables.tables[table.name]
+        columns = [column.name for column in table.c if column.name in origin.c]
+        keys = [column.name for column in table.c
+                if column.name in origin.c and isinstance(column.type, Key)]
+        copied = 0
+        with source.connect() as connection:
+            result = connection.execution_options(stream_results=True, yield_per=batch_size) \
+                .execute(select(*(origin.c[name] for name in columns)))
+            for partition in result.partitions(batch_size):
+                rows = [dict(zip(columns, row)) for row in partition]
+                for row in rows:
+                    for name in keys:
+                        key = _as_string(row[name])
+                        row[name] = mapping.get(key, key)
+                db.session.execute(table.insert(), rows)
+                db.session.commit()
+                copied += len(rows)
+        yield table.name, copied
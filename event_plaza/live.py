@@ -0,0 +1,236 @@
+#!/usr/bin/python3
+""" Live task updates over Server-Sent Events.
+
+    Task changes are published, once their transaction commits, to a hub
+    as small deltas (task.created, task.moved, task.updated, task.deleted,
+    tasks.imported, tasks.changed) on a channel per event. Every open dashboard holds an
+    SSE stream subscribed to its event's channel, instead of polling.
+
+    The hub is in-process by default, which is enough for a single worker.
+    With several workers or hosts set LIVE_BROKER to a redis:// URL: every
+    process then publishes through Redis and fans the messages of its
+    subscribed channels out to its own streams.
+
+    An idle stream is a queue and a suspended generator; it only occupies a
+    thread under a threaded server, so run the app with an async worker
+    (e.g. gunicorn -k gevent) to hold thousands of them per process.
+"""
+import json
+import threading
+from collections import deque
+from flask import current_app
+from sqlalchemy import event as sa_event, inspect
+from sqlalchemy.orm import Session
+from event_plaza.models import Task
+from event_plaza.models.base_model import time as TIME_FORMAT
+
+
+# Closes the stream of a subscriber that stopped reading (it reconnects)
+CLOSED = object()
+
+
+class Subscription():
+    """ The messages of one channel waiting for one stream """
+
+    def __init__(self, hub, channel, size):
+        self.hub = hub
+        self.channel = channel
+        self.size = size
+        self.closed = False
+        # A deque and one condition: a queue.Queue weighs three times as much
+        self.messages = deque()
+        self._ready = threading.Condition(threading.Lock())
+
+    def put(self, message):
+        with self._ready:
+            if self.closed:
+                return
+            if len(self.messages) >= self.size:
+                self.closed, message = True, CLOSED
+            self.messages.append(message)
+            self._ready.notify()
+        if message is CLOSED:
+            self.hub.unsubscribe(self)
+
+    def get(self, timeout):
+        """ Return the next message, None after timeout seconds without one """
+        with self._ready:
+            if not self.messages:
+                self._ready.wait(timeout)
+            return self.messages.popleft() if self.messages else None
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+
+class MemoryHub():
+    """ Delivers the messages to the subscribers of this process only """
+
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel):
+        subscription = Subscription(self, channel, self.queue_size)
+        with self._lock:
+            self._channels.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._channels.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._channels[subscription.channel]
+
+    def publish(self, channel, message):
+        self.deliver(channel, message)
+
+    def deliver(self, channel, message):
+        """ Hand a message to the local subscribers of its channel """
+        with self._lock:
+            subscribers = list(self._channels.get(channel, ()))
+        for subscription in subscribers:
+            subscription.put(message)
+
+    def count(self):
+        """ Return the number of open subscriptions """
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._channels.values())
+
+
+class RedisHub(MemoryHub):
+    """ Publishes through Redis, so every process sees every message.
+
+        One thread per process listens to all the channels and hands their
+        messages to the local subscribers.
+    """
+
+    def __init__(self, url, queue_size=100, prefix='eventplaza:live:'):
+        import redis
+        super().__init__(queue_size)
+        self.prefix = prefix
+        self.client = redis.Redis.from_url(url)
+        self._listener = threading.Thread(target=self._listen, daemon=True,
+                                          name='live-listener')
+        self._listener.start()
+
+    def publish(self, channel, message):
+        self.client.publish(self.prefix + channel, json.dumps(message))
+
+    def _listen(self):
+        import redis
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(self.prefix + '*')
+                for item in pubsub.listen():
+                    channel = item['channel'].decode()[len(self.prefix):]
+                    self.deliver(channel, json.loads(item['data']))
+            except redis.ConnectionError:
+                # Messages published until it is back are lost
+                threading.Event().wait(1)
+
+
+_hub = None
+_hub_lock = threading.Lock()
+
+
+def get_hub():
+    """ Build the process' hub from the app config on first use """
+    global _hub
+    if _hub is None:
+        with _hub_lock:
+            if _hub is None:
+                config = current_app.config
+                broker = config.get('LIVE_BROKER', 'memory')
+                size = config.get('LIVE_QUEUE_SIZE', 100)
+                _hub = MemoryHub(size) if broker == 'memory' else RedisHub(broker, size)
+    return _hub
+
+
+def channel_of(event_id):
+    return str(event_id)
+
+
+def stream(hub, channel, heartbeat=15):
+    """ Yield the SSE stream of a channel until the client leaves.
+
+        The channel is subscribed when the stream starts, not before: a
+        response that is never read (a HEAD request, a client gone before
+        the first write) holds no subscription.
+
+        A comment is sent every heartbeat seconds without messages, which
+        keeps proxies from closing the connection and notices departed
+        clients (the write fails), so their subscription is dropped.
+    """
+    subscription = hub.subscribe(channel)
+    try:
+        yield 'retry: 5000\n\n'
+        while True:
+            message = subscription.get(heartbeat)
+            if message is CLOSED:
+                return
+            if message is None:
+                yield ': ping\n\n'
+                continue
+            yield 'event: {}\ndata: {}\n\n'.format(message['type'], json.dumps(message))
+    finally:
+        subscription.close()
+
+
+def task_message(kind, target, **extra):
+    """ Return the delta message of a task change """
+    created_at = target.created_at.strftime(TIME_FORMAT) if target.created_at else None
+    return {'type': kind, 'task': {'id': target.id, 'name': target.name,
+                                   'status': target.status, 'created_at': created_at},
+            **extra}
+
+
+def publish_after_commit(session, event_id, message):
+    """ Publish a message to an event's channel once the session commits """
+    session.info.setdefault('live_messages', []).append((channel_of(event_id), message))
+
+
+@sa_event.listens_for(Session, 'after_commit')
+def _committed(session):
+    messages = session.info.pop('live_messages', None)
+    if messages:
+        hub = get_hub()
+        for channel, message in messages:
+            try:
+                hub.publish(channel, message)
+            except Exception:
+                current_app.logger.exception('Publishing a live update failed')
+
+
+@sa_event.listens_for(Session, 'after_rollback')
+def _rolled_back(session):
+    session.info.pop('live_messages', None)
+
+
+@sa_event.listens_for(Task, 'after_insert')
+def _created(mapper, connection, target):
+    publish_after_commit(inspect(target).session, target.event_id,
+                         task_message('task.created', target))
+
+
+@sa_event.listens_for(Task, 'after_update')
+def _updated(mapper, connection, target):
+    state = inspect(target)
+    status = state.attrs.status.history
+    if status.has_changes() and status.deleted:
+        message = task_message('task.moved', target, previous=status.deleted[0])
+    elif any(state.attrs[name].history.has_changes() for name in ('name', 'description')):
+        message = task_message('task.updated', target)
+    else:
+        return
+    publish_after_commit(state.session, target.event_id, message)
+
+
+@sa_event.listens_for(Task, 'after_delete')
+def _deleted(mapper, connection, target):
+    publish_after_commit(inspect(target).session, target.event_id,
+                         task_message('task.deleted', target))
@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+""" Request-scoped memoization of keyed lookups.
+
+    A single request used to fetch the same row several times: the user
+    loader, a form validator and the view would each SELECT the same user by
+    id or email. The helpers below remember every user/event they return
+    (and misses too) in `flask.g`, under all of its keys, so the forms,
+    routes and user loader share one lookup per key and per request.
+"""
+import threading
+from flask import g, has_app_context
+from event_plaza import db
+from event_plaza.models import User, Event
+
+
+_totals = {'hits': 0, 'misses': 0}
+_totals_lock = threading.Lock()
+
+
+def _cache():
+    if not has_app_context():
+        return None
+    if 'lookups' not in g:
+        g.lookups = {}
+        g.lookup_stats = {'hits': 0, 'misses': 0}
+    return g.lookups
+
+
+def _count(outcome):
+    g.lookup_stats[outcome] += 1
+    with _totals_lock:
+        _totals[outcome] += 1
+
+
+def _keys(obj):
+    """ Return every key an object can be looked up with """
+    if isinstance(obj, User):
+        return [('user', 'id', obj.id), ('user', 'email', obj.email)]
+    if isinstance(obj, Event):
+        return [('event', 'id', obj.id), ('event', 'name', obj.name)]
+    return []
+
+
+def _lookup(key, query):
+    cache = _cache()
+    if cache is None:
+        return query()
+    if key in cache:
+        _count('hits')
+        return cache[key]
+    _count('misses')
+    obj = query()
+    cache[key] = obj
+    if obj is not None:
+        for other in _keys(obj):
+            cache[other] = obj
+    return obj
+
+
+def user_by_id(user_id):
+    """ Return the user with this id, or None """
+    return _lookup(('user', 'id', user_id), lambda: db.session.get(User, user_id))
+
+
+def user_by_email(email):
+    """ Return the user with this email, or None """
+    return _lookup(('user', 'email', email),
+                   lambda: User.query.filter_by(email=email).first())
+
+
+def event_by_id(event_id):
+    """ Return the event with this id, or None """
+    return _lookup(('event', 'id', event_id), lambda: db.session.get(Event, event_id))
+
+
+def event_by_name(name):
+    """ Return the event with this name, or None """
+    return _lookup(('event', 'name', name),
+                   lambda: Event.query.filter_by(name=name).first())
+
+
+def remember(obj):
+    """ Record a freshly created or renamed object so earlier misses are replaced """
+    cache = _cache()
+    if cache is not None:
+        for key in _keys(obj):
+            cache[key] = obj
+
+
+def stats():
+    """ Return the hits and misses of the current request and of the process """
+    current = g.get('lookup_stats', {'hits': 0, 'misses': 0}) if has_app_context() else {}
+    with _totals_lock:
+        return {'request': dict(current), 'total': dict(_totals)}
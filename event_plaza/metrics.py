@@ -0,0 +1,239 @@
+#!/usr/bin/python3
+""" Request instrumentation, exported in the Prometheus text format.
+
+    Every request is timed, along with the SQL statements it runs (counted
+    and timed through the engine events), the templates it renders, and the
+    bcrypt, picture and email work it does. The histograms are served on
+    /metrics; they belong to the process, so scrape every worker.
+
+    A request that runs the same statement (parameters aside) more than
+    METRICS_N_PLUS_ONE times is logged as a probable N+1 query, typically a
+    relationship lazy-loaded for every row of a page. With METRICS_HEADER
+    (debug mode by default) every response also reports its statement count
+    in X-SQL-Statements, which the load benchmark checks against budgets.
+"""
+import re
+import time
+import threading
+from bisect import bisect_left
+from collections import Counter as StatementCounter
+from contextlib import contextmanager
+from flask import current_app, g, has_request_context, request
+from flask import before_render_template, template_rendered
+from sqlalchemy import event as sa_event
+from sqlalchemy.engine import Engine
+
+
+SECONDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENTS = (1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+
+_metrics = []
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, str(value).replace('\\', r'\\')
+                                           .replace('"', r'\"').replace('\n', r'\n'))
+                          for name, value in zip(names, values)) + '}'
+
+
+class Counter():
+    """ A Prometheus counter, per combination of label values """
+
+    kind = 'counter'
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield self.name + _labels(self.labels, key), value
+
+
+class Histogram():
+    """ A Prometheus histogram, per combination of label values """
+
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=SECONDS):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        # label values: (count per bucket, the last one for +Inf, sum)
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0)
+            counts[bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        """ Observe how long the with block takes """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = sorted((key, (counts[:], total)) for key, (counts, total)
+                            in self._values.items())
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                yield self.name + '_bucket' + _labels(self.labels + ('le',), key + (bound,)), \
+                    cumulative
+            yield self.name + '_sum' + _labels(self.labels, key), total
+            yield self.name + '_count' + _labels(self.labels, key), cumulative
+
+
+REQUEST_SECONDS = Histogram('eventplaza_request_duration_seconds',
+                            'Time to build the response of a request',
+                            ('endpoint', 'method', 'status'))
+SQL_STATEMENTS = Histogram('eventplaza_request_sql_statements',
+                           'SQL statements run by a request', ('endpoint',), STATEMENTS)
+SQL_SECONDS = Histogram('eventplaza_request_sql_seconds',
+                        'Time a request spent running SQL statements', ('endpoint',))
+TEMPLATE_SECONDS = Histogram('eventplaza_template_render_seconds',
+                             'Time to render a template', ('template',))
+BCRYPT_SECONDS = Histogram('eventplaza_bcrypt_seconds',
+                           'Time to hash or check a password, queueing included',
+                           ('operation',), SECONDS + (20, 30))
+IMAGE_SECONDS = Histogram('eventplaza_image_seconds',
+                          'Time a request spent saving an upload, and to render its variants',
+                          ('step',), SECONDS + (20, 30, 60))
+EMAIL_ENQUEUE_SECONDS = Histogram('eventplaza_email_enqueue_seconds',
+                                  'Time to queue an email in the outbox')
+N_PLUS_ONE = Counter('eventplaza_n_plus_one_total',
+                     'Requests that repeated a statement more than METRICS_N_PLUS_ONE times',
+                     ('endpoint',))
+
+
+def render():
+    """ Return every metric in the Prometheus text format """
+    lines = []
+    for metric in _metrics:
+        lines.append('# HELP {} {}'.format(metric.name, metric.description))
+        lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+        lines.extend('{} {}'.format(name, value) for name, value in metric.samples())
+    return '\n'.join(lines) + '\n'
+
+
+def shape(statement):
+    """ Return a statement with its IN lists collapsed, so that the lookups
+        of an N+1 loop all have the same shape
+    """
+    return re.sub(r'\bIN \([^()]*\)', 'IN (...)', statement)
+
+
+class RequestStats():
+    """ What a request did so far """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.sql_seconds = 0
+        self.statements = StatementCounter()
+        self.templates = []
+        self.done = False
+
+
+def _endpoint():
+    return request.endpoint or 'unmatched'
+
+
+def _started():
+    g.metrics = RequestStats()
+
+
+def _finished(response):
+    _observe(response.status_code)
+    if current_app.config.get('METRICS_HEADER', current_app.debug):
+        response.headers['X-SQL-Statements'] = str(sum(g.metrics.statements.values()))
+    return response
+
+
+def _torn_down(error):
+    # Requests that raised never reach the after_request handlers
+    if g.get('metrics') is not None and not g.metrics.done:
+        _observe(500)
+
+
+def _observe(status):
+    stats = g.metrics
+    stats.done = True
+    endpoint = _endpoint()
+    REQUEST_SECONDS.observe(time.perf_counter() - stats.start, endpoint=endpoint,
+                            method=request.method, status=status)
+    SQL_STATEMENTS.observe(sum(stats.statements.values()), endpoint=endpoint)
+    SQL_SECONDS.observe(stats.sql_seconds, endpoint=endpoint)
+    threshold = current_app.config.get('METRICS_N_PLUS_ONE', 10)
+    repeated = [(statement, count) for statement, count in stats.statements.items()
+                if count > threshold]
+    if repeated:
+        N_PLUS_ONE.inc(endpoint=endpoint)
+        for statement, count in repeated:
+            # The selected columns say less than the table and conditions
+            statement = re.sub(r'^SELECT .*? FROM ', 'SELECT ... FROM ',
+                               ' '.join(statement.split()))
+            current_app.logger.warning('Probable N+1 query: %s ran %d times in %s %s',
+                                       statement[:300], count, request.method, request.path)
+
+
+def _rendering(sender, template, context, **extra):
+    if has_request_context() and g.get('metrics') is not None:
+        g.metrics.templates.append(time.perf_counter())
+
+
+def _rendered(sender, template, context, **extra):
+    if has_request_context() and g.get('metrics') is not None and g.metrics.templates:
+        TEMPLATE_SECONDS.observe(time.perf_counter() - g.metrics.templates.pop(),
+                                 template=template.name or 'string')
+
+
+@sa_event.listens_for(Engine, 'before_cursor_execute')
+def _executing(connection, cursor, statement, parameters, context, executemany):
+    connection.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+
+@sa_event.listens_for(Engine, 'after_cursor_execute')
+def _executed(connection, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - connection.info['metrics_started'].pop()
+    if has_request_context() and g.get('metrics') is not None:
+        g.metrics.sql_seconds += elapsed
+        g.metrics.statements[shape(statement)] += 1
+
+
+@sa_event.listens_for(Engine, 'handle_error')
+def _failed(context):
+    if context.connection is not None and context.connection.info.get('metrics_started'):
+        context.connection.info['metrics_started'].pop()
+
+
+def init_app(app):
+    """ Instrument the requests of an app """
+    app.before_request(_started)
+    app.after_request(_finished)
+    app.teardown_request(_torn_down)
+    before_render_template.connect(_rendering, app)
+    template_rendered.connect(_rendered, app)
@@ -1,6 +1,11 @@
 #!/usr/bin/env python3
 
-from .task import Task
+from .task import Task, TASK_STATUSES
 from .committee import Committee
 from .event import Event
 from .user import User
+from .outbox import OutboxEmail
+from .picture import Picture
+from .search_document import search_documents
+from .activity import task_activity, event_task_stats, event_task_days
+from .auth_token import AuthToken
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""This module contains the task activity log and its summary tables
+
+task_activity is append-only: one row per task created, moved to
+another status or deleted. event_task_stats and event_task_days are
+summaries of it, updated incrementally whenever activity is written.
+"""
+from event_plaza import db
+from .keys import Key
+
+
+task_activity = db.Table('task_activity', db.Model.metadata,
+                         db.Column('id', Key(), primary_key=True),
+                         # No foreign keys: the history outlives the task
+                         db.Column('task_id', Key(), nullable=False),
+                         db.Column('event_id', Key(), nullable=False),
+                         db.Column('user_id', Key(), nullable=True),
+                         db.Column('action', db.String(16), nullable=False),
+                         db.Column('from_status', db.String(16), nullable=True),
+                         db.Column('to_status', db.String(16), nullable=True),
+                         # Time the task spent in from_status
+                         db.Column('seconds', db.Integer, nullable=True),
+                         db.Column('created_at', db.DateTime, nullable=False),
+                         db.Index('ix_task_activity_event_id_created_at',
+                                  'event_id', 'created_at'))
+
+# Tasks per status, and the time tasks took from new to review and from
+# review to done (sums and counts, so that averages stay incremental)
+event_task_stats = db.Table('event_task_stats', db.Model.metadata,
+                            db.Column('event_id', Key(),
+                                      db.ForeignKey('events.id', onupdate='CASCADE',
+                                                    ondelete='CASCADE'),
+                                      primary_key=True),
+                            db.Column('tasks_new', db.Integer, nullable=False, default=0),
+                            db.Column('tasks_review', db.Integer, nullable=False, default=0),
+                            db.Column('tasks_done', db.Integer, nullable=False, default=0),
+                            db.Column('reviewed', db.Integer, nullable=False, default=0),
+                            db.Column('reviewed_seconds', db.BigInteger, nullable=False, default=0),
+                            db.Column('done', db.Integer, nullable=False, default=0),
+                            db.Column('done_seconds', db.BigInteger, nullable=False, default=0))
+
+# Throughput: tasks created, sent to review and done per day
+event_task_days = db.Table('event_task_days', db.Model.metadata,
+                           db.Column('event_id', Key(),
+                                     db.ForeignKey('events.id', onupdate='CASCADE',
+                                                   ondelete='CASCADE'),
+                                     primary_key=True),
+                           db.Column('day', db.Date, primary_key=True),
+                           db.Column('created', db.Integer, nullable=False, default=0),
+                           db.Column('reviewed', db.Integer, nullable=False, default=0),
+                           db.Column('done', db.Integer, nullable=False, default=0))
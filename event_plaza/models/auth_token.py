@@ -0,0 +1,18 @@
+#!/usr/bin/env python3
+"""This module contains the AuthToken class"""
+from .base_model import BaseModel
+from .keys import Key
+from event_plaza import db
+
+
+class AuthToken(BaseModel, db.Model):
+    """This class holds the hash of a token mailed to a user, e.g. to verify
+    their email or reset their password"""
+    __tablename__ = 'auth_tokens'
+    __table_args__ = (db.Index('ix_auth_tokens_user_id_purpose', 'user_id', 'purpose'),)
+
+    token_hash = db.Column(db.String(64), nullable=False, unique=True)
+    user_id = db.Column(Key(), db.ForeignKey('users.id', onupdate='CASCADE',
+                                             ondelete='CASCADE'), nullable=False)
+    purpose = db.Column(db.String(16), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
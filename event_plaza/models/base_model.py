@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 """Define the Base Module"""
-from uuid import uuid4
 from event_plaza import db
+from .keys import Key, new_id
 from datetime import datetime
 
 time = "%Y-%m-%dT%H:%M:%S"
@@ -9,7 +9,7 @@ time = "%Y-%m-%dT%H:%M:%S"
 
 class BaseModel():
     """The base model class for all coming classes"""
-    id = db.Column(db.String(60), primary_key=True)
+    id = db.Column(Key(), primary_key=True)
     created_at = db.Column(db.DateTime, default=datetime.now())
     updated_at = db.Column(db.DateTime, default=datetime.now())
 
@@ -24,7 +24,7 @@ class BaseModel():
             if 'id' in kwargs:
                 self.id = kwargs['id']
             else:
-                self.id = str(uuid4())
+                self.id = new_id()
             if 'created_at' in kwargs:
                 self.created_at = datetime.strptime(kwargs['created_at'], time)
             else:
@@ -34,13 +34,13 @@ class BaseModel():
             else:
                 self.updated_at = datetime.now()
         else:
-            self.id = str(uuid4())
+            self.id = new_id()
             self.created_at = datetime.now()
             self.updated_at = datetime.now()
 
     def __str__(self):
         """Return the string representation of the object"""
-        new_dict = self.to_dict().copy()
+        new_dict = self.to_dict()
         new_dict.pop('__class__', None)
         
         return "[{}] ({}) {}".format(
@@ -1,37 +1,38 @@
 #!/usr/bin/env python3
 """This module contains the Committee class"""
 from .base_model import BaseModel
+from .keys import Key
 from event_plaza import db
 
 
 committee_member = db.Table('committee_member', db.Model.metadata,
-                         db.Column('committee_id', db.String(60),
+                         db.Column('committee_id', Key(),
                                 db.ForeignKey('committees.id', onupdate='CASCADE',
                                            ondelete='CASCADE'),
                                 primary_key=True),
-                         db.Column('user_id', db.String(60),
+                         db.Column('user_id', Key(),
                                 db.ForeignKey('users.id', onupdate='CASCADE',
                                            ondelete='CASCADE'),
                                 primary_key=True))
 
 
 committee_vice = db.Table('committee_vice', db.Model.metadata,
-                       db.Column('committee_id', db.String(60),
+                       db.Column('committee_id', Key(),
                               db.ForeignKey('committees.id', onupdate='CASCADE',
                                          ondelete='CASCADE'),
                               primary_key=True),
-                       db.Column('user_id', db.String(60),
+                       db.Column('user_id', Key(),
                               db.ForeignKey('users.id', onupdate='CASCADE',
                                          ondelete='CASCADE'),
                               primary_key=True))
 
 
 committee_head = db.Table('committee_head', db.Model.metadata,
-                       db.Column('committee_id', db.String(60),
+                       db.Column('committee_id', Key(),
                               db.ForeignKey('committees.id', onupdate='CASCADE',
                                          ondelete='CASCADE'),
                               primary_key=True),
-                       db.Column('user_id', db.String(60),
+                       db.Column('user_id', Key(),
                               db.ForeignKey('users.id', onupdate='CASCADE',
                                          ondelete='CASCADE'),
                               primary_key=True))
@@ -42,7 +43,7 @@ class Committee(BaseModel, db.Model):
     """This class represents the committee table"""
     __tablename__ = 'committees'
 
-    event_id = db.Column(db.String(60), db.ForeignKey('events.id'), nullable=False)
+    event_id = db.Column(Key(), db.ForeignKey('events.id'), nullable=False)
     name = db.Column(db.String(128), nullable=False)
     description = db.Column(db.String(1024), nullable=True)
 
@@ -8,6 +8,7 @@ from event_plaza import db
 class Event(BaseModel, db.Model):
     """This class defines the Event model for EventPlaza"""
     __tablename__ = 'events'
+    __table_args__ = (db.Index('ix_events_created_at_id', 'created_at', 'id'),)
 
     name = db.Column(db.String(128), nullable=False, unique=True)
     description = db.Column(db.String(1024), nullable=True)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""Primary key strategies.
+
+Ids are UUID strings everywhere in the code and in URLs. How they are
+generated and stored is chosen with the EVENTPLAZA_KEYS environment
+variable, read at import time since it shapes the schema:
+
+    uuid4   random UUIDs stored as strings (the default)
+    uuid7   time-ordered UUIDs stored as strings, new rows land at the end
+            of the primary key index instead of on a random page
+    binary  time-ordered UUIDs stored as BINARY(16), which also makes every
+            key and foreign key (and the association tables' composite
+            keys) less than half the size
+
+Switching an existing database to binary keys needs its data copied with
+`flask keys-migrate`.
+"""
+import os
+import time
+import uuid
+from sqlalchemy.types import TypeDecorator, String, BINARY
+
+STRATEGIES = ('uuid4', 'uuid7', 'binary')
+STRATEGY = os.environ.get('EVENTPLAZA_KEYS', 'uuid4')
+if STRATEGY not in STRATEGIES:
+    raise ValueError('EVENTPLAZA_KEYS must be one of {}'.format(', '.join(STRATEGIES)))
+
+
+def uuid7(timestamp=None):
+    """Return a UUID version 7: 48 bits of unix milliseconds then random bits"""
+    milliseconds = int((time.time() if timestamp is None else timestamp) * 1000)
+    random = int.from_bytes(os.urandom(10), 'big')
+    value = (milliseconds & 0xFFFFFFFFFFFF) << 80
+    value |= 0x7 << 76 | (random >> 62 & 0xFFF) << 64
+    value |= 0b10 << 62 | random & 0x3FFFFFFFFFFFFFFF
+    return uuid.UUID(int=value)
+
+
+def new_id(timestamp=None):
+    """Return a new primary key, as a string, following the key strategy"""
+    if STRATEGY == 'uuid4':
+        return str(uuid.uuid4())
+    return str(uuid7(timestamp))
+
+
+def canonical(value):
+    """Return a key spelled as the database returns it (lowercase, dashed),
+    or value as it is when it is not a UUID"""
+    try:
+        return str(uuid.UUID(value))
+    except (TypeError, ValueError, AttributeError):
+        return value
+
+
+class Key(TypeDecorator):
+    """A primary or foreign key column: a UUID string in Python, stored as
+    a string or, with the binary strategy, as BINARY(16)
+    """
+    impl = String(60)
+    cache_ok = True
+
+    def __init__(self, binary=None):
+        super().__init__()
+        self.binary = STRATEGY == 'binary' if binary is None else binary
+
+    def load_dialect_impl(self, dialect):
+        if self.binary:
+            return dialect.type_descriptor(BINARY(16))
+        return dialect.type_descriptor(String(60))
+
+    def process_bind_param(self, value, dialect):
+        if value is None or not self.binary or isinstance(value, bytes):
+            return value
+        try:
+            return uuid.UUID(value).bytes
+        except (TypeError, ValueError):
+            # Not an id (a mistyped URL...): match nothing
+            return b''
+
+    def process_result_value(self, value, dialect):
+        if value is None or not self.binary:
+            return value
+        return str(uuid.UUID(bytes=bytes(value)))
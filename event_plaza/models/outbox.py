@@ -0,0 +1,21 @@
+#!/usr/bin/env python3
+"""This module contains the OutboxEmail class"""
+from .base_model import BaseModel
+from event_plaza import db
+from datetime import datetime
+
+
+class OutboxEmail(BaseModel, db.Model):
+    """This class represents an email waiting in the outbox"""
+    __tablename__ = 'outbox'
+    __table_args__ = (db.Index('ix_outbox_status_next_attempt_at',
+                               'status', 'next_attempt_at'),)
+
+    sender = db.Column(db.String(128), nullable=False)
+    recipient = db.Column(db.String(128), nullable=False)
+    subject = db.Column(db.String(256), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(16), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    last_error = db.Column(db.String(1024), nullable=True)
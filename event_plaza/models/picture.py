@@ -0,0 +1,14 @@
+#!/usr/bin/env python3
+"""This module contains the Picture class"""
+from .base_model import BaseModel
+from event_plaza import db
+
+
+class Picture(BaseModel, db.Model):
+    """This class counts the references to a stored picture"""
+    __tablename__ = 'pictures'
+    __table_args__ = (db.UniqueConstraint('kind', 'digest'),)
+
+    kind = db.Column(db.String(16), nullable=False)
+    digest = db.Column(db.String(32), nullable=False)
+    refcount = db.Column(db.Integer, nullable=False, default=0)
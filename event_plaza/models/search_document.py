@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""This module contains the search_documents table
+
+Every task, event and committee has a row here with the text to search
+for it. On MySQL the table carries a FULLTEXT index; on SQLite an FTS5
+table over it, kept up to date by triggers, stands in for it.
+"""
+from sqlalchemy import DDL, event
+from event_plaza import db
+from .keys import Key
+
+
+# id is SQLite's rowid, which the FTS5 table points at: an INTEGER PRIMARY
+# KEY keeps its values through a VACUUM, an implicit rowid may not
+search_documents = db.Table('search_documents', db.Model.metadata,
+                            db.Column('id', db.Integer, primary_key=True, autoincrement=True),
+                            db.Column('kind', db.String(16), nullable=False),
+                            db.Column('object_id', Key(), nullable=False),
+                            db.Column('event_id', Key(), nullable=False, index=True),
+                            db.Column('title', db.String(128), nullable=False),
+                            db.Column('body', db.Text, nullable=True),
+                            db.UniqueConstraint('kind', 'object_id',
+                                                name='uq_search_documents_kind_object_id'))
+
+db.Index('ft_search_documents', search_documents.c.title, search_documents.c.body,
+         mysql_prefix='FULLTEXT').ddl_if(dialect='mysql')
+
+SQLITE_FTS = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5("
+    "title, body, content='search_documents', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2', "
+    # Words being typed match on prefixes: index the short ones
+    "prefix='2 3 4')",
+    "CREATE TRIGGER IF NOT EXISTS search_documents_ai AFTER INSERT ON search_documents BEGIN "
+    "INSERT INTO search_fts(rowid, title, body) VALUES (new.id, new.title, new.body); END",
+    "CREATE TRIGGER IF NOT EXISTS search_documents_ad AFTER DELETE ON search_documents BEGIN "
+    "INSERT INTO search_fts(search_fts, rowid, title, body) "
+    "VALUES ('delete', old.id, old.title, old.body); END",
+    "CREATE TRIGGER IF NOT EXISTS search_documents_au AFTER UPDATE ON search_documents BEGIN "
+    "INSERT INTO search_fts(search_fts, rowid, title, body) "
+    "VALUES ('delete', old.id, old.title, old.body); "
+    "INSERT INTO search_fts(rowid, title, body) VALUES (new.id, new.title, new.body); END",
+)
+for statement in SQLITE_FTS:
+    event.listen(search_documents, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+event.listen(search_documents, 'before_drop',
+             DDL('DROP TABLE IF EXISTS search_fts').execute_if(dialect='sqlite'))
@@ -1,36 +1,43 @@
 #!/usr/bin/env python3
 """This module contains the Task class"""
 from .base_model import BaseModel
+from .keys import Key
 from event_plaza import db
 from datetime import datetime
 
 
 assigns = db.Table('assigns', db.Model.metadata,
-                   db.Column('task_id', db.String(60),
+                   db.Column('task_id', Key(),
                              db.ForeignKey('tasks.id', onupdate='CASCADE',
                                            ondelete='CASCADE'),
                              primary_key=True),
-                   db.Column('user_id', db.String(60),
+                   db.Column('user_id', Key(),
                              db.ForeignKey('users.id', onupdate='CASCADE',
                                            ondelete='CASCADE'),
                              primary_key=True))
 
 task_attachments = db.Table('task_attachments', db.Model.metadata,
-                            db.Column('task_id', db.String(60),
+                            db.Column('task_id', Key(),
                                         db.ForeignKey('tasks.id', onupdate='CASCADE',
                                                         ondelete='CASCADE'),
                                         primary_key=True),
-                            db.Column('attachment_id', db.String(60),
+                            db.Column('attachment_id', Key(),
                                         db.ForeignKey('attachments.id', onupdate='CASCADE',
                                                         ondelete='CASCADE'),
                                         primary_key=True))
 
+TASK_STATUSES = ('new', 'review', 'done')
+
+
 class Task(BaseModel, db.Model):
     """This class represents a task object"""
     __tablename__ = 'tasks'
+    # Serves the board columns: one event, one status, in (created_at, id) order
+    __table_args__ = (db.Index('ix_tasks_event_id_status_created_at',
+                               'event_id', 'status', 'created_at', 'id'),)
 
     name = db.Column(db.String(128), nullable=False)
-    event_id = db.Column(db.String(60), db.ForeignKey('events.id'), nullable=False)
+    event_id = db.Column(Key(), db.ForeignKey('events.id'), nullable=False)
     description = db.Column(db.String(1024), nullable=True)
     assignees = db.relationship('User', secondary='assigns',
                                 back_populates='assigned_tasks', lazy=True)
@@ -38,6 +45,11 @@ class Task(BaseModel, db.Model):
                                   back_populates='task', lazy=True)
     status = db.Column(db.String(128), nullable=False, default='new')
     reviewed_at = db.Column(db.DateTime, default=datetime.now())
+    # Bumped by every change, so a write based on an outdated read fails
+    # instead of overwriting someone else's (see event_plaza.transitions)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+
+    __mapper_args__ = {'version_id_col': version}
 
 
 class Attachment(BaseModel, db.Model):
@@ -45,6 +57,6 @@ class Attachment(BaseModel, db.Model):
     __tablename__ = 'attachments'
 
     url = db.Column(db.String(256), nullable=False)
-    task_id = db.Column(db.String(60), db.ForeignKey('tasks.id'), nullable=False)
+    task_id = db.Column(Key(), db.ForeignKey('tasks.id'), nullable=False)
     task = db.relationship("Task", back_populates="attachments")
 
@@ -2,14 +2,14 @@
 """This module defines the User model for EventPlaza"""
 import secrets
 from .base_model import BaseModel
-from itsdangerous import URLSafeTimedSerializer as Serializer
 from .event_tables import event_organizers, event_attendens
-from event_plaza import login_manager, db, app
+from event_plaza import login_manager, db
 from flask_login import UserMixin
 
 @login_manager.user_loader
 def load_user(user_id: str):
-    return User.query.get(user_id)
+    from event_plaza.lookups import user_by_id
+    return user_by_id(user_id)
 
 class User(BaseModel, db.Model, UserMixin):
     """This class defines the User model for EventPlaza"""
@@ -20,6 +20,8 @@ class User(BaseModel, db.Model, UserMixin):
     email = db.Column(db.String(128), nullable=False, unique=True)
     image_file = db.Column(db.String(32), nullable=False, default='default.jpg')
     password = db.Column(db.String(128), nullable=False)
+    # Unused since the tokens moved to auth_tokens (see tokens.py); cleared
+    # by `flask tokens-migrate`
     email_token = db.Column(db.String(128), nullable=False, default='NOT INIT')
     is_confirmed = db.Column(db.Boolean, nullable=False, default=False)
     managed_events = db.relationship('Event', secondary='event_managers',
@@ -36,19 +38,3 @@ class User(BaseModel, db.Model, UserMixin):
                                    back_populates='vices', lazy=True)
     head_committees = db.relationship('Committee', secondary='committee_head',
                                    back_populates='heads', lazy=True)
-
-    def get_reset_token(self):
-        s = Serializer(app.config['SECRET_KEY'])
-        return s.dumps({'user_id': self.id})
-    
-    def verify_email_token(self, token):
-        return self.email_token == token
-
-    @staticmethod
-    def verify_reset_token(token):
-        s = Serializer(app.config['SECRET_KEY'])
-        try:
-            user_id = s.loads(token, 300)['user_id']
-        except:
-            return None
-        return User.query.get(user_id)
\ No newline at end of file
@@ -0,0 +1,227 @@
+#!/usr/bin/python3
+""" Outbound email queue.
+
+    Routes only add emails to the `outbox` table, in their own transaction,
+    so an email goes out only if what it tells about is committed. A small
+    pool of worker threads (or a dedicated `flask outbox-worker` process)
+    claims pending rows, delivers them through the configured transport and
+    retries failures with exponential backoff.
+
+    Every worker keeps a single transport for its whole life, so the
+    Gmail client is authorized once per worker instead of once per email.
+"""
+import os
+import re
+import random
+import smtplib
+import threading
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import or_, and_, update, event as sa_event
+from sqlalchemy.orm import Session
+from event_plaza import db
+from event_plaza.models import OutboxEmail
+from event_plaza.metrics import EMAIL_ENQUEUE_SECONDS
+
+
+DEFAULT_SENDER = 'noreply@eventplaza.com'
+
+_workers = []
+_workers_lock = threading.Lock()
+_wakeup = threading.Event()
+
+
+class GmailTransport():
+    """ Delivers emails through the Gmail API """
+
+    def __init__(self, app):
+        self.service = None
+
+    def send(self, email):
+        from event_plaza.send_email import GetService, CreateMessage
+        if self.service is None:
+            self.service = GetService()
+        message = CreateMessage(email.sender, email.recipient, email.subject,
+                                email.body, html_to_text(email.body))
+        self.service.users().messages().send(userId='me', body=message).execute()
+
+
+class SMTPTransport():
+    """ Delivers emails to an SMTP server, e.g. a local debugging server """
+
+    def __init__(self, app):
+        self.host = app.config.get('MAIL_SMTP_HOST', 'localhost')
+        self.port = int(app.config.get('MAIL_SMTP_PORT', 1025))
+        self.connection = None
+
+    def send(self, email):
+        from event_plaza.send_email import CreateMimeMessage
+        message = CreateMimeMessage(email.sender, email.recipient, email.subject,
+                                    email.body, html_to_text(email.body))
+        if self.connection is None:
+            self.connection = smtplib.SMTP(self.host, self.port, timeout=30)
+        try:
+            self.connection.send_message(message)
+        except smtplib.SMTPServerDisconnected:
+            self.connection = None
+            raise
+
+
+class FileTransport():
+    """ Writes emails as .eml files into a spool directory """
+
+    def __init__(self, app):
+        self.directory = app.config.get('MAIL_SPOOL_DIR') or \
+            os.path.join(app.instance_path, 'mail_spool')
+        os.makedirs(self.directory, exist_ok=True)
+
+    def send(self, email):
+        from event_plaza.send_email import CreateMimeMessage
+        message = CreateMimeMessage(email.sender, email.recipient, email.subject,
+                                    email.body, html_to_text(email.body))
+        filename = '{}-{}.eml'.format(datetime.now().strftime('%Y%m%dT%H%M%S'), email.id)
+        with open(os.path.join(self.directory, filename), 'wb') as f:
+            f.write(message.as_bytes())
+
+
+TRANSPORTS = {
+    'gmail': GmailTransport,
+    'smtp': SMTPTransport,
+    'file': FileTransport,
+}
+
+
+def html_to_text(html):
+    """ Strip the markup of an html body to get its plain text part """
+    return re.sub(r'\n\s+', '\n', re.sub(r'<[^>]+>', '', html)).strip()
+
+
+def enqueue_email(recipient, subject, body, sender=None):
+    """ Add an email to the outbox in the session, to be sent once the
+        caller commits (and not at all if it rolls back)
+    """
+    with EMAIL_ENQUEUE_SECONDS.time():
+        return _enqueue(recipient, subject, body, sender)
+
+
+def _enqueue(recipient, subject, body, sender):
+    email = OutboxEmail(sender=sender or current_app.config.get('MAIL_SENDER', DEFAULT_SENDER),
+                        recipient=recipient, subject=subject, body=body,
+                        status='pending', attempts=0, next_attempt_at=datetime.now())
+    db.session.add(email)
+    db.session.info['outbox_app'] = current_app._get_current_object()
+    return email
+
+
+@sa_event.listens_for(Session, 'after_commit')
+def _committed(session):
+    """ Wake up the workers once the queued emails are visible to them """
+    app = session.info.pop('outbox_app', None)
+    if app is not None:
+        start_workers(app)
+        _wakeup.set()
+
+
+@sa_event.listens_for(Session, 'after_rollback')
+def _rolled_back(session):
+    session.info.pop('outbox_app', None)
+
+
+def claim_batch(app, limit=10):
+    """ Claim up to $(limit) due emails for the calling worker.
+
+        A row is claimed by flipping its status to 'sending' with a
+        conditional UPDATE, so concurrent workers never deliver the same
+        email twice. Rows stuck in 'sending' longer than the lease (the
+        worker that claimed them died) become claimable again.
+    """
+    now = datetime.now()
+    lease = now - timedelta(seconds=app.config.get('MAIL_LEASE_SECONDS', 600))
+    claimable = or_(and_(OutboxEmail.status == 'pending', OutboxEmail.next_attempt_at <= now),
+                    and_(OutboxEmail.status == 'sending', OutboxEmail.updated_at < lease))
+    candidates = db.session.query(OutboxEmail.id).filter(claimable) \
+        .order_by(OutboxEmail.next_attempt_at).limit(limit).all()
+    claimed = []
+    for (email_id,) in candidates:
+        result = db.session.execute(
+            update(OutboxEmail)
+            .where(OutboxEmail.id == email_id, claimable)
+            .values(status='sending', attempts=OutboxEmail.attempts + 1, updated_at=now)
+            .execution_options(synchronize_session=False))
+        if result.rowcount == 1:
+            claimed.append(email_id)
+    db.session.commit()
+    if not claimed:
+        return []
+    return OutboxEmail.query.filter(OutboxEmail.id.in_(claimed)).all()
+
+
+def deliver(app, transport, email):
+    """ Deliver a claimed email, scheduling a retry when it fails """
+    try:
+        transport.send(email)
+    except Exception as error:
+        max_attempts = app.config.get('MAIL_MAX_ATTEMPTS', 5)
+        email.last_error = str(error)[:1024]
+        if email.attempts >= max_attempts:
+            email.status = 'failed'
+        else:
+            delay = app.config.get('MAIL_RETRY_BASE_SECONDS', 30) * 2 ** (email.attempts - 1)
+            email.status = 'pending'
+            email.next_attempt_at = datetime.now() + \
+                timedelta(seconds=delay * random.uniform(1, 1.25))
+        app.logger.warning('Sending email %s failed (attempt %d): %s',
+                           email.id, email.attempts, error)
+    else:
+        email.status = 'sent'
+        email.last_error = None
+    email.updated_at = datetime.now()
+    db.session.commit()
+
+
+def process_once(app, transport, limit=10):
+    """ Deliver one batch of due emails, return how many were handled """
+    with app.app_context():
+        emails = claim_batch(app, limit)
+        for email in emails:
+            deliver(app, transport, email)
+        return len(emails)
+
+
+class OutboxWorker(threading.Thread):
+    """ A worker thread draining the outbox with its own transport """
+
+    def __init__(self, app, stop=None):
+        super().__init__(daemon=True, name='outbox-worker')
+        self.app = app
+        self.stop = stop or threading.Event()
+        self.transport = TRANSPORTS[app.config.get('MAIL_TRANSPORT', 'gmail')](app)
+
+    def run(self):
+        poll_interval = self.app.config.get('MAIL_POLL_INTERVAL', 5)
+        while not self.stop.is_set():
+            # Cleared before claiming, so an email enqueued from now on sets
+            # it again and cuts the next wait short
+            _wakeup.clear()
+            try:
+                handled = process_once(self.app, self.transport)
+            except Exception:
+                self.app.logger.exception('Outbox worker failed')
+                handled = 0
+            if not handled:
+                _wakeup.wait(poll_interval)
+
+
+def start_workers(app):
+    """ Start the in-process worker pool once per process.
+        Setting MAIL_WORKERS to 0 leaves delivery to `flask outbox-worker`.
+    """
+    if _workers or app.config.get('MAIL_WORKERS', 2) <= 0:
+        return
+    with _workers_lock:
+        if _workers:
+            return
+        for _ in range(app.config.get('MAIL_WORKERS', 2)):
+            worker = OutboxWorker(app)
+            worker.start()
+            _workers.append(worker)
@@ -0,0 +1,53 @@
+#!/usr/bin/python3
+""" Keyset pagination on (created_at, id).
+
+    Instead of OFFSET, which reads and throws away every row before the
+    page, the next page starts right after the (created_at, id) of the last
+    row of the previous one. With an index ending in (created_at, id) every
+    page costs the same however deep it is, and rows inserted meanwhile do
+    not shift the pages.
+"""
+import base64
+from datetime import datetime
+from sqlalchemy import tuple_
+
+
+PAGE_SIZE = 30
+
+
+def encode_cursor(row):
+    """ Return the opaque cursor pointing right after a row """
+    key = '{}|{}'.format(row.created_at.isoformat(), row.id)
+    return base64.urlsafe_b64encode(key.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """ Return the (created_at, id) of a cursor, or None if it is invalid """
+    try:
+        created_at, row_id = base64.urlsafe_b64decode(cursor.encode('ascii')) \
+            .decode('utf-8').split('|', 1)
+        return datetime.fromisoformat(created_at), row_id
+    except (ValueError, UnicodeError):
+        return None
+
+
+def after(cursor, model):
+    """ Return the filter selecting the rows after a cursor """
+    key = decode_cursor(cursor)
+    if key is None:
+        return None
+    return tuple_(model.created_at, model.id) > key
+
+
+def keyset_page(query, model, cursor=None, limit=PAGE_SIZE):
+    """ Return a page of the query's rows and the cursor of the next page
+        (None on the last page).
+    """
+    if cursor:
+        condition = after(cursor, model)
+        if condition is not None:
+            query = query.filter(condition)
+    rows = query.order_by(model.created_at, model.id).limit(limit + 1).all()
+    if len(rows) > limit:
+        return rows[:limit], encode_cursor(rows[limit - 1])
+    return rows, None
@@ -0,0 +1,116 @@
+#!/usr/bin/python3
+""" Password hashing off the request thread.
+
+    bcrypt is CPU bound and holds the GIL, so a burst of logins used to
+    stall every other route of the worker. Hashes are now computed in a
+    bounded process pool; once PASSWORD_MAX_PENDING hashes are queued new
+    ones are refused with PasswordHasherBusy instead of piling up.
+
+    The work factor comes from BCRYPT_LOG_ROUNDS. Hashes made with another
+    cost are re-hashed the next time their owner logs in.
+"""
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import bcrypt
+from flask import current_app
+from event_plaza.metrics import BCRYPT_SECONDS
+
+
+class PasswordHasherBusy(Exception):
+    """ Raised when too many hashes are already waiting for the pool """
+
+
+def _encode(password):
+    # bcrypt only looks at the first 72 bytes, newer versions refuse longer ones
+    return password.encode('utf-8')[:72]
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(_encode(password), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _check(hashed, password):
+    try:
+        return bcrypt.checkpw(_encode(password), hashed.encode('utf-8'))
+    except ValueError:
+        return False
+
+
+def hash_cost(hashed):
+    """ Return the work factor a bcrypt hash was made with """
+    return int(hashed.split('$')[2])
+
+
+class PasswordHasher():
+    """ Runs bcrypt in a process pool with a bounded queue """
+
+    def __init__(self, rounds=12, workers=None, max_pending=None):
+        self.rounds = rounds
+        self.workers = os.cpu_count() if workers is None else workers
+        self.max_pending = max_pending or 4 * max(self.workers, 1)
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _run(self, function, *args):
+        if self.workers <= 0:
+            return function(*args)
+        if not self._slots.acquire(blocking=False):
+            raise PasswordHasherBusy()
+        try:
+            if self._pool is None:
+                with self._lock:
+                    if self._pool is None:
+                        self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            return self._pool.submit(function, *args).result()
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        with BCRYPT_SECONDS.time(operation='hash'):
+            return self._run(_hash, password, self.rounds)
+
+    def check(self, hashed, password):
+        with BCRYPT_SECONDS.time(operation='check'):
+            return self._run(_check, hashed, password)
+
+    def needs_rehash(self, hashed):
+        return hash_cost(hashed) != self.rounds
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+
+_hasher = None
+_hasher_lock = threading.Lock()
+
+
+def get_hasher():
+    """ Build the process' hasher from the app config on first use """
+    global _hasher
+    if _hasher is None:
+        with _hasher_lock:
+            if _hasher is None:
+                config = current_app.config
+                _hasher = PasswordHasher(config.get('BCRYPT_LOG_ROUNDS', 12),
+                                         config.get('PASSWORD_WORKERS'),
+                                         config.get('PASSWORD_MAX_PENDING'))
+    return _hasher
+
+
+def hash_password(password):
+    """ Return the bcrypt hash of a password """
+    return get_hasher().hash(password)
+
+
+def check_password(hashed, password):
+    """ Check a password against its bcrypt hash """
+    return get_hasher().check(hashed, password)
+
+
+def needs_rehash(hashed):
+    """ Check if a hash was made with another work factor than the configured one """
+    return get_hasher().needs_rehash(hashed)
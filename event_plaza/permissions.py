@@ -0,0 +1,192 @@
+#!/usr/bin/python3
+""" Event and committee roles of a user.
+
+    Roles live in the association tables (event_organizers, event_managers,
+    event_attendens, committee_head, committee_vice, committee_member).
+    Looking them up goes through their (target_id, user_id) primary keys in
+    a single UNION ALL query, and the answers are cached per user until the
+    relationships backed by those tables change, or the TTL runs out (which
+    bounds staleness across worker processes).
+"""
+import time
+import threading
+from collections import OrderedDict
+from functools import wraps
+from flask import flash, redirect, url_for, jsonify, has_app_context
+from flask_login import current_user
+from sqlalchemy import event as sa_event, literal, select, union_all
+from sqlalchemy.orm import Session
+from event_plaza import db
+from event_plaza.models import User, Event, Committee
+from event_plaza.event_cache import resolve_event
+from event_plaza.models.event_tables import (event_organizers, event_managers,
+                                             event_attendens)
+from event_plaza.models.committee import committee_head, committee_vice, committee_member
+
+
+EVENT_ROLES = (('organizer', event_organizers),
+               ('manager', event_managers),
+               ('attendee', event_attendens))
+COMMITTEE_ROLES = (('head', committee_head),
+                   ('vice', committee_vice),
+                   ('member', committee_member))
+
+
+class RoleCache():
+    """ A per-user LRU cache of {(kind, target_id): roles} with a TTL """
+
+    def __init__(self, max_users=10000, ttl=60):
+        self.max_users = max_users
+        self.ttl = ttl
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id, key):
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._users[user_id]
+                return None
+            self._users.move_to_end(user_id)
+            return entry[1].get(key)
+
+    def put(self, user_id, key, roles):
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is None or entry[0] < time.monotonic():
+                entry = self._users[user_id] = (time.monotonic() + self.ttl, {})
+            self._users.move_to_end(user_id)
+            entry[1][key] = roles
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._users.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+
+
+cache = RoleCache()
+
+
+def _lookup(kind, role_tables, user_id, target_ids):
+    """ Fetch the roles of a user on several targets in one query """
+    column = kind + '_id'
+    roles = {target_id: set() for target_id in target_ids}
+    query = union_all(*[
+        select(literal(role).label('role'), table.c[column].label('target_id'))
+        .where(table.c.user_id == user_id, table.c[column].in_(target_ids))
+        for role, table in role_tables])
+    for role, target_id in db.session.execute(query):
+        roles[target_id].add(role)
+    return {target_id: frozenset(found) for target_id, found in roles.items()}
+
+
+def _cached_roles(kind, role_tables, user_id, target_ids):
+    found, missing = {}, []
+    for target_id in target_ids:
+        roles = cache.get(user_id, (kind, target_id))
+        if roles is None:
+            missing.append(target_id)
+        else:
+            found[target_id] = roles
+    if missing:
+        for target_id, roles in _lookup(kind, role_tables, user_id, missing).items():
+            cache.put(user_id, (kind, target_id), roles)
+            found[target_id] = roles
+    return found
+
+
+def event_roles(user_id, event_id):
+    """ Return the roles ('organizer', 'manager', 'attendee') a user holds in an event """
+    return _cached_roles('event', EVENT_ROLES, user_id, [event_id])[event_id]
+
+
+def event_roles_many(user_id, event_ids):
+    """ Return {event_id: roles} for several events with at most one query """
+    return _cached_roles('event', EVENT_ROLES, user_id, list(event_ids))
+
+
+def committee_roles(user_id, committee_id):
+    """ Return the roles ('head', 'vice', 'member') a user holds in a committee """
+    return _cached_roles('committee', COMMITTEE_ROLES, user_id, [committee_id])[committee_id]
+
+
+def has_event_role(user_id, event_id, *roles):
+    """ Check if a user holds any of the roles in an event """
+    return not event_roles(user_id, event_id).isdisjoint(roles)
+
+
+def invalidate(*user_ids):
+    """ Forget the cached roles of users, e.g. after writing the role tables directly """
+    for user_id in user_ids:
+        cache.invalidate(user_id)
+
+
+def event_role_required(*roles, message='You are not authorized to view this page', api=False):
+    """ Decorator for the /<event_name>/... views.
+
+        It resolves the event, checks the current user holds one of the
+        roles in it and calls the view with `event` (an EventInfo, see
+        event_cache) instead of `event_name`.
+        Use it under @login_required.
+    """
+    roles = roles or ('organizer',)
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(event_name, **kwargs):
+            if current_user.is_confirmed is False:
+                if api:
+                    return jsonify(error='Verify your email first'), 403
+                return redirect(url_for('main.verify_required'))
+            event = resolve_event(event_name)
+            if not event:
+                if api:
+                    return jsonify(error='Event not found'), 404
+                flash('Event not found', 'error')
+                return redirect(url_for('main.home'))
+            if not has_event_role(current_user.id, event.id, *roles):
+                if api:
+                    return jsonify(error=message), 403
+                flash(message, 'error')
+                return redirect(url_for('main.home'))
+            return view(event=event, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _touched(user_id):
+    """ Invalidate a user now, and again once the transaction ends """
+    cache.invalidate(user_id)
+    if has_app_context():
+        db.session().info.setdefault('permission_users', set()).add(user_id)
+
+
+def _watch(attribute, user_is_target):
+    """ Invalidate the affected user whenever a role collection changes """
+    def on_change(target, value, initiator):
+        _touched(target.id if user_is_target else value.id)
+    sa_event.listen(attribute, 'append', on_change)
+    sa_event.listen(attribute, 'remove', on_change)
+
+
+for _attribute in (Event.organizer, Event.managers, Event.attendees,
+                   Committee.heads, Committee.vices, Committee.members):
+    _watch(_attribute, user_is_target=False)
+for _attribute in (User.organized_events, User.managed_events, User.attended_events,
+                   User.head_committees, User.vice_committees, User.member_committees):
+    _watch(_attribute, user_is_target=True)
+
+
+@sa_event.listens_for(Session, 'after_commit')
+@sa_event.listens_for(Session, 'after_rollback')
+def _flush_touched(session):
+    for user_id in session.info.pop('permission_users', ()):
+        cache.invalidate(user_id)
+
@@ -1,453 +1,738 @@
 #!/usr/bin/python3
 """ Starts a Flask Web Application """
-import secrets, os
-from PIL import Image
-from flask import render_template, url_for, flash, redirect, request
-from event_plaza import app, bcrypt, db
+import io
+import secrets
+from flask import (Blueprint, current_app, render_template, url_for, flash, redirect, request,
+                   jsonify, Response, stream_with_context)
+from sqlalchemy import func
+from event_plaza import db
 from event_plaza.forms import (RegistrationForm, LoginForm, UpdateProfileForm,
                                CreateEventForm, CreateTaskForm, RequestResetForm,
                                ResetPasswordForm, VerifyEmailForm,
-                               AddUserToEventForm)
-from event_plaza.models import User, Event, Task
+                               AddUserToEventForm, ImportTasksForm, BulkInviteForm)
+from event_plaza.models import User, Event, Task, TASK_STATUSES
+from event_plaza.outbox import enqueue_email
+from event_plaza.passwords import (hash_password, check_password, needs_rehash,
+                                   PasswordHasherBusy)
+from event_plaza.cities import search as search_cities
+from event_plaza.images import (save_picture, picture_url, send_picture, release,
+                                InvalidPicture)
+from event_plaza.assets import asset_url, send_asset
+from event_plaza.lookups import user_by_email, event_by_id, remember, stats as lookup_stats
+from event_plaza.permissions import event_role_required, event_roles, event_roles_many
+from event_plaza.pagination import keyset_page, after, encode_cursor, PAGE_SIZE
+from event_plaza.serializers import TASK, EVENT
+from event_plaza import task_transfer, invites, search, activity, live, metrics, fragments
+from event_plaza import tokens, transitions
+from event_plaza.routing import primary
+from werkzeug.utils import secure_filename
+from flask_wtf.csrf import generate_csrf, validate_csrf
+from wtforms.validators import ValidationError
 from flask_login import login_user, current_user, logout_user, login_required
-from datetime import datetime
+from datetime import timedelta
 
 
-with app.app_context():
-    """ The database will work in the app context """
-    db.create_all()
+main = Blueprint('main', __name__)
+# The partial rendering the cards of each task status
+CARD_TEMPLATES = {'new': '_new_tasks.html', 'review': '_review_tasks.html',
+                  'done': '_done_tasks.html'}
+INVALID_PICTURE = 'This file is not a picture we can read, try another JPG or PNG.'
+main.add_app_template_global(picture_url)
+main.add_app_template_global(asset_url)
+main.add_app_template_global(generate_csrf, 'csrf_token')
 
 
-@app.route('/', strict_slashes=False)
+@main.app_errorhandler(PasswordHasherBusy)
+def password_hasher_busy(error):
+    """ Sheds password work when the hashing pool is saturated """
+    flash('We are receiving too many requests, please try again in a moment.', 'error')
+    return redirect(request.url)
+
+
+@main.after_app_request
+def add_lookup_stats(response):
+    """ Report the request's lookup cache hits and misses (debug mode by default) """
+    if current_app.config.get('LOOKUP_STATS_HEADER', current_app.debug):
+        response.headers['X-Lookup-Stats'] = 'hits={hits}; misses={misses}'.format(
+            **lookup_stats()['request'])
+    return response
+
+
+@main.route('/', strict_slashes=False)
 def landing():
     """ Renders the landing page """
     return render_template('landing.html', landing_layout=True)
 
 
-@app.route('/login', strict_slashes=False, methods=['GET', 'POST'])
+@main.route('/login', strict_slashes=False, methods=['GET', 'POST'])
 def login():
     """ Renders the log in page """
     if current_user.is_authenticated:
         flash('Already logged in.', 'success')
-        return redirect(url_for('home'))
+        return redirect(url_for('main.home'))
     form = LoginForm()
     if form.validate_on_submit():
-        with app.app_context():
-            user = User.query.filter_by(email=form.email.data).first()
-        if user and bcrypt.check_password_hash(user.password, form.password.data):
+        user = user_by_email(form.email.data)
+        if user and check_password(user.password, form.password.data):
+            if needs_rehash(user.password):
+                user.password = hash_password(form.password.data)
+                db.session.commit()
             login_user(user, remember=form.remember.data)
             next_page = request.args.get('next')
-            return redirect(next_page) if next_page else redirect(url_for('home'))
+            return redirect(next_page) if next_page else redirect(url_for('main.home'))
         else:
             flash('Login unsuccessful, please check email and password', 'error')
-            return redirect(url_for('login'))
+            return redirect(url_for('main.login'))
     return render_template('log_in.html', form=form, page_title="Log In", landing_layout=True)
 
 
-@app.route('/signup', strict_slashes=False, methods=['GET', 'POST'])
+@main.route('/signup', strict_slashes=False, methods=['GET', 'POST'])
 def signup():
     """ Renders the signup page """
     if current_user.is_authenticated:
         flash('You are already registered.', 'success')
-        return redirect(url_for('home'))
+        return redirect(url_for('main.home'))
     form = RegistrationForm()
     if form.validate_on_submit():
-        hashed_password = bcrypt.generate_password_hash(form.password.data).decode('utf-8')
-        with app.app_context():
-            user = User(first_name=form.first_name.data, last_name=form.last_name.data,
-                        email=form.email.data, password=hashed_password)
-            db.session.add(user)
-            db.session.commit()
+        hashed_password = hash_password(form.password.data)
+        user = User(first_name=form.first_name.data, last_name=form.last_name.data,
+                    email=form.email.data, password=hashed_password)
+        db.session.add(user)
+        db.session.commit()
+        remember(user)
         flash('Account created for {} {}!'.format(form.first_name.data,
                                                  form.last_name.data),
                                                  'success')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     return render_template('sign_up.html', form=form)
 
 
-@app.route('/signout', strict_slashes=False)
+@main.route('/signout', strict_slashes=False)
 def logout():
     """ logs the user outs"""
     logout_user()
-    return redirect(url_for('landing'))
+    return redirect(url_for('main.landing'))
 
 
-@app.route('/home', strict_slashes=False)
+@main.route('/home', strict_slashes=False)
 @login_required
 def home():
     """ Renders the home page that contains the user's events"""
     if current_user.is_confirmed is False:
-        return redirect(url_for('verify_required'))
-    image_file = url_for('static', filename='profile_pics/' + current_user.image_file)
-    events = Event.query.filter(Event.organizer.any(id=current_user.id)).all()
-
-    return render_template('your_events.html', image_file=image_file, events=events,
+        return redirect(url_for('main.verify_required'))
+    cursor = request.args.get('after')
+
+    def render_cards():
+        events, next_cursor = keyset_page(
+            Event.query.filter(Event.organizer.any(id=current_user.id)), Event, cursor)
+        roles = event_roles_many(current_user.id, [event.id for event in events])
+        return render_template('_event_cards.html', events=events, roles=roles,
+                               next_cursor=next_cursor)
+
+    cards = fragments.cached(fragments.events_group(current_user.id), cursor, render_cards)
+    if request.args.get('partial'):
+        return cards
+
+    image_file = picture_url('profile', current_user.image_file, 'avatar')
+    return render_template('your_events.html', image_file=image_file, cards=cards,
                            current_user=current_user, page_title="Your Events")
 
 
-@app.route('/<event_name>/dashboard', strict_slashes=False, methods=['GET', 'POST'])
+@main.route('/events', strict_slashes=False)
 @login_required
-def dashboard(event_name: str):
+def list_events():
+    """ Return a page of the events the user organizes as JSON, with the
+        ?after= cursor of the next page (null on the last one).
+    """
+    events, next_cursor = keyset_page(
+        EVENT.query(Event.organizer.any(id=current_user.id)), Event,
+        request.args.get('after'))
+    return jsonify(events=EVENT.rows(events), cursor=next_cursor)
+
+
+def add_user_to_event(form, event):
+    """ Add the user from an AddUserToEventForm to the event """
+    user = user_by_email(form.email.data)
+    event = event_by_id(event.id)
+
+    if 'organizer' not in event_roles(user.id, event.id):
+        event.organizer.append(user)
+        if form.role.data == 'organizer':
+            db.session.commit()
+            flash('User added as an organizer', 'success')
+        elif form.role.data == 'manager':
+            event.managers.append(user)
+            db.session.commit()
+            flash('User added as a manager', 'success')
+    else:
+        flash('User is already in the event', 'error')
+
+
+def task_column(event, status):
+    """ Return the cards of a page of the event's tasks in a status, cached
+        until one of them changes
+    """
+    cursor = request.args.get('after')
+
+    def render_column():
+        tasks, next_cursor = keyset_page(Task.query.filter_by(event_id=event.id, status=status),
+                                         Task, cursor)
+        return render_template(CARD_TEMPLATES[status], event=event, tasks=tasks,
+                               next_cursor=next_cursor)
+
+    return fragments.cached(fragments.tasks_group(event.id, status), cursor, render_column)
+
+
+@main.route('/<event_name>/dashboard', strict_slashes=False, methods=['GET', 'POST'])
+@login_required
+@event_role_required('organizer')
+def dashboard(event):
     """ Renders the event dashboard page, showing new tasks """
-    if current_user.is_confirmed is False:
-        return redirect(url_for('verify_required'))
-    image_file = url_for('static', filename='profile_pics/' + current_user.image_file)
-    event = Event.query.filter_by(name=event_name).first()
-
-    if not event:
-        flash('Event not found', 'error')
-        return redirect(url_for('home'))
-    if current_user not in event.organizer:
-        flash('You are not authorized to view this page', 'error')
-        return redirect(url_for('home'))
-    tasks = Task.query.filter_by(event_id=event.id, status='new').all()
+    column = task_column(event, 'new')
+    if request.args.get('partial'):
+        return column
 
     form = AddUserToEventForm()
     if form.validate_on_submit():
-        user = User.query.filter_by(email=form.email.data).first()
-        organizers = event.organizer
+        add_user_to_event(form, event)
 
-        if user not in organizers:
-            event.organizer.append(user)
-            if form.role.data == 'organizer':
-                db.session.commit()
-                flash('User added as an organizer', 'success')
-            elif form.role.data == 'manager':
-                event.managers.append(user)
-                db.session.commit()
-                flash('User added as a manager', 'success')
+    image_file = picture_url('profile', current_user.image_file, 'avatar')
+    return render_template('dashboard.html', image_file=image_file, event=event,
+                            column=column, form=form, page_title="Tasks")
+
+
+@main.route('/<event_name>/dashboard/invite', strict_slashes=False, methods=['GET', 'POST'])
+@login_required
+@event_role_required('organizer')
+def invite_users(event):
+    """ Renders the bulk add form, and adds a roster of users to the event """
+    form = BulkInviteForm()
+    image_file = picture_url('profile', current_user.image_file, 'avatar')
+    report = None
+    if form.validate_on_submit():
+        roster = form.emails.data or ''
+        if form.roster.data:
+            roster += '\n' + form.roster.data.read().decode('utf-8-sig', errors='replace')
+        entries = invites.parse_roster(roster, form.role.data)
+        if len(entries) > invites.MAX_ENTRIES:
+            flash('Add at most {} users at once'.format(invites.MAX_ENTRIES), 'error')
         else:
-            flash('User is already in the event', 'error')
+            report = invites.add_users(event.id, entries)
+            added = sum(1 for _, _, result in report if result == invites.ADDED)
+            flash('Added {} of {} user(s)'.format(added, len(report)),
+                  'success' if added == len(report) else 'error')
 
-    return render_template('dashboard.html', image_file=image_file, event=event,
-                            tasks=tasks, form=form, page_title="Tasks")
+    return render_template('invite_users.html', image_file=image_file, event=event,
+                           form=form, report=report, page_title="Add Users")
 
 
-@app.route('/<event_name>/dashboard/pendingreview', strict_slashes=False, methods=['GET', 'POST'])
+@main.route('/<event_name>/dashboard/pendingreview', strict_slashes=False, methods=['GET', 'POST'])
 @login_required
-def dashboard_review(event_name: str):
+@event_role_required('organizer')
+def dashboard_review(event):
     """ Renders the event dashboard page, showing new tasks """
-    if current_user.is_confirmed is False:
-        return redirect(url_for('verify_required'))
-    image_file = url_for('static', filename='profile_pics/' + current_user.image_file)
-    event = Event.query.filter_by(name=event_name).first()
-
-    if not event:
-        flash('Event not found', 'error')
-        return redirect(url_for('home'))
-    if current_user not in event.organizer:
-        flash('You are not authorized to view this page', 'error')
-        return redirect(url_for('home'))
-    tasks = Task.query.filter_by(event_id=event.id, status='review').all()
+    column = task_column(event, 'review')
+    if request.args.get('partial'):
+        return column
 
     form = AddUserToEventForm()
     if form.validate_on_submit():
-        user = User.query.filter_by(email=form.email.data).first()
-        organizers = event.organizer
-
-        if user not in organizers:
-            event.organizer.append(user)
-            if form.role.data == 'organizer':
-                db.session.commit()
-                flash('User added as an organizer', 'success')
-            elif form.role.data == 'manager':
-                event.managers.append(user)
-                db.session.commit()
-                flash('User added as a manager', 'success')
-        else:
-            flash('User is already in the event', 'error')
+        add_user_to_event(form, event)
 
-    return render_template('pending_review.html', image_file=image_file,
-                            event=event, tasks=tasks, form=form, page_title="Pending Review")
+    image_file = picture_url('profile', current_user.image_file, 'avatar')
+    return render_template('pending_review.html', image_file=image_file, event=event,
+                            column=column, form=form, page_title="Pending Review")
 
 
-@app.route('/<event_name>/dashboard/done', strict_slashes=False, methods=['GET', 'POST'])
+@main.route('/<event_name>/dashboard/done', strict_slashes=False, methods=['GET', 'POST'])
 @login_required
-def dashboard_done(event_name: str):
+@event_role_required('organizer')
+def dashboard_done(event):
     """ Renders the event dashboard page, showing new tasks """
-    if current_user.is_confirmed is False:
-        return redirect(url_for('verify_required'))
-    image_file = url_for('static', filename='profile_pics/' + current_user.image_file)
-    event = Event.query.filter_by(name=event_name).first()
-
-    if not event:
-        flash('Event not found', 'error')
-        return redirect(url_for('home'))
-    if current_user not in event.organizer:
-        flash('You are not authorized to view this page', 'error')
-        return redirect(url_for('home'))
-    tasks = Task.query.filter_by(event_id=event.id, status='done').all()
+    column = task_column(event, 'done')
+    if request.args.get('partial'):
+        return column
 
     form = AddUserToEventForm()
     if form.validate_on_submit():
-        user = User.query.filter_by(email=form.email.data).first()
-        organizers = event.organizer
-
-        if user not in organizers:
-            event.organizer.append(user)
-            if form.role.data == 'organizer':
-                db.session.commit()
-                flash('User added as an organizer', 'success')
-            elif form.role.data == 'manager':
-                event.managers.append(user)
-                db.session.commit()
-                flash('User added as a manager', 'success')
-        else:
-            flash('User is already in the event', 'error')
+        add_user_to_event(form, event)
 
+    image_file = picture_url('profile', current_user.image_file, 'avatar')
     return render_template('done.html', image_file=image_file, event=event,
-                            tasks=tasks, form=form, page_title="Done")
+                            column=column, form=form, page_title="Done")
+
+
+@main.route('/<event_name>/board', strict_slashes=False)
+@login_required
+@event_role_required('organizer', message='You are not authorized to view this board', api=True)
+def board(event):
+    """ Return the event's task board as JSON.
+
+        All columns (or the ones listed in ?status=new,review) come from a
+        single query, and the per-status counts from one grouped query, so
+        a client can refresh the whole board in one round-trip.
+
+        Each column holds at most ?limit= tasks, in (created_at, id) order;
+        cursors[status] is the ?after= to pass, with ?status= set to that
+        single column, to get its next page (null once it is complete).
+    """
+    statuses = request.args.get('status')
+    statuses = statuses.split(',') if statuses else list(TASK_STATUSES)
+    if any(status not in TASK_STATUSES for status in statuses):
+        return jsonify(error='Unknown task status'), 400
+    limit = min(request.args.get('limit', PAGE_SIZE, type=int), 100)
+    if limit < 1:
+        return jsonify(error='Invalid limit'), 400
+
+    counts = dict.fromkeys(TASK_STATUSES, 0)
+    counts.update(db.session.query(Task.status, func.count(Task.id))
+                  .filter(Task.event_id == event.id).group_by(Task.status).all())
+    conditions = [Task.event_id == event.id, Task.status.in_(statuses)]
+    if request.args.get('after'):
+        condition = after(request.args['after'], Task)
+        if condition is None or len(statuses) != 1:
+            return jsonify(error='Invalid cursor'), 400
+        conditions.append(condition)
+    # Number the tasks of each column to cut every column at limit + 1 rows
+    # in the same query
+    position = func.row_number().over(partition_by=Task.status,
+                                      order_by=(Task.created_at, Task.id)).label('position')
+    ranked = db.session.query(Task.id, position).filter(*conditions).subquery()
+    tasks = TASK.query(ranked.c.position <= limit + 1) \
+        .join(ranked, ranked.c.id == Task.id) \
+        .order_by(Task.status, Task.created_at, Task.id).all()
+
+    pages = {status: [] for status in statuses}
+    for task in tasks:
+        pages[task.status].append(task)
+    columns, cursors = {}, {}
+    for status, page in pages.items():
+        columns[status] = TASK.rows(page[:limit])
+        cursors[status] = encode_cursor(page[limit - 1]) if len(page) > limit else None
+
+    return jsonify(event=event.name, counts=counts, columns=columns, cursors=cursors)
+
+
+@main.route('/<event_name>/tasks', strict_slashes=False)
+@login_required
+@event_role_required('organizer', message='You are not authorized to view these tasks', api=True)
+def list_tasks(event):
+    """ Return all the event's tasks (or the ones with ?status=) as a JSON
+        array, streamed straight from the database rows.
+    """
+    criteria = [Task.event_id == event.id]
+    status = request.args.get('status')
+    if status:
+        if status not in TASK_STATUSES:
+            return jsonify(error='Unknown task status'), 400
+        criteria.append(Task.status == status)
+    rows = TASK.query(*criteria).order_by(Task.created_at, Task.id).yield_per(500)
+
+    return Response(stream_with_context(TASK.stream(rows)), mimetype='application/json')
+
+
+@main.route('/<event_name>/live', strict_slashes=False)
+@login_required
+@event_role_required('organizer', message='You are not authorized to follow this event', api=True)
+def live_tasks(event):
+    """ Stream the event's task changes as Server-Sent Events """
+    hub = live.get_hub()
+    if hub.count() >= current_app.config.get('LIVE_MAX_STREAMS', 10000):
+        return jsonify(error='Too many live dashboards, refresh by hand'), 503
+    # The stream may stay open for hours: do not hold a connection for it
+    db.session.remove()
+    heartbeat = current_app.config.get('LIVE_HEARTBEAT_SECONDS', 15)
+    response = Response(live.stream(hub, live.channel_of(event.id), heartbeat),
+                        mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@main.route('/<event_name>/dashboard/<task_id>/card', strict_slashes=False)
+@login_required
+@event_role_required('organizer')
+def task_card(event, task_id):
+    """ Render the card of a single task, for the live dashboards """
+    task = Task.query.filter_by(id=task_id, event_id=event.id).first()
+    if task is None:
+        return '', 404
+    return render_template(CARD_TEMPLATES[task.status], event=event, tasks=[task],
+                           next_cursor=None)
 
 
-@app.route('/<event_name>/dashboard/create_task', strict_slashes=False , methods=['GET', 'POST'])
+@main.route('/<event_name>/dashboard/create_task', strict_slashes=False , methods=['GET', 'POST'])
 @login_required
-def create_task(event_name):
+@event_role_required('organizer')
+def create_task(event):
     """ Renders the Create Task form """
-    if current_user.is_confirmed is False:
-        return redirect(url_for('verify_required'))
     form = CreateTaskForm()
-    image_file = url_for('static', filename='profile_pics/' + current_user.image_file)
-    event = Event.query.filter_by(name=event_name).first()
-    if not event:
-        flash('Event not found', 'error')
-        return redirect(url_for('home'))
-    if current_user not in event.organizer:
-        flash('You are not authorized to view this page', 'error')
-        return redirect(url_for('home'))
+    image_file = picture_url('profile', current_user.image_file, 'avatar')
     if form.validate_on_submit():
         task = Task(name=form.name.data, description=form.description.data, event_id=event.id)
         db.session.add(task)
         db.session.commit()
         flash('Task created successfully', 'success')
-        return redirect(url_for('dashboard', event_name=event_name))
+        return redirect(url_for('main.dashboard', event_name=event.name))
 
     return render_template('create_task.html', image_file=image_file, event=event,
                             form=form, page_title="Create Task")
 
 
-@app.route('/<event_name>/dashboard/<task_id>/review', strict_slashes=False)
+@main.route('/<event_name>/dashboard/import', strict_slashes=False, methods=['GET', 'POST'])
 @login_required
-def review_task(event_name, task_id):
-    """ Move task to pending review """
-    if current_user.is_confirmed is False:
-        return redirect(url_for('verify_required'))
-    event = Event.query.filter_by(name=event_name).first()
-    if not event:
-        flash('Event not found', 'error')
-        return redirect(url_for('home'))
-    if current_user not in event.organizer:
-        flash('You are not authorized to do this action', 'error')
-        return redirect(url_for('home'))
-    task = Task.query.filter_by(id=task_id).first()
-    if task is None:
-        flash('There is no such task', 'error')
-        return redirect(url_for('dashboard'))
-    task.status = 'review'
-    task.updated_at = task.reviewed_at = datetime.now()
-    db.session.commit()
-    return redirect(url_for('dashboard_review', event_name=event.name))
+@event_role_required('organizer')
+def import_tasks(event):
+    """ Renders the task import form, and imports an uploaded CSV/JSONL file """
+    form = ImportTasksForm()
+    image_file = picture_url('profile', current_user.image_file, 'avatar')
+    report = None
+    if form.validate_on_submit():
+        upload = form.tasks.data
+        stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', errors='replace',
+                                  newline='')
+        report = task_transfer.import_tasks(event.id, stream,
+                                            task_transfer.format_of(upload.filename))
+        flash('Imported {} task(s), rejected {}'.format(report.imported, report.rejected),
+              'error' if report.rejected else 'success')
+        if not report.rejected:
+            return redirect(url_for('main.dashboard', event_name=event.name))
 
+    return render_template('import_tasks.html', image_file=image_file, event=event,
+                           form=form, report=report, page_title="Import Tasks")
 
-@app.route('/<event_name>/dashboard/<task_id>/done', strict_slashes=False)
+
+@main.route('/<event_name>/dashboard/export', strict_slashes=False)
 @login_required
-def done_task(event_name, task_id):
-    """ Mark task as done """
-    if current_user.is_confirmed is False:
-        return redirect(url_for('verify_required'))
-    event = Event.query.filter_by(name=event_name).first()
-    if not event:
-        flash('Event not found', 'error')
-        return redirect(url_for('home'))
-    if current_user not in event.organizer:
-        flash('You are not authorized to do this action', 'error')
-        return redirect(url_for('home'))
-    task = Task.query.filter_by(id=task_id).first()
-    if task is None:
-        flash('There is no such task', 'error')
-        return redirect(url_for('dashboard'))
-    task.status = 'done'
-    task.updated_at = datetime.now()
+@event_role_required('organizer')
+def export_tasks(event):
+    """ Stream the event's tasks as a CSV or JSON lines download """
+    fmt = request.args.get('format', 'csv')
+    if fmt not in task_transfer.FORMATS:
+        flash('Unknown export format', 'error')
+        return redirect(url_for('main.dashboard', event_name=event.name))
+    response = Response(stream_with_context(task_transfer.export_tasks(event.id, fmt)),
+                        mimetype='text/csv' if fmt == 'csv' else 'application/x-ndjson')
+    response.headers['Content-Disposition'] = 'attachment; filename="{}-tasks.{}"'.format(
+        secure_filename(event.name) or 'event', fmt)
+    return response
+
+
+@main.route('/<event_name>/dashboard/analytics', strict_slashes=False)
+@login_required
+@event_role_required('organizer')
+@primary
+def analytics(event):
+    """ Renders the event's task analytics, from its summary tables """
+    image_file = picture_url('profile', current_user.image_file, 'avatar')
+    # What this process still buffers, e.g. the organizer's last moves; read
+    # from the primary, which holds them right away
+    activity.flush()
+    stats, throughput, latest = activity.event_summary(event.id)
+    cycle_times = {}
+    if stats:
+        for column in ('reviewed', 'done'):
+            count = getattr(stats, column)
+            cycle_times[column] = timedelta(
+                seconds=getattr(stats, column + '_seconds') // count) if count else None
+
+    return render_template('analytics.html', image_file=image_file, event=event, stats=stats,
+                           cycle_times=cycle_times, throughput=throughput, latest=latest,
+                           busiest=max((day.done for day in throughput), default=0),
+                           page_title="Analytics")
+
+
+def transition_task(event, task_id, action):
+    """ Apply a transition to one task as it is now, return whether it did """
+    outcome = transitions.apply(event.id, {task_id: None}, action)
     db.session.commit()
-    return redirect(url_for('dashboard_done', event_name=event.name))
+    if outcome.missing:
+        flash('There is no such task', 'error')
+    elif outcome.conflicts:
+        flash('The task was changed meanwhile, please try again', 'error')
+    return task_id in outcome.succeeded
 
 
-@app.route('/<event_name>/dashboard/<task_id>/delete', strict_slashes=False)
+@main.route('/<event_name>/dashboard/<task_id>/review', strict_slashes=False)
 @login_required
-def delete_task(event_name, task_id):
+@event_role_required('organizer', message='You are not authorized to do this action')
+@primary
+def review_task(event, task_id):
+    """ Move task to pending review """
+    if not transition_task(event, task_id, 'review'):
+        return redirect(url_for('main.dashboard', event_name=event.name))
+    return redirect(url_for('main.dashboard_review', event_name=event.name))
+
+
+@main.route('/<event_name>/dashboard/<task_id>/done', strict_slashes=False)
+@login_required
+@event_role_required('organizer', message='You are not authorized to do this action')
+@primary
+def done_task(event, task_id):
     """ Mark task as done """
-    if current_user.is_confirmed is False:
-        return redirect(url_for('verify_required'))
-    event = Event.query.filter_by(name=event_name).first()
-    if not event:
-        flash('Event not found', 'error')
-        return redirect(url_for('home'))
-    if current_user not in event.organizer:
-        flash('You are not authorized to do this action', 'error')
-        return redirect(url_for('home'))
-    task = Task.query.filter_by(id=task_id).first()
-    if task is None:
-        flash('There is no such task', 'error')
-        return redirect(url_for('dashboard'))
-    Task.query.filter_by(id=task_id).delete()
+    if not transition_task(event, task_id, 'done'):
+        return redirect(url_for('main.dashboard', event_name=event.name))
+    return redirect(url_for('main.dashboard_done', event_name=event.name))
+
+
+@main.route('/<event_name>/dashboard/<task_id>/delete', strict_slashes=False)
+@login_required
+@event_role_required('organizer', message='You are not authorized to do this action')
+@primary
+def delete_task(event, task_id):
+    """ Delete task """
+    if not transition_task(event, task_id, transitions.DELETE):
+        return redirect(url_for('main.dashboard', event_name=event.name))
+    return redirect(url_for('main.dashboard_done', event_name=event.name))
+
+
+@main.route('/<event_name>/tasks/transition', strict_slashes=False, methods=['POST'])
+@login_required
+@event_role_required('organizer', message='You are not authorized to do this action', api=True)
+@primary
+def bulk_transition(event):
+    """ Move tasks of the event to a status, or delete them, in one go.
+
+        The JSON body is {"action": "review", "tasks": {"<id>": <version>,
+        ...}}, with an action of new, review, done or delete and the
+        version each task had when it was read (from /board or the
+        data-version of its card); the X-CSRFToken header carries the
+        token of the page's csrf-token meta tag.
+
+        Answers {"succeeded": {id: new version, null when deleted},
+        "conflicts": {id: {"status", "version"}}, "missing": [id]}: a task
+        changed since it was read is left as it is and listed with what it
+        is now, to be reviewed and sent again.
+    """
+    if current_app.config.get('WTF_CSRF_ENABLED', True):
+        try:
+            validate_csrf(request.headers.get('X-CSRFToken'))
+        except ValidationError as error:
+            return jsonify(error=str(error)), 400
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or body.get('action') not in transitions.ACTIONS:
+        return jsonify(error='Unknown action'), 400
+    versions = body.get('tasks')
+    if not isinstance(versions, dict) or not versions or \
+            any(type(version) is not int for version in versions.values()):
+        return jsonify(error='tasks must map task ids to versions'), 400
+    if len(versions) > transitions.MAX_TASKS:
+        return jsonify(error='At most {} tasks at once'.format(transitions.MAX_TASKS)), 400
+
+    outcome = transitions.apply(event.id, versions, body['action'])
     db.session.commit()
-    return redirect(url_for('dashboard_done', event_name=event.name))
+    return jsonify(succeeded=outcome.succeeded, conflicts=outcome.conflicts,
+                   missing=outcome.missing)
 
 
-@app.route('/create_event', strict_slashes=False, methods=['GET', 'POST'])
+@main.route('/create_event', strict_slashes=False, methods=['GET', 'POST'])
 @login_required
 def create_event():
     """ Render the Create Event form """
     if current_user.is_confirmed is False:
-        return redirect(url_for('verify_required'))
+        return redirect(url_for('main.verify_required'))
     form = CreateEventForm()
     if form.validate_on_submit():
-        event = Event(name=form.name.data, description=form.description.data,
-                    location=form.location.data, date=form.date.data,
-                    time=form.time.data, organizer=[current_user], managers=[current_user])
-        if form.picture.data:
-            picture_file = save_picture(form.picture.data, event=True)
-            event.image_file = picture_file
-
-        db.session.add(event)
-        db.session.commit()
-        flash('Event created successfully', 'success')
-        return redirect(url_for('home'))
+        try:
+            picture_file = save_picture(form.picture.data, event=True) \
+                if form.picture.data else None
+        except InvalidPicture:
+            form.picture.errors.append(INVALID_PICTURE)
+        else:
+            event = Event(name=form.name.data, description=form.description.data,
+                        location=form.location.data, date=form.date.data,
+                        time=form.time.data, organizer=[current_user], managers=[current_user])
+            if picture_file:
+                event.image_file = picture_file
+
+            db.session.add(event)
+            db.session.commit()
+            flash('Event created successfully', 'success')
+            return redirect(url_for('main.home'))
 
-    image_file = url_for('static', filename='profile_pics/' + current_user.image_file)
-    event_image_file = url_for('static', filename='event_pics/' + current_user.image_file)
-    return render_template('create_event.html', image_file=image_file, event_image_file=event_image_file,
+    image_file = picture_url('profile', current_user.image_file, 'avatar')
+    return render_template('create_event.html', image_file=image_file,
                             form=form, page_title="Create Event")
 
 
-def save_picture(form_picture, event=False, new_width=800, new_height=800):
-    """ Compress pictures and save them """
-    random_hex = secrets.token_hex(8)
-    _, f_ext = os.path.splitext(form_picture.filename)
-    picture_fn = random_hex + f_ext
-    path = 'static/profile_pics' if not event else 'static/event_pics'
-    picture_path = os.path.join(app.root_path, path, picture_fn)
-    output_size = (512, 512)
-    i = Image.open(form_picture)
-    i.thumbnail(output_size)
-    i.save(picture_path)
+@main.route('/search', strict_slashes=False)
+@login_required
+def search_everything():
+    """ Return the tasks, events and committees matching ?q= that the user
+        may see, best matches first, as JSON; url is null for the events
+        the user does not organize
+    """
+    query = request.args.get('q', '')
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    results = search.search(current_user.id, query, limit)
+    # The event pages are for organizers: managers and attendees get no link
+    roles = event_roles_many(current_user.id, {result['event_id'] for result in results})
+    for result in results:
+        result['url'] = url_for('main.dashboard', event_name=result['event']) \
+            if 'organizer' in roles[result['event_id']] else None
+
+    return jsonify(query=query, results=results)
+
 
-    return picture_fn
+@main.route('/metrics', strict_slashes=False)
+def export_metrics():
+    """ Serve this process' metrics to Prometheus """
+    token = current_app.config.get('METRICS_TOKEN')
+    if token and not secrets.compare_digest(request.headers.get('Authorization', ''),
+                                            'Bearer ' + token):
+        return jsonify(error='Unauthorized'), 401
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 
-@app.route('/profile', strict_slashes=False, methods=['GET', 'POST'])
+@main.route('/cities', strict_slashes=False)
+@login_required
+def cities_autocomplete():
+    """ Returns the cities whose English or Arabic name starts with ?q= """
+    limit = min(request.args.get('limit', 10, type=int), 50)
+    cities = search_cities(request.args.get('q', ''), limit)
+    response = jsonify([city._asdict() for city in cities])
+    response.cache_control.max_age = 24 * 3600
+    return response
+
+
+@main.route('/media/<kind>/<filename>', strict_slashes=False)
+def media(kind, filename):
+    """ Serves the stored pictures """
+    return send_picture(kind, filename)
+
+
+@main.route('/assets/<path:filename>', strict_slashes=False)
+def asset(filename):
+    """ Serves the fingerprinted build of the static files """
+    return send_asset(filename)
+
+
+@main.route('/profile', strict_slashes=False, methods=['GET', 'POST'])
 @login_required
 def profile():
     """ Renders the profile page """
     if current_user.is_confirmed is False:
-        return redirect(url_for('verify_required'))
+        return redirect(url_for('main.verify_required'))
     form = UpdateProfileForm()
     if form.validate_on_submit():
-        if form.picture.data:
-            picture_file = save_picture(form.picture.data)
-            current_user.image_file = picture_file
-        current_user.first_name = form.first_name.data
-        current_user.last_name = form.last_name.data
-        if current_user.email != form.email.data: 
-            current_user.email = form.email.data
-            current_user.is_confirmed = False
-        db.session.commit()
-        flash('Your profile has been updated!', 'success')
-        return redirect(url_for('profile'))
+        try:
+            picture_file = save_picture(form.picture.data) if form.picture.data else None
+        except InvalidPicture:
+            form.picture.errors.append(INVALID_PICTURE)
+        else:
+            if picture_file:
+                release('profile', current_user.image_file)
+                current_user.image_file = picture_file
+            current_user.first_name = form.first_name.data
+            current_user.last_name = form.last_name.data
+            if current_user.email != form.email.data: 
+                current_user.email = form.email.data
+                current_user.is_confirmed = False
+                # A link mailed to the previous address must not confirm this one
+                tokens.revoke(current_user.id, tokens.VERIFY)
+            db.session.commit()
+            flash('Your profile has been updated!', 'success')
+            return redirect(url_for('main.profile'))
     elif request.method == 'GET':
         form.first_name.data = current_user.first_name
         form.last_name.data = current_user.last_name
         form.email.data = current_user.email
 
-    image_file = url_for('static', filename='profile_pics/' + current_user.image_file)
-    return render_template('profile.html', image_file=image_file, form=form, page_title="Profile")
-
-
-from event_plaza.send_email import SendEmail
+    image_file = picture_url('profile', current_user.image_file, 'avatar')
+    profile_image = picture_url('profile', current_user.image_file, 'large')
+    return render_template('profile.html', image_file=image_file, profile_image=profile_image,
+                           form=form, page_title="Profile")
 
 
 def send_reset_email(user):
-    """ Method to send reset password emails """
-    token = user.get_reset_token()
+    """ Method to send reset password emails; the caller commits """
+    token = tokens.issue(user.id, tokens.RESET)
     subject = 'EventPlaza - Password Reset Request'
-    sender = 'noreply@demo.com'
     recipient = user.email
     body = f'''<strong>To reset your password, visit the following link:</strong>
     <br>
-    {url_for('reset_token', token=token, _external=True)}
+    {url_for('main.reset_token', token=token, _external=True)}
     <br>
     If you did not make this request, ignore this email and no changes will be made.'''
-    SendEmail(sender, recipient, subject, body)
+    enqueue_email(recipient, subject, body)
 
 
 def send_verify_email(user):
-    """ Method to send email verifications """
-    token = user.email_token
+    """ Method to send email verifications; the caller commits """
+    token = tokens.issue(user.id, tokens.VERIFY)
     subject = 'EventPlaza - Email Verification'
-    sender = 'noreply@demo.com'
     recipient = user.email
     body = f'''<h2>Hi {user.first_name}!</h2>
     <br>
     <strong>To verify your account, visit the following link:</strong>
     <br>
-    {url_for('verify_email', token=token, _external=True)}
+    {url_for('main.verify_email', token=token, _external=True)}
     <br>
     If you did not make this request, please ignore this email.'''
-    SendEmail(sender, recipient, subject, body)
+    enqueue_email(recipient, subject, body)
 
 
-@app.route("/reset_password", methods=['GET', 'POST'], strict_slashes=False)
+@main.route("/reset_password", methods=['GET', 'POST'], strict_slashes=False)
 def reset_request():
     """ Request a password reset.
     
         PASSWORD RESET LOGIC:
-        A token that contains the user_id (serialized) is generated and
-        sent to the user's email address.
-        When the user clicks on the link with the token. The application
-        checks which user_id was serialized into this token and gives access
-        to update the password accordingly.    
+        A random token is generated, its hash stored with the user_id (see
+        tokens.py) and the token sent to the user's email address.
+        When the user clicks on the link with the token, the application
+        looks its hash up and gives access to update the password of that
+        user accordingly; the token then stops working.
     """
     if current_user.is_authenticated:
         if current_user.is_confirmed is False:
-            return redirect(url_for('verify_required'))
+            return redirect(url_for('main.verify_required'))
         flash('You are already logged in. Log out to reset your password.', 'success')
-        return redirect(url_for('home'))
+        return redirect(url_for('main.home'))
     form = RequestResetForm()
     if form.validate_on_submit():
-        with app.app_context():
-            user = User.query.filter_by(email=form.email.data).first()
+        user = user_by_email(form.email.data)
         send_reset_email(user)
+        db.session.commit()
         flash('An email has been sent with the link to reset your password.', 'success')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     return render_template('reset_request.html', form=form, page_title="Reset Password",
                             landing_layout=True)
 
 
-@app.route("/reset_password/<token>", methods=['GET', 'POST'], strict_slashes=False)
+@main.route("/reset_password/<token>", methods=['GET', 'POST'], strict_slashes=False)
+@primary
 def reset_token(token):
     """ Check if the reset token is legit.
         If it is, give let the user change his password
     """
     if current_user.is_authenticated:
         if current_user.is_confirmed is False:
-            return redirect(url_for('verify_required'))
+            return redirect(url_for('main.verify_required'))
         flash('You are already logged in. Log out to reset your password.', 'success')
-        return redirect(url_for('home'))
-    user = User.verify_reset_token(token)
+        return redirect(url_for('main.home'))
+    user = tokens.find(token, tokens.RESET)
     if user is None:
         flash('That is an invalid or expired token', 'error')
-        return redirect(url_for('reset_request'))
+        return redirect(url_for('main.reset_request'))
     form = ResetPasswordForm()
     if form.validate_on_submit():
-        hashed_password = bcrypt.generate_password_hash(form.password.data).decode('utf-8')
+        # Used up by another request since it was found
+        user = tokens.redeem(token, tokens.RESET)
+        if user is None:
+            flash('That is an invalid or expired token', 'error')
+            return redirect(url_for('main.reset_request'))
+        hashed_password = hash_password(form.password.data)
         user.password = hashed_password
         db.session.commit()
         flash('Your password has been updated! You are now able to log in', 'success')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     return render_template('reset_token.html', form=form, page_title="Reset Password",
                             landing_layout=True)
 
 
-@app.route("/verify/<token>", methods=['GET', 'POST'], strict_slashes=False)
+@main.route("/verify/<token>", methods=['GET', 'POST'], strict_slashes=False)
+@primary
 def verify_email(token):
     """ Verify that the token is legit.
         If it is, mark this user's email as confirmed.
@@ -455,19 +740,19 @@ def verify_email(token):
     if current_user.is_authenticated:
         if current_user.is_confirmed:
             flash('Your email is already verified.', 'success')
-            return redirect(url_for('home'))
-    user = User.query.filter_by(email_token=token).first()
-    if user and user.verify_email_token(token):
+            return redirect(url_for('main.home'))
+    user = tokens.redeem(token, tokens.VERIFY)
+    if user:
         user.is_confirmed = True
         db.session.commit()
         flash('Your email is now verified!', 'success')
     else:
         flash('That is an invalid token. Please log in again to verify your email.', 'error')
-        return redirect(url_for('landing'))
-    return redirect(url_for('landing'))
+        return redirect(url_for('main.landing'))
+    return redirect(url_for('main.landing'))
 
 
-@app.route("/verify", methods=['GET', 'POST'], strict_slashes=False)
+@main.route("/verify", methods=['GET', 'POST'], strict_slashes=False)
 @login_required
 def verify_required():
     """ After successful signup, the user can log in,
@@ -477,26 +762,23 @@ def verify_required():
         he verifies his email.
         
         EMAIL VERIFICATION LOGIC:
-        Every user has an attribute $(email_token), that gets updated
-        to a random 32-byte hex token every time the user needs to verify
-        his email.
+        A new random token (see tokens.py) is issued every time the user
+        needs to verify his email, which revokes the previous one.
         Whenever the user sign up for the first time or change his email
         address in profile settings, he should verify the new email address.
-        The token is sent to his address. Every time the user's email changes
-        the token gets regenerated.
+        The token is sent to his address, and expires after two days.
     """
     if current_user.is_confirmed:
         flash('Your email is already verified.', 'success')
-        return redirect(url_for('home'))
+        return redirect(url_for('main.home'))
     form = VerifyEmailForm()
     if form.validate_on_submit():
         if form.email.data != current_user.email:
             current_user.email = form.email.data
-        current_user.email_token = secrets.token_hex(32)    
-        db.session.commit()
         send_verify_email(current_user)
+        db.session.commit()
         flash('We sent a verification link to your email.', 'success')
-        return redirect(url_for('landing'))
+        return redirect(url_for('main.landing'))
     elif request.method == 'GET':
         form.email.data = current_user.email
     return render_template('verify_email.html', form=form, page_title="Verify Email",
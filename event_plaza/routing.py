@@ -0,0 +1,99 @@
+#!/usr/bin/python3
+""" Read/write routing between the primary database and its replicas.
+
+    With DB_REPLICA_URIS set, the SELECTs of GET and HEAD requests go to one
+    of the replicas (the same one for the whole request). Everything else
+    stays on the primary:
+      - other methods, and views marked with @primary;
+      - any statement once the request has written something;
+      - every request of a client for DB_PRIMARY_PIN_SECONDS after it wrote,
+        so that the page it is redirected to shows what it just did even if
+        the replicas lag a little;
+      - the reads made inside reading_primary(), such as the renders of the
+        cached fragments, which other clients are served afterwards;
+      - anything outside of a request (CLI commands, outbox workers).
+"""
+import time
+import random
+from contextlib import contextmanager
+from functools import wraps
+from flask import current_app, g, has_request_context, request, session as web_session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event as sa_event
+
+
+READ_METHODS = ('GET', 'HEAD')
+PIN_KEY = '_db_primary_until'
+
+
+def replica_binds(config):
+    """ Return the bind keys of the configured replicas """
+    return ['replica{}'.format(i) for i in range(len(config.get('DB_REPLICA_URIS') or ()))]
+
+
+def init_app(app):
+    """ Register the replicas as binds; call before db.init_app(app) """
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    binds.update(zip(replica_binds(app.config), app.config.get('DB_REPLICA_URIS') or ()))
+    app.config['SQLALCHEMY_BINDS'] = binds
+    if binds:
+        app.after_request(_pin_after_write)
+
+
+def primary(view):
+    """ Decorator for the GET views that write: read from the primary too """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.db_primary = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+@contextmanager
+def reading_primary():
+    """ Send the reads of the block to the primary """
+    if not has_request_context():
+        yield
+        return
+    previous = g.get('db_primary')
+    g.db_primary = True
+    try:
+        yield
+    finally:
+        g.db_primary = previous
+
+
+def _reads_from_replica():
+    return has_request_context() and request.method in READ_METHODS \
+        and not g.get('db_primary') and web_session.get(PIN_KEY, 0) <= time.time()
+
+
+class RoutingSession(Session):
+    """ A Flask-SQLAlchemy session that sends reads to a replica when it can """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and not self.info.get('wrote') \
+                and getattr(clause, 'is_select', False) and _reads_from_replica():
+            binds = replica_binds(current_app.config)
+            if binds:
+                key = self.info.setdefault('replica', random.choice(binds))
+                return self._db.engines[key]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@sa_event.listens_for(RoutingSession, 'after_flush')
+def _flushed(session, context):
+    session.info['wrote'] = True
+
+
+@sa_event.listens_for(RoutingSession, 'do_orm_execute')
+def _executing(state):
+    if not state.is_select:
+        state.session.info['wrote'] = True
+
+
+def _pin_after_write(response):
+    from event_plaza import db
+    if db.session.info.get('wrote'):
+        web_session[PIN_KEY] = time.time() + current_app.config.get('DB_PRIMARY_PIN_SECONDS', 5)
+    return response
@@ -0,0 +1,179 @@
+#!/usr/bin/python3
+""" Full-text search over tasks, events and committees.
+
+    The search_documents table holds the searchable text of every object.
+    It is kept in step by mapper events, in the same flush as the change,
+    and queried through MySQL's FULLTEXT index or SQLite's FTS5. Results
+    only include what the caller may see: tasks and committees of the
+    events they organize, and the events they have any role in.
+
+    Only the MAX_CANDIDATES most recent matches are ranked, and whole
+    words are tried before prefixes, so a query over a million documents
+    stays within tens of milliseconds however common its words are
+    (benchmarks/search.py; about 1 to 35 ms on SQLite).
+"""
+import re
+from sqlalchemy import event as sa_event, inspect, text, bindparam, delete, select
+from event_plaza import db
+from event_plaza.models import Task, Event, Committee
+from event_plaza.models.keys import Key
+from event_plaza.models.search_document import search_documents
+
+
+MAX_TERMS = 8
+
+# kind: (model, title attribute, body attributes)
+SOURCES = {
+    'task': (Task, 'name', ('description',)),
+    'event': (Event, 'name', ('description', 'location')),
+    'committee': (Committee, 'name', ('description',)),
+}
+
+# Tasks and committees need the organizer role, events any role
+PERMITTED = """(
+    d.event_id IN (SELECT event_id FROM event_organizers WHERE user_id = :user_id)
+    OR (d.kind = 'event' AND d.event_id IN (
+        SELECT event_id FROM event_managers WHERE user_id = :user_id
+        UNION SELECT event_id FROM event_attendens WHERE user_id = :user_id)))"""
+
+# Matches ranked per query: the most recently indexed ones the user may
+# see (highest search_documents.id, which both queries order by). bm25
+# and MATCH ... AGAINST score every row they are given, so bounding the
+# rows keeps a common word about as fast as a rare one
+MAX_CANDIDATES = 500
+
+QUERIES = {
+    'mysql': """
+        SELECT kind, object_id, event_id, title, score FROM (
+            SELECT d.kind, d.object_id, d.event_id, d.title,
+                   MATCH (d.title, d.body) AGAINST (:match IN BOOLEAN MODE) AS score
+            FROM search_documents d
+            WHERE MATCH (d.title, d.body) AGAINST (:match IN BOOLEAN MODE) AND {permitted}
+            ORDER BY d.id DESC LIMIT :candidates) AS candidates
+        ORDER BY score DESC LIMIT :limit""",
+    # bm25() is lower for better matches
+    'sqlite': """
+        SELECT kind, object_id, event_id, title, score FROM (
+            SELECT d.kind, d.object_id, d.event_id, d.title,
+                   -bm25(search_fts, 4.0, 1.0) AS score
+            FROM search_fts JOIN search_documents d ON d.id = search_fts.rowid
+            WHERE search_fts MATCH :match AND {permitted}
+            ORDER BY search_fts.rowid DESC LIMIT :candidates) AS candidates
+        ORDER BY score DESC LIMIT :limit""",
+    # Unranked scan, for databases without a full-text index
+    'default': """
+        SELECT d.kind, d.object_id, d.event_id, d.title, 0 AS score
+        FROM search_documents d
+        WHERE (d.title LIKE :match OR d.body LIKE :match) AND {permitted}
+        LIMIT :limit""",
+}
+
+
+def terms(query):
+    """ Return the words of a query, without any search operator """
+    return re.findall(r'\w+', query)[:MAX_TERMS]
+
+
+def _match(dialect, words, prefix=True):
+    suffix = '*' if prefix else ''
+    if dialect == 'mysql':
+        return ' '.join('+{}{}'.format(word, suffix) for word in words)
+    if dialect == 'sqlite':
+        return ' '.join('"{}"{}'.format(word, suffix) for word in words)
+    return '%{}%'.format(' '.join(words))
+
+
+def document(kind, target):
+    """ Return the search_documents row of an object """
+    _, title, body = SOURCES[kind]
+    return {'kind': kind, 'object_id': target.id,
+            'event_id': target.id if kind == 'event' else target.event_id,
+            'title': getattr(target, title),
+            'body': '\n'.join(filter(None, (getattr(target, name) for name in body)))}
+
+
+def index_documents(connection, documents):
+    """ Add or replace rows of search_documents """
+    if not documents:
+        return
+    for kind in {row['kind'] for row in documents}:
+        ids = [row['object_id'] for row in documents if row['kind'] == kind]
+        connection.execute(delete(search_documents).where(search_documents.c.kind == kind,
+                                                          search_documents.c.object_id.in_(ids)))
+    connection.execute(search_documents.insert(), documents)
+
+
+def search(user_id, query, limit=20):
+    """ Return the best matches of a query the user may see, as dicts """
+    words = terms(query)
+    if not words:
+        return []
+    dialect = db.session.get_bind().dialect.name
+    statement = text(QUERIES.get(dialect, QUERIES['default']).format(permitted=PERMITTED)) \
+        .bindparams(bindparam('user_id', type_=Key())) \
+        .columns(kind=db.String, object_id=Key(), event_id=Key(), title=db.String, score=db.Float)
+    parameters = {'user_id': user_id, 'limit': limit, 'candidates': MAX_CANDIDATES}
+    rows = []
+    if dialect in ('mysql', 'sqlite'):
+        # Whole words first: a prefix makes the index merge the lists of all
+        # the words it starts, the whole list for a common one
+        rows = db.session.execute(statement, {'match': _match(dialect, words, prefix=False),
+                                              **parameters}).all()
+    if len(rows) < limit:
+        rows = db.session.execute(statement, {'match': _match(dialect, words),
+                                              **parameters}).all()
+    names = dict(db.session.execute(select(Event.id, Event.name)
+                                    .where(Event.id.in_({row.event_id for row in rows}))).all()) \
+        if rows else {}
+    return [{'kind': row.kind, 'id': row.object_id, 'title': row.title,
+             'event_id': row.event_id, 'event': names.get(row.event_id),
+             'score': float(row.score)} for row in rows]
+
+
+def reindex(batch_size=1000):
+    """ Recreate search_documents (and SQLite's FTS5 table), so a change of
+        their schema is picked up, and fill it from the models; return the
+        number of rows
+    """
+    connection = db.session.connection()
+    search_documents.drop(connection, checkfirst=True)
+    search_documents.create(connection)
+    count = 0
+    for kind, (model, _, _) in SOURCES.items():
+        batch = []
+        for target in model.query.yield_per(batch_size):
+            batch.append(document(kind, target))
+            if len(batch) == batch_size:
+                index_documents(db.session.connection(), batch)
+                count, batch = count + len(batch), []
+        index_documents(db.session.connection(), batch)
+        count += len(batch)
+    db.session.commit()
+    return count
+
+
+def _indexed_changed(kind, target):
+    _, title, body = SOURCES[kind]
+    state = inspect(target)
+    return any(state.attrs[name].history.has_changes() for name in (title, 'event_id', *body)
+               if name in state.attrs)
+
+
+def _listen(kind, model):
+    @sa_event.listens_for(model, 'after_insert')
+    def inserted(mapper, connection, target):
+        index_documents(connection, [document(kind, target)])
+
+    @sa_event.listens_for(model, 'after_update')
+    def updated(mapper, connection, target):
+        if _indexed_changed(kind, target):
+            index_documents(connection, [document(kind, target)])
+
+    @sa_event.listens_for(model, 'after_delete')
+    def deleted(mapper, connection, target):
+        connection.execute(delete(search_documents).where(
+            search_documents.c.kind == kind, search_documents.c.object_id == target.id))
+
+
+for _kind, (_model, _, _) in SOURCES.items():
+    _listen(_kind, _model)
@@ -1,17 +1,17 @@
-import httplib2
 import os
-import oauth2client
-from oauth2client import client, tools, file
 import base64
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
-from apiclient import errors, discovery
+# The Google clients are imported by the Gmail functions only, so that the
+# MIME helpers work without them (the outbox's SMTP and file transports)
 
 SCOPES = 'https://www.googleapis.com/auth/gmail.send'
 CLIENT_SECRET_FILE = 'client_secret.json'
 APPLICATION_NAME = 'Gmail API Python Send Email'
 
 def get_credentials():
+    import oauth2client
+    from oauth2client import client, tools, file
     home_dir = os.path.expanduser('~')
     credential_dir = os.path.join(home_dir, '.credentials')
     if not os.path.exists(credential_dir):
@@ -26,14 +26,21 @@ def get_credentials():
         print('Storing credentials to ' + credential_path)
     return credentials
 
-def SendMessage(sender, to, subject, msgHtml, msgPlain):
+def GetService():
+    import httplib2
+    from apiclient import discovery
     credentials = get_credentials()
     http = credentials.authorize(httplib2.Http())
-    service = discovery.build('gmail', 'v1', http=http)
+    return discovery.build('gmail', 'v1', http=http)
+
+def SendMessage(sender, to, subject, msgHtml, msgPlain, service=None):
+    if service is None:
+        service = GetService()
     message1 = CreateMessage(sender, to, subject, msgHtml, msgPlain)
     SendMessageInternal(service, "me", message1)
 
 def SendMessageInternal(service, user_id, message):
+    from apiclient import errors
     try:
         message = (service.users().messages().send(userId=user_id, body=message).execute())
         # print('Message Id: %s' % message['id'])
@@ -41,13 +48,17 @@ def SendMessageInternal(service, user_id, message):
     except errors.HttpError as error:
         print('An error occurred: %s' % error)
 
-def CreateMessage(sender, to, subject, msgHtml, msgPlain):
+def CreateMimeMessage(sender, to, subject, msgHtml, msgPlain):
     msg = MIMEMultipart('alternative')
     msg['Subject'] = subject
     msg['From'] = sender
     msg['To'] = to
     msg.attach(MIMEText(msgPlain, 'plain'))
     msg.attach(MIMEText(msgHtml, 'html'))
+    return msg
+
+def CreateMessage(sender, to, subject, msgHtml, msgPlain):
+    msg = CreateMimeMessage(sender, to, subject, msgHtml, msgPlain)
     raw = base64.urlsafe_b64encode(msg.as_bytes())
     raw = raw.decode()
     body = {'raw': raw}
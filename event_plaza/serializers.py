@@ -0,0 +1,68 @@
+#!/usr/bin/python3
+""" Projection based JSON serialization.
+
+    BaseModel.to_dict copies a whole instance, whatever happens to be loaded
+    on it. A Projection instead names the columns a JSON output needs; its
+    query selects just those columns, and its rows are turned into dicts
+    without ever building ORM objects. The work of looking at the column
+    types is done once, when the projection is declared.
+"""
+import json
+from sqlalchemy import DateTime
+from event_plaza import db
+from event_plaza.models import Task, Event
+from event_plaza.models.base_model import time as TIME_FORMAT
+
+
+def _datetime(value):
+    return value.strftime(TIME_FORMAT) if value is not None else None
+
+
+class Projection():
+    """ The fields of a model to serialize, and how """
+
+    def __init__(self, model, *fields):
+        self.model = model
+        self.fields = fields
+        self.columns = [getattr(model, field) for field in fields]
+        # (position, converter) of the fields that are not JSON as they are
+        self._converters = tuple(
+            (position, _datetime) for position, column in enumerate(self.columns)
+            if isinstance(column.type, DateTime))
+
+    def query(self, *criteria):
+        """ Return a query of the projected columns, as row tuples """
+        return db.session.query(*self.columns).filter(*criteria)
+
+    def row(self, row):
+        """ Return the dict of a row of the projection's query """
+        if self._converters:
+            row = list(row)
+            for position, converter in self._converters:
+                row[position] = converter(row[position])
+        return dict(zip(self.fields, row))
+
+    def rows(self, rows):
+        return [self.row(row) for row in rows]
+
+    def stream(self, rows, batch=500):
+        """ Yield a JSON array of the rows piece by piece, so large results
+            never sit in memory as a whole.
+        """
+        encode = json.JSONEncoder(ensure_ascii=False).encode
+        yield '['
+        chunk, first = [], True
+        for row in rows:
+            chunk.append(encode(self.row(row)))
+            if len(chunk) == batch:
+                yield ('' if first else ',') + ','.join(chunk)
+                chunk, first = [], False
+        if chunk:
+            yield ('' if first else ',') + ','.join(chunk)
+        yield ']'
+
+
+TASK = Projection(Task, 'id', 'name', 'description', 'status', 'event_id',
+                  'created_at', 'updated_at', 'version')
+EVENT = Projection(Event, 'id', 'name', 'description', 'location', 'date', 'time',
+                   'image_file', 'created_at')
@@ -0,0 +1,19 @@
+#!/usr/bin/python3
+""" SQL statements the dialects spell differently """
+from event_plaza import db
+
+
+def insert_ignore(table, rows, connection=None):
+    """ Insert rows in one statement, skipping the ones already there """
+    if not rows:
+        return
+    statement = table.insert().values(rows)
+    dialect = (connection or db.session.get_bind()).dialect.name
+    if dialect == 'mysql':
+        statement = statement.prefix_with('IGNORE')
+    elif dialect == 'sqlite':
+        statement = statement.prefix_with('OR IGNORE')
+    elif dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        statement = insert(table).values(rows).on_conflict_do_nothing()
+    (connection or db.session).execute(statement)
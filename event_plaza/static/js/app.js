@@ -187,6 +187,136 @@ if (dropzone) {
       };
     }
 }
+
+const city_input = doc.querySelector('[data-autocomplete="cities"]');
+const city_list = doc.getElementById('cities');
+
+if (city_input && city_list) {
+    let city_timer;
+
+    city_input.addEventListener('input', () => {
+
+        // ask the server for matching cities once the user stops typing
+        clearTimeout(city_timer);
+        city_timer = setTimeout(() => {
+            const query = city_input.value.trim();
+            if (!query) {
+                return;
+            }
+            fetch(city_list.dataset.source + '?q=' + encodeURIComponent(query))
+                .then(response => response.json())
+                .then(cities => {
+                    city_list.replaceChildren(...cities.map(city => {
+                        const option = doc.createElement('option');
+                        option.value = city.name_en;
+                        option.label = city.name_ar;
+                        return option;
+                    }));
+                });
+        }, 150);
+
+    });
+}
+
+doc.addEventListener('click', event => {
+    const link = event.target.closest('[data-load-more] a');
+    if (!link) {
+        return;
+    }
+
+    // fetch only the next cards and append them in place of the button
+    event.preventDefault();
+    const url = new URL(link.href);
+    url.searchParams.set('partial', '1');
+    fetch(url)
+        .then(response => response.text())
+        .then(html => {
+            link.closest('[data-load-more]').outerHTML = html;
+        });
+});
+
+const live_board = doc.querySelector('[data-live]');
+
+if (live_board && win.EventSource) {
+    const status = live_board.dataset.status;
+    const source = new EventSource(live_board.dataset.live);
+    let reconnecting = false;
+    let reload_timer;
+
+    const card_of = task => live_board.querySelector('[data-task-id="' + task.id + '"]');
+
+    const add_card = task => {
+        const more = live_board.querySelector('[data-load-more]');
+        const cards = live_board.querySelectorAll('[data-task-id]');
+        // past the loaded cards, it comes with "Load more"
+        if (card_of(task) || (more && cards.length
+                && task.created_at > cards[cards.length - 1].dataset.created)) {
+            return;
+        }
+        fetch(live_board.dataset.card.replace('TASK_ID', task.id))
+            .then(response => response.ok ? response.text() : '')
+            .then(html => {
+                const template = doc.createElement('template');
+                template.innerHTML = html.trim();
+                const card = template.content.firstElementChild;
+                if (!card || card_of(task)) {
+                    return;
+                }
+                const next = [...live_board.querySelectorAll('[data-task-id]')]
+                    .find(other => other.dataset.created > card.dataset.created);
+                live_board.insertBefore(card, next || live_board.querySelector('[data-load-more]'));
+            });
+    };
+
+    const remove_card = task => {
+        const card = card_of(task);
+        if (card) {
+            card.remove();
+        }
+    };
+
+    const on = (type, handler) => source.addEventListener(type, message => {
+        handler(JSON.parse(message.data));
+    });
+
+    on('task.created', message => {
+        if (message.task.status === status) {
+            add_card(message.task);
+        }
+    });
+    on('task.moved', message => {
+        if (message.task.status === status) {
+            add_card(message.task);
+        } else {
+            remove_card(message.task);
+        }
+    });
+    on('task.updated', message => {
+        if (card_of(message.task)) {
+            remove_card(message.task);
+            add_card(message.task);
+        }
+    });
+    on('task.deleted', message => remove_card(message.task));
+    const reload_soon = () => {
+        // imports and bulk transitions come in batches, reload once they settle
+        clearTimeout(reload_timer);
+        reload_timer = setTimeout(() => win.location.reload(), 1000);
+    };
+    on('tasks.imported', reload_soon);
+    on('tasks.changed', reload_soon);
+
+    // updates sent while disconnected are lost, start over
+    source.addEventListener('error', () => {
+        reconnecting = true;
+    });
+    source.addEventListener('open', () => {
+        if (reconnecting) {
+            win.location.reload();
+        }
+    });
+}
+
 // There must be a cleaner way
 
 var add_people_toggle = document.getElementById('add_people_toggle');
@@ -0,0 +1,152 @@
+#!/usr/bin/python3
+""" Bulk import and export of an event's tasks, as CSV or JSON lines.
+
+    Both directions stream: an import reads, validates and inserts the rows
+    in batches (one executemany and one commit per batch), and an export
+    reads the tasks through a server-side cursor, so neither holds more
+    than a batch of tasks in memory whatever the size of the event.
+"""
+import io
+import csv
+import json
+from datetime import datetime
+from collections import namedtuple
+from event_plaza import db
+from event_plaza.models import Task, TASK_STATUSES
+from event_plaza.models.base_model import time as TIME_FORMAT
+from event_plaza.models.keys import new_id
+from event_plaza.serializers import Projection
+from event_plaza.search import index_documents
+from event_plaza import activity, live, fragments
+
+
+FORMATS = ('csv', 'jsonl')
+FIELDS = ('name', 'description', 'status', 'created_at')
+BATCH_SIZE = 1000
+MAX_ERRORS = 100
+
+TRANSFER = Projection(Task, *FIELDS)
+ImportReport = namedtuple('ImportReport', ['imported', 'rejected', 'errors'])
+
+
+class InvalidRow(ValueError):
+    """ Raised for a row that can not become a task """
+
+
+def format_of(filename, default='csv'):
+    """ Guess the format of a file from its name """
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    return extension if extension in FORMATS else default
+
+
+def read_rows(stream, fmt):
+    """ Yield (line number, dict) for every record of a text stream """
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield number, None
+            continue
+        yield number, row if isinstance(row, dict) else None
+
+
+def validate(row):
+    """ Return the column values of a task from an imported row """
+    if row is None:
+        raise InvalidRow('not a JSON object')
+    name = row.get('name') or ''
+    if not isinstance(name, str) or not 2 <= len(name.strip()) <= 128:
+        raise InvalidRow('name must be between 2 and 128 characters')
+    name = name.strip()
+    description = row.get('description') or None
+    if description is not None and not isinstance(description, str):
+        raise InvalidRow('description must be text')
+    if description is not None and len(description) > 1024:
+        raise InvalidRow('description is longer than 1024 characters')
+    status = row.get('status') or 'new'
+    if not isinstance(status, str) or status not in TASK_STATUSES:
+        raise InvalidRow('unknown status {!r}'.format(status))
+    created_at = row.get('created_at')
+    try:
+        created_at = datetime.strptime(created_at, TIME_FORMAT) if created_at else datetime.now()
+    except (TypeError, ValueError):
+        raise InvalidRow('created_at must look like 2024-01-31T18:00:00')
+    return {'name': name, 'description': description, 'status': status,
+            'created_at': created_at}
+
+
+def _insert(event_id, batch):
+    now = datetime.now()
+    for values in batch:
+        values.update(id=new_id(), event_id=event_id, updated_at=now, reviewed_at=now)
+    db.session.execute(Task.__table__.insert(), batch)
+    # Core inserts skip the mapper events that index tasks for search and
+    # log their activity
+    index_documents(db.session.connection(), [
+        {'kind': 'task', 'object_id': values['id'], 'event_id': event_id,
+         'title': values['name'], 'body': values['description']} for values in batch])
+    activity.record(db.session, [activity.entry(values['id'], event_id, 'create',
+                                                to_status=values['status'], now=now)
+                                 for values in batch])
+    live.publish_after_commit(db.session, event_id,
+                              {'type': 'tasks.imported', 'count': len(batch)})
+    fragments.bump(db.session, *{fragments.tasks_group(event_id, values['status'])
+                                 for values in batch})
+    db.session.commit()
+
+
+def import_tasks(event_id, stream, fmt='csv', batch_size=BATCH_SIZE):
+    """ Add the tasks of a CSV or JSON lines text stream to an event.
+
+        Invalid rows are skipped and reported (up to MAX_ERRORS of them);
+        every batch of valid rows is committed on its own, so a failure
+        midway keeps the batches already imported.
+    """
+    imported = rejected = 0
+    errors = []
+    batch = []
+    for number, row in read_rows(stream, fmt):
+        try:
+            batch.append(validate(row))
+        except InvalidRow as error:
+            rejected += 1
+            if len(errors) < MAX_ERRORS:
+                errors.append((number, str(error)))
+            continue
+        if len(batch) == batch_size:
+            _insert(event_id, batch)
+            imported += len(batch)
+            batch = []
+    if batch:
+        _insert(event_id, batch)
+        imported += len(batch)
+    return ImportReport(imported, rejected, errors)
+
+
+def export_tasks(event_id, fmt='csv', batch_size=BATCH_SIZE):
+    """ Yield the event's tasks as CSV or JSON lines text, a batch at a time """
+    rows = TRANSFER.query(Task.event_id == event_id) \
+        .order_by(Task.created_at, Task.id) \
+        .execution_options(stream_results=True, yield_per=batch_size)
+    buffer = io.StringIO()
+    if fmt == 'csv':
+        writer = csv.writer(buffer)
+        writer.writerow(FIELDS)
+        write = lambda record: writer.writerow(record.values())
+    else:
+        encode = json.JSONEncoder(ensure_ascii=False).encode
+        write = lambda record: buffer.write(encode(record) + '\n')
+    for count, row in enumerate(rows, 1):
+        write(TRANSFER.row(row))
+        if count % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
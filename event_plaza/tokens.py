@@ -0,0 +1,164 @@
+#!/usr/bin/python3
+""" Single-use tokens mailed to users: email verification and password reset.
+
+    A token is a random URL-safe string; only its SHA-256 hash is stored,
+    in auth_tokens, under a unique index, so redeeming one is a single
+    index lookup whatever the number of users, and a leaked table does not
+    give working links away. Each token has a purpose and an expiry
+    (LIFETIMES); issuing a new one for a purpose revokes the user's
+    previous ones.
+
+    Expired rows are deleted in batches by a sweeper thread started by the
+    first process that issues a token, every TOKEN_SWEEP_SECONDS (0 leaves
+    it to `flask tokens-sweep`, e.g. from cron).
+"""
+import secrets
+import hashlib
+import threading
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import delete, select, update
+from event_plaza import db
+from event_plaza.models import AuthToken, User
+from event_plaza.models.keys import new_id
+from event_plaza.lookups import user_by_id
+
+
+VERIFY = 'verify'
+RESET = 'reset'
+LIFETIMES = {
+    VERIFY: timedelta(days=2),
+    RESET: timedelta(minutes=30),
+}
+# What users.email_token holds once cleared
+LEGACY_EMPTY = 'NOT INIT'
+
+
+def digest(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def issue(user_id, purpose):
+    """ Add a new token of a user to the session and return it; the
+        caller commits
+    """
+    token = secrets.token_urlsafe(32)
+    now = datetime.now()
+    revoke(user_id, purpose)
+    db.session.add(AuthToken(token_hash=digest(token), user_id=user_id, purpose=purpose,
+                             expires_at=now + LIFETIMES[purpose]))
+    start_sweeper(current_app._get_current_object())
+    return token
+
+
+def find(token, purpose):
+    """ Return the user a valid token of this purpose was issued to, or None """
+    row = db.session.execute(
+        select(AuthToken.user_id, AuthToken.expires_at)
+        .where(AuthToken.token_hash == digest(token), AuthToken.purpose == purpose)).first()
+    if row is None or row.expires_at < datetime.now():
+        return None
+    return user_by_id(row.user_id)
+
+
+def redeem(token, purpose):
+    """ Return the user of a valid token and revoke every token of theirs
+        for this purpose (the caller commits), or return None.
+
+        The token is deleted by its hash before anything else: of two
+        requests redeeming it at once, only the one whose delete took the
+        row gets the user.
+    """
+    user = find(token, purpose)
+    if user is None:
+        return None
+    result = db.session.execute(delete(AuthToken).where(AuthToken.token_hash == digest(token),
+                                                        AuthToken.purpose == purpose,
+                                                        AuthToken.expires_at >= datetime.now()))
+    if result.rowcount != 1:
+        return None
+    revoke(user.id, purpose)
+    return user
+
+
+def revoke(user_id, purpose):
+    """ Delete every token of a user for this purpose; the caller commits """
+    db.session.execute(delete(AuthToken).where(AuthToken.user_id == user_id,
+                                               AuthToken.purpose == purpose))
+
+
+def sweep(batch_size=1000):
+    """ Delete the expired tokens, batch_size at a time, and return how
+        many were deleted
+    """
+    deleted = 0
+    while True:
+        expired = db.session.scalars(
+            select(AuthToken.id).where(AuthToken.expires_at < datetime.now())
+            .order_by(AuthToken.expires_at).limit(batch_size)).all()
+        if expired:
+            db.session.execute(delete(AuthToken).where(AuthToken.id.in_(expired)))
+        db.session.commit()
+        deleted += len(expired)
+        if len(expired) < batch_size:
+            return deleted
+
+
+def migrate_legacy(batch_size=1000):
+    """ Move the verification tokens still stored in users.email_token to
+        auth_tokens (valid for LIFETIMES[VERIFY] from now) and clear the
+        column. Return how many were moved.
+    """
+    moved = 0
+    while True:
+        rows = db.session.execute(
+            select(User.id, User.email_token, User.is_confirmed)
+            .where(User.email_token != LEGACY_EMPTY).limit(batch_size)).all()
+        expires_at = datetime.now() + LIFETIMES[VERIFY]
+        pending = [{'id': new_id(), 'token_hash': digest(token), 'user_id': user_id,
+                    'purpose': VERIFY, 'expires_at': expires_at, 'created_at': datetime.now(),
+                    'updated_at': datetime.now()}
+                   for user_id, token, confirmed in rows if not confirmed]
+        if pending:
+            db.session.execute(AuthToken.__table__.insert(), pending)
+        if rows:
+            db.session.execute(update(User).where(User.id.in_([row.id for row in rows]))
+                               .values(email_token=LEGACY_EMPTY)
+                               .execution_options(synchronize_session=False))
+        db.session.commit()
+        moved += len(pending)
+        if len(rows) < batch_size:
+            return moved
+
+
+class TokenSweeper(threading.Thread):
+    """ The thread deleting the expired tokens of the database """
+
+    def __init__(self, app):
+        super().__init__(daemon=True, name='token-sweeper')
+        self.app = app
+        self.stop = threading.Event()
+
+    def run(self):
+        interval = self.app.config.get('TOKEN_SWEEP_SECONDS', 3600)
+        while not self.stop.wait(interval):
+            try:
+                with self.app.app_context():
+                    sweep(self.app.config.get('TOKEN_SWEEP_BATCH', 1000))
+            except Exception:
+                self.app.logger.exception('Sweeping the expired tokens failed')
+
+
+_sweeper = None
+_sweeper_lock = threading.Lock()
+
+
+def start_sweeper(app):
+    """ Start the sweeper once per process, unless TOKEN_SWEEP_SECONDS is 0 """
+    global _sweeper
+    if _sweeper is not None or app.config.get('TOKEN_SWEEP_SECONDS', 3600) <= 0:
+        return
+    with _sweeper_lock:
+        if _sweeper is None:
+            _sweeper = TokenSweeper(app)
+            _sweeper.start()
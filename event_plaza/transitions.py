@@ -0,0 +1,189 @@
+#!/usr/bin/python3
+""" Moving and deleting many tasks at once, with optimistic concurrency.
+
+    Every task has a version, bumped by each change. A transition names
+    the tasks with the version the client last saw, and runs as a single
+    statement for the whole set:
+
+        UPDATE tasks SET status = ?, version = version + 1, ...
+        WHERE event_id = ? AND (id, version) IN ((?, ?), ...)
+
+    so a task changed by another organizer since it was read is left as it
+    is, and reported as a conflict with its current status and version
+    instead of being silently overwritten. The tasks are read once before,
+    by primary key, to tell conflicts and missing tasks apart and to log
+    the changes.
+
+    The statements bypass the ORM, so the search index, the activity log,
+    the live dashboards and the fragment cache are told here, as for the
+    imported tasks.
+"""
+from types import SimpleNamespace
+from datetime import datetime
+from collections import namedtuple
+from sqlalchemy import delete, select, tuple_, update
+from event_plaza import db
+from event_plaza.models import Task, TASK_STATUSES
+from event_plaza.models.task import assigns, task_attachments
+from event_plaza.models.keys import canonical
+from event_plaza.models.search_document import search_documents
+from event_plaza import activity, live, fragments
+
+
+DELETE = 'delete'
+ACTIONS = (*TASK_STATUSES, DELETE)
+# Most tasks a transition may name
+MAX_TASKS = 1000
+# Past this many tasks, live dashboards are told to reload once rather
+# than sent every card
+LIVE_CARDS = 20
+
+# succeeded: {id: new version, None once deleted}; conflicts: {id:
+# {'status', 'version'} as they are now}; missing: ids not in the event
+Outcome = namedtuple('Outcome', ['succeeded', 'conflicts', 'missing'])
+
+
+def _current(ids, event_id, latest=False):
+    """ Return the rows of the tasks; latest reads the rows committed since
+        the transaction began too (a plain SELECT on MySQL's REPEATABLE READ
+        still answers from the snapshot of the first read)
+    """
+    statement = select(Task.id, Task.name, Task.status, Task.version, Task.created_at,
+                       Task.reviewed_at).where(Task.event_id == event_id, Task.id.in_(ids))
+    if latest:
+        statement = statement.with_for_update()
+    return {row.id: row for row in db.session.execute(statement)}
+
+
+def _conflict(row):
+    return {'status': row.status, 'version': row.version}
+
+
+def apply(event_id, versions, action):
+    """ Move the tasks of an event to a status, or delete them, and return
+        the Outcome; the caller commits.
+
+        versions maps the id of each task to the version it is expected to
+        have, or to None to take it as it is now (single task views). The
+        Outcome names the tasks as versions does, however it spells them.
+    """
+    spelled = {canonical(task_id): task_id for task_id in versions}
+    outcome = _apply(event_id, {canonical(task_id): version
+                                for task_id, version in versions.items()}, action)
+    return Outcome({spelled[task_id]: version for task_id, version in outcome.succeeded.items()},
+                   {spelled[task_id]: now for task_id, now in outcome.conflicts.items()},
+                   [spelled[task_id] for task_id in outcome.missing])
+
+
+def _apply(event_id, versions, action):
+    rows = _current(list(versions), event_id)
+    succeeded, conflicts = {}, {}
+    missing = [task_id for task_id in versions if task_id not in rows]
+    expected = {}
+    for task_id, row in rows.items():
+        version = versions[task_id]
+        if version is not None and version != row.version:
+            conflicts[task_id] = _conflict(row)
+        elif row.status == action:
+            succeeded[task_id] = row.version
+        else:
+            expected[task_id] = row.version
+    if not expected:
+        return Outcome(succeeded, conflicts, missing)
+
+    now = datetime.now()
+    if action == DELETE:
+        changed = _delete(event_id, expected)
+    else:
+        changed = _update(event_id, expected, action, now)
+    lost = [task_id for task_id in expected if task_id not in changed]
+    if lost:
+        # Changed or deleted by another transaction between the read and the write
+        after = _current(lost, event_id, latest=True)
+        for task_id in lost:
+            if task_id in after:
+                conflicts[task_id] = _conflict(after[task_id])
+            else:
+                missing.append(task_id)
+    for task_id in changed:
+        succeeded[task_id] = None if action == DELETE else expected[task_id] + 1
+    if changed:
+        _changed(event_id, [rows[task_id] for task_id in changed], action, now)
+    return Outcome(succeeded, conflicts, missing)
+
+
+def _at(event_id, expected):
+    return (Task.event_id == event_id,
+            tuple_(Task.id, Task.version).in_(list(expected.items())))
+
+
+def _update(event_id, expected, action, now):
+    """ Move the tasks still at their expected version, return the ids moved """
+    values = {'status': action, 'version': Task.version + 1, 'updated_at': now}
+    if action == 'review':
+        values['reviewed_at'] = now
+    # Another transaction may have made the same move meanwhile, to the same
+    # status and version: only the moves of this one are to be logged
+    return _own(lambda at: update(Task).where(*_at(event_id, at)).values(**values), expected)
+
+
+def _delete(event_id, expected):
+    """ Delete the tasks still at their expected version, return the ids deleted """
+    # A deleted row does not tell who deleted it
+    return _own(lambda at: delete(Task).where(*_at(event_id, at)), expected)
+
+
+def _own(statement, expected):
+    """ Run the statement for the tasks at their expected version, return
+        the ids of the rows it changed itself
+    """
+    def run(at):
+        return db.session.execute(statement(at).execution_options(synchronize_session=False))
+
+    if len(expected) == 1:
+        # A single row was changed by this statement or not at all, no
+        # savepoint needed
+        return list(expected) if run(expected).rowcount else []
+    savepoint = db.session.begin_nested()
+    if run(expected).rowcount == len(expected):
+        savepoint.commit()
+        return list(expected)
+    # Short: start over one task at a time, keeping the rows each changed
+    savepoint.rollback()
+    return [task_id for task_id, version in expected.items() if run({task_id: version}).rowcount]
+
+
+def _changed(event_id, rows, action, now):
+    """ Do what the mapper events of the tasks would have done """
+    ids = [row.id for row in rows]
+    if action == DELETE:
+        for table in (assigns, task_attachments):
+            db.session.execute(delete(table).where(table.c.task_id.in_(ids)))
+        db.session.execute(delete(search_documents).where(search_documents.c.kind == 'task',
+                                                          search_documents.c.object_id.in_(ids)))
+        entries = [activity.entry(row.id, event_id, 'delete', from_status=row.status, now=now)
+                   for row in rows]
+    else:
+        entries = [activity.entry(row.id, event_id, action, row.status, action,
+                                  row.reviewed_at if row.status == 'review' else row.created_at,
+                                  now)
+                   for row in rows]
+    activity.record(db.session, entries)
+
+    if len(rows) > LIVE_CARDS:
+        live.publish_after_commit(db.session, event_id,
+                                  {'type': 'tasks.changed', 'count': len(rows)})
+    else:
+        for row in rows:
+            if action == DELETE:
+                message = live.task_message('task.deleted', row)
+            else:
+                moved = SimpleNamespace(**row._asdict())
+                moved.status = action
+                message = live.task_message('task.moved', moved, previous=row.status)
+            live.publish_after_commit(db.session, event_id, message)
+
+    statuses = {row.status for row in rows}
+    if action != DELETE:
+        statuses.add(action)
+    fragments.bump(db.session, *(fragments.tasks_group(event_id, status) for status in statuses))
@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
 """Run the application"""
-from event_plaza import app
+from event_plaza import create_app
+
+
+app = create_app()
 
 
 if __name__ == '__main__':